@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+import requests
+from dotenv import load_dotenv
+
+import config
+import util
+from webex import WebexDeviceAPI
+
+# Load in Environment Variables (optional bot token used to post alert messages, else the org's integration token)
+load_dotenv()
+WEBEX_BOT_TOKEN = os.getenv('WEBEX_BOT_TOKEN')
+
+# Display labels of the alert metrics (quality detector observation keys, see collector.call_quality_observation)
+ALERT_METRIC_LABELS = {'a_mos': 'Audio MOS', 'v_mos': 'Video MOS', 'a_pkt_loss_max': 'Audio Loss %',
+                       'v_pkt_loss_max': 'Video Loss %', 'a_jit_max': 'Audio Jitter', 'v_jit_max': 'Video Jitter'}
+
+# Calls already alerted are remembered this long (an active call is never alerted twice)
+ALERTED_CALL_RETENTION = timedelta(hours=24)
+
+# An active call and its call history entry are the same call if their start times are this close (the active call's
+# start is estimated from its duration, the two paths have different call ids)
+CALL_START_TOLERANCE = timedelta(minutes=1)
+
+
+class AlertEngine:
+    """
+    Call quality alert engine (one per org): calls breaching a threshold are deduplicated per call, debounced per device
+    and queued until the next digest
+    """
+
+    def __init__(self, org_id: str, thresholds: dict, debounce_minutes: int, max_alerts: int):
+        """
+        Initialize the alert engine
+        :param org_id: Org the alerts belong to
+        :param thresholds: Observation metric -> ('below' | 'above', threshold value)
+        :param debounce_minutes: Minimum time between two alerts of the same device
+        :param max_alerts: Maximum number of alerts listed in a digest (the rest are only counted)
+        """
+        self.org_id = org_id
+        self.thresholds = thresholds
+        self.debounce = timedelta(minutes=debounce_minutes)
+        self.max_alerts = max_alerts
+        self.lock = threading.Lock()
+
+        # Alerts waiting for the next digest, breaches suppressed by the device debounce (per device)
+        self.pending = []
+        self.suppressed = {}
+
+        # Last alert per device, alert time per (device_id, call_id), (call start, alert time) per device
+        self.last_alert = {}
+        self.alerted_calls = {}
+        self.alerted_starts = {}
+
+        # Digest each sink failed to deliver (sent again, merged with the next digest)
+        self.undelivered = {}
+
+    def breaches(self, observation: dict) -> list[str]:
+        """
+        Thresholds breached by a call observation
+        :param observation: Metric values (None if not measured)
+        :return: Breach descriptions (ex: 'Audio MOS 2.41 (below 3.0)')
+        """
+        breaches = []
+        for metric, (direction, threshold) in self.thresholds.items():
+            value = observation.get(metric)
+            if value is None:
+                continue
+
+            if (value < threshold) if direction == 'below' else (value > threshold):
+                label = ALERT_METRIC_LABELS.get(metric, metric)
+                breaches.append(f"{label} {round(value, 2)} ({direction} {threshold})")
+
+        return breaches
+
+    def evaluate(self, device_id: str, call_id: str, source: str, observation: dict, now: datetime | None = None,
+                 call_start: str | None = None) -> bool:
+        """
+        Check a call against the alert thresholds, queue an alert unless the call already alerted (same call id, or
+        same device and call start within CALL_START_TOLERANCE - an active call alerted before it reached the call
+        history) or the device is within its debounce period (the breach is then counted as suppressed)
+        :param device_id: Device ID
+        :param call_id: Call ID (call history id, or xAPI call id of an active call)
+        :param source: 'history' (completed call) or 'active' (in-progress call sample)
+        :param observation: Metric values (see collector.call_quality_observation, media_sample_observation)
+        :param now: Evaluation time (UTC, defaults to now)
+        :param call_start: Call start time (UTC, util.DB_TIME_FORMAT)
+        :return: True if an alert was queued
+        """
+        breaches = self.breaches(observation)
+        if not breaches:
+            return False
+
+        now = now or datetime.now(pytz.utc)
+        start = datetime.strptime(call_start, util.DB_TIME_FORMAT) if call_start else None
+        with self.lock:
+            if (device_id, call_id) in self.alerted_calls:
+                return False
+            if start and any(abs(start - alerted_start) <= CALL_START_TOLERANCE
+                             for alerted_start, _ in self.alerted_starts.get(device_id, [])):
+                return False
+            self.alerted_calls[(device_id, call_id)] = now
+            if start:
+                self.alerted_starts.setdefault(device_id, []).append((start, now))
+
+            last_alert = self.last_alert.get(device_id)
+            if last_alert and now - last_alert < self.debounce:
+                self.suppressed[device_id] = self.suppressed.get(device_id, 0) + 1
+                return False
+            self.last_alert[device_id] = now
+
+            self.pending.append({'device_id': device_id, 'call_id': call_id, 'source': source,
+                                 'time': now.strftime(util.DB_TIME_FORMAT), 'breaches': breaches})
+            return True
+
+    def take_digest(self, now: datetime | None = None) -> dict | None:
+        """
+        Remove the queued alerts and suppressed counts as one digest (and forget expired debounce / dedupe entries)
+        :param now: Digest time (UTC, defaults to now)
+        :return: Digest (org_id, time, alerts - at most max_alerts, total, omitted, suppressed, debounce_minutes),
+                 None if nothing to send
+        """
+        now = now or datetime.now(pytz.utc)
+        with self.lock:
+            pending, self.pending = self.pending, []
+            suppressed, self.suppressed = self.suppressed, {}
+
+            self.last_alert = {device_id: alert_time for device_id, alert_time in self.last_alert.items()
+                               if now - alert_time < self.debounce}
+            self.alerted_calls = {key: alert_time for key, alert_time in self.alerted_calls.items()
+                                  if now - alert_time < ALERTED_CALL_RETENTION}
+            self.alerted_starts = {device_id: recent for device_id, starts in self.alerted_starts.items()
+                                   if (recent := [(start, alert_time) for start, alert_time in starts
+                                                  if now - alert_time < ALERTED_CALL_RETENTION])}
+
+        if not pending and not suppressed:
+            return None
+
+        return {'org_id': self.org_id, 'time': now.strftime(util.DB_TIME_FORMAT), 'alerts': pending[:self.max_alerts],
+                'total': len(pending), 'omitted': max(len(pending) - self.max_alerts, 0),
+                'suppressed': sum(suppressed.values()), 'debounce_minutes': int(self.debounce.total_seconds() // 60)}
+
+    def requeue(self, sink: str, digest: dict):
+        """
+        Keep a digest a sink failed to deliver, it is merged into the sink's next digest (see sink_digest)
+        :param sink: Sink name (ALERT_SINKS entry)
+        :param digest: Undelivered digest
+        """
+        with self.lock:
+            self.undelivered[sink] = digest
+
+    def sink_digest(self, sink: str, digest: dict | None) -> dict | None:
+        """
+        Digest to send to a sink: the new digest, merged after the digest the sink failed to deliver last time (alerts
+        listed oldest first, at most max_alerts, the rest counted as omitted)
+        :param sink: Sink name (ALERT_SINKS entry)
+        :param digest: New digest (see take_digest), None if nothing new
+        :return: Digest, None if nothing to send
+        """
+        with self.lock:
+            undelivered = self.undelivered.pop(sink, None)
+
+        if undelivered is None or digest is None:
+            return digest or undelivered
+
+        listed = (undelivered['alerts'] + digest['alerts'])[:self.max_alerts]
+        total = undelivered['total'] + digest['total']
+        return dict(digest, alerts=listed, total=total, omitted=total - len(listed),
+                    suppressed=undelivered['suppressed'] + digest['suppressed'])
+
+
+def site_counts(digest: dict) -> dict[str, int]:
+    """
+    Number of listed alerts per site (largest first)
+    :param digest: Alert digest (alerts labeled with their site)
+    :return: Site -> alert count
+    """
+    counts = {}
+    for alert in digest['alerts']:
+        site = alert.get('site') or 'Unknown'
+        counts[site] = counts.get(site, 0) + 1
+
+    return dict(sorted(counts.items(), key=lambda item: item[1], reverse=True))
+
+
+def format_digest(digest: dict) -> str:
+    """
+    Markdown text of an alert digest (Webex message, log)
+    :param digest: Alert digest
+    :return: Markdown text
+    """
+    lines = [f"**Call Quality Alerts** ({digest['org_id']}, {digest['time']} UTC): {digest['total']} call(s) breached "
+             f"the alert thresholds"]
+
+    sites = site_counts(digest)
+    if sites:
+        lines.append("Sites: " + ", ".join(f"{site} ({count})" for site, count in sites.items()))
+
+    for alert in digest['alerts']:
+        call = 'active call' if alert['source'] == 'active' else 'call'
+        lines.append(f"- {alert.get('endpoint') or alert['device_id']} ({alert.get('site') or 'Unknown'}), {call} "
+                     f"{alert['call_id']}: {', '.join(alert['breaches'])}")
+
+    if digest['omitted']:
+        lines.append(f"... and {digest['omitted']} more call(s)")
+    if digest['suppressed']:
+        lines.append(f"{digest['suppressed']} further breach(es) suppressed (device alerted in the last "
+                     f"{digest['debounce_minutes']} minutes)")
+
+    return '\n'.join(lines)
+
+
+class LogSink:
+    """
+    Alert sink writing digests to the log
+    """
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+
+    def send(self, digest: dict) -> bool:
+        self.logger.warning(format_digest(digest))
+        return True
+
+
+class WebhookSink:
+    """
+    Alert sink posting digests as JSON to a generic webhook URL
+    """
+
+    def __init__(self, url: str, timeout: float, logger: logging.Logger):
+        self.url = url
+        self.timeout = timeout
+        self.logger = logger
+
+    def send(self, digest: dict) -> bool:
+        try:
+            response = requests.post(self.url, json=dict(digest, sites=site_counts(digest)), timeout=self.timeout)
+        except requests.RequestException as e:
+            self.logger.error(f"Failed to post alert digest to webhook {self.url}: {e}")
+            return False
+
+        if not response.ok:
+            self.logger.error(f"Failed to post alert digest to webhook {self.url}: {response.status_code} "
+                              f"{response.text}")
+        return response.ok
+
+
+class WebexMessageSink:
+    """
+    Alert sink posting digests as a Webex message to the alert room (bot token if configured, else the org's token)
+    """
+
+    def __init__(self, api: WebexDeviceAPI, room_id: str):
+        self.api = api
+        self.room_id = room_id
+        self.headers = {'Authorization': f'Bearer {WEBEX_BOT_TOKEN}'} if WEBEX_BOT_TOKEN else None
+
+    def send(self, digest: dict) -> bool:
+        body = {'roomId': self.room_id, 'markdown': format_digest(digest)}
+        return self.api.post_wrapper('messages', {}, body, headers=self.headers) is not None
+
+
+# Alert sinks selectable in ALERT_SINKS: name -> sink factory (called with the org's WebexDeviceAPI and a logger)
+ALERT_SINKS = {
+    'log': lambda api, logger: LogSink(logger),
+    'webhook': lambda api, logger: WebhookSink(config.ALERT_WEBHOOK_URL, config.ALERT_WEBHOOK_TIMEOUT, logger),
+    'webex': lambda api, logger: WebexMessageSink(api, config.ALERT_WEBEX_ROOM_ID)
+}
+
+
+def register_alert_sink(name: str, factory):
+    """
+    Register an alert sink (selectable in ALERT_SINKS)
+    :param name: Sink name
+    :param factory: Callable (api, logger) returning an object with a send(digest) -> bool method
+    """
+    ALERT_SINKS[name] = factory
+
+
+def create_alert_sinks(names: list[str], api: WebexDeviceAPI, logger: logging.Logger) -> list:
+    """
+    Create the configured alert sinks of an org
+    :param names: Sink names (ALERT_SINKS keys)
+    :param api: The org's WebexDeviceAPI instance
+    :param logger: Logger Object
+    :return: List of sinks
+    """
+    unknown = [name for name in names if name not in ALERT_SINKS]
+    if unknown:
+        raise ValueError(f"Unknown alert sinks {unknown} (available: {', '.join(ALERT_SINKS)})")
+
+    return [ALERT_SINKS[name](api, logger) for name in names]
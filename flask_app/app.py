@@ -18,23 +18,30 @@ __copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
 import copy
+import csv
+import gzip
+import hashlib
 import json
 import os
 import sqlite3
+import tempfile
 from datetime import datetime, timedelta
-from io import BytesIO
+from io import BytesIO, StringIO
 
+import numpy as np
 import pandas as pd
 import pytz
 import requests
+import xlsxwriter
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, render_template, request, Response, g, redirect, url_for, jsonify
+from flask import Flask, render_template, request, Response, g, redirect, url_for, jsonify, stream_with_context
 
+import collector
 import config
 import db
 import util
 from servicenow import ServiceNow
-from webex import WebexDeviceAPI, get_webex_token
+from webex import PRIORITY_BULK, WebexDeviceAPI, create_org_apis, request_schedulers
 
 # Absolute Paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -48,21 +55,46 @@ app.config['DATABASE'] = db_path
 logger = util.set_up_logging()
 logger_background = util.set_up_logging_background()
 
-# Get Valid Webex Access Token
-access_token = get_webex_token(logger)
-
-# Get instance of Device API Class (Main and Periodic Background Thread)
-device_api = WebexDeviceAPI(access_token, logger)
-device_api_background = WebexDeviceAPI(access_token, logger_background)
+# Get instances of Device API Class per Webex org, using each org's valid access token (Main: every org, Periodic
+# Background Thread: orgs assigned to this process)
+device_apis = create_org_apis(config.WEBEX_ORGS, logger)
+device_apis_background = create_org_apis(collector.assigned_orgs(), logger_background, PRIORITY_BULK)
 
 # Define Global Class Object (contains all API methods for SNOW)
 snow = ServiceNow(logger)
 
-# Background Scheduler, used to periodically query Webex Devices for 30 day calling history
+# Background Scheduler, used to periodically query Webex Devices for 30 day calling history (only started in the
+# process holding the scheduler lock, see collector.py)
 scheduler = BackgroundScheduler()
 
-# Room id for MOSS Value Alert Room (if feature is enabled)
-room_id = None
+# Response compression settings (only text payloads at least this large are gzipped)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/javascript', 'application/javascript'}
+COMPRESSION_MIN_SIZE = 500
+
+# Call quality analytics results per (grouping, window, org), memoized until the next device / call history sync (at
+# most CALL_QUALITY_CACHE_SIZE results)
+call_quality_cache = {'sync_state': None, 'results': {}}
+CALL_QUALITY_CACHE_SIZE = 256
+
+# Call quality chart results per (scope, window, points, raw series, org), memoized the same way. Series hold
+# CHART_DEFAULT_POINTS points unless requested otherwise (at most CHART_MAX_POINTS)
+chart_cache = {'sync_state': None, 'results': {}}
+CHART_CACHE_SIZE = 256
+CHART_DEFAULT_POINTS = 200
+CHART_MAX_POINTS = 1000
+
+# Raw per call chart series (LTTB downsampled): series name -> call_history column (worst stream of the call)
+CHART_RAW_SERIES = {'mos': 'mos', 'loss': 'pkt_loss_max', 'jitter': 'jit_max'}
+
+# Call report export columns (row key, column header), rows are streamed from the DB in batches of EXPORT_BATCH_SIZE
+CALL_REPORT_EXPORT_COLUMNS = [('endpoint', 'Endpoint'), ('region', 'Region'), ('site', 'Site'), ('ipAddr', 'IP Addr'),
+                              ('displayName', 'Display Name'), ('callbackNumber', 'Callback Number'),
+                              ('remoteNumber', 'Remote Number'), ('startTime', 'Start Time'), ('endTime', 'End Time'),
+                              ('duration', 'Duration'), ('disconnect_reason', 'Disconnect Type'),
+                              ('a_moss', 'A MOS Min'), ('v_moss', 'V MOS Min'), ('a_pkt_loss_max', 'A Loss Max'),
+                              ('v_pkt_loss_max', 'V Loss Max'), ('a_jit_max', 'A Jit Max'), ('v_jit_max', 'V Jit Max')]
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
 
 
 # Methods
@@ -82,7 +114,7 @@ def getSystemTimeAndLocation() -> str:
 
     # create info string
     location = geoData['country']
-    timezone = pytz.timezone(geoData['timezone'])
+    timezone = util.get_timezone(geoData['timezone'])
 
     current_time = datetime.now(timezone).strftime("%d %b %Y, %I:%M %p")
     timeAndLocation = "System Information: {}, {} (Timezone: {})".format(location, current_time, timezone)
@@ -90,121 +122,13 @@ def getSystemTimeAndLocation() -> str:
     return timeAndLocation
 
 
-def get_devices_periodically(api: WebexDeviceAPI):
+def get_org_api(org_id: str | None) -> WebexDeviceAPI:
     """
-    Get Webex Devices periodically and update the DB (runs every 5 minutes by default)
-    :param api: WebexDeviceAPI instance - get all devices, add to DB in the background)
+    Return the Device API instance of a Webex org (devices stored before multi-org support fall back to the first org)
+    :param org_id: Org name (org_id column of the device)
+    :return: WebexDeviceAPI instance for the org
     """
-    # Connection to DB (one-time)
-    conn = db.create_connection(app.config['DATABASE'])
-
-    # Get Device List
-    devices = api.get_all_devices(config.DEVICE_TYPE)
-
-    # Clear devices from table not returned in devices api call (no longer have xapi permission, removed, etc.)
-    new_device_ids = [device['id'] for device in devices]
-    current_device_ids = db.query_all_devices(conn, "device_id")
-    for device_id in current_device_ids:
-        if device_id[0] not in new_device_ids:
-            db.delete_old_device_entries(conn, device_id[0])
-
-    # Add devices to db
-    for device in devices:
-        # Enrich Device Details
-        device = enrich_device_fields(device)
-
-        # Add device to db
-        db.add_device_entries(conn, device)
-
-    db.close_connection(conn)
-
-
-def get_device_call_history_periodically(api: WebexDeviceAPI):
-    """
-    Get All Call history across all Webex Devices in the background (every X minutes, only retain calls younger than X days - both configured in config.py)
-    :param api: WebexDeviceAPI used to get call history for all devices, add to DB table
-    """
-    # Connection to DB (one-time)
-    conn = db.create_connection(app.config['DATABASE'])
-
-    # Get Device ID's List
-    device_ids = db.query_all_devices(conn, "device_id")
-    device_ids = [device_id[0] for device_id in device_ids]
-
-    # Get Call History for all devices
-    call_history = api.get_call_history(device_ids)
-
-    # Calculate x days ago (ensure only historical entries within x days saved)
-    x_days_ago = datetime.now(pytz.utc) - timedelta(days=config.CALL_HISTORY_MAX_PERIOD)
-
-    for device_id in call_history:
-        db.add_history_entries(conn, x_days_ago, call_history[device_id])
-
-    # Delete all entries older than 30 days (cleanup)
-    db.delete_old_call_entries(conn, x_days_ago)
-
-    # Close connection to DB
-    db.close_connection(conn)
-
-
-def enrich_device_fields(device: dict) -> dict:
-    """
-    Obtains additional fields and information about each device for webpage display (ex: location name given a location id)
-    :param device: Specific device, originally containing only native API fields
-    :return: "Enriched" device dictionary, additional fields added for further processing and displaying on dashboard
-    """
-    # Get Device Location Name (if possible)
-    if 'locationId' in device:
-        location_details = device_api.get_location_details(device['locationId'])
-        device['site'] = location_details.get('name', 'Unknown')
-        device['timeZone'] = location_details.get('timeZone', 'N/A')
-    else:
-        device['site'] = 'Unknown'
-        device['timeZone'] = 'N/A'
-
-    # Display friendly status
-    device['connectionStatus'] = device['connectionStatus'].capitalize()
-
-    if device['connectionStatus'] == 'Connected_with_issues':
-        device['connectionStatus'] = "Issues"
-    elif device['connectionStatus'] == 'Offline_expired':
-        device['connectionStatus'] = "Offline Expired"
-
-    # Determine 'mode' (and Workspace name if relevant)
-    if 'workspaceId' in device:
-        device['mode'] = 'Shared'
-
-        # Get workspace name
-        workspace_details = device_api.get_workspace_details(device['workspaceId'])
-
-        if workspace_details:
-            device['room'] = ''
-            device['email'] = ''
-
-            if 'displayName' in workspace_details:
-                device['room'] = workspace_details['displayName']
-
-            # Get mailbox info (if integration enabled and assigned)
-            if 'calendar' in workspace_details and workspace_details['calendar']['type'] != 'none':
-                device['email'] = workspace_details['calendar'].get('emailAddress', "Unknown")
-        else:
-            device['room'] = ''
-            device['email'] = ''
-    else:
-        # Personal mode
-        device['mode'] = 'Personal'
-        device['room'] = ''
-        device['email'] = ''
-
-    # Get Uptime
-    system_unit_information = device_api.get_system_unit_information(device['id'])
-    if 'Uptime' in system_unit_information:
-        uptime = system_unit_information['Uptime']
-        device['uptime'] = util.convert_seconds_to_time(uptime)
-    else:
-        device['uptime'] = 'Unknown'
-
-    return device
+    return device_apis.get(org_id) or next(iter(device_apis.values()))
 
 
 def lookup_device_details(api: WebexDeviceAPI, device_id: str) -> dict:
@@ -221,10 +145,13 @@ def lookup_device_details(api: WebexDeviceAPI, device_id: str) -> dict:
     device = api.get_device_details(device_id)
 
     # Enrich Device Details
-    device = enrich_device_fields(device)
+    device = collector.enrich_device_fields(api, device)
 
-    # Add device to db
-    db.add_device_entries(conn, device)
+    # Log state transitions, add device to db
+    previous_state = collector.query_device_states(conn, device_id=device_id).get(device_id)
+    collector.record_device_changes(conn, previous_state, device, api.org_id)
+    db.add_device_entries(conn, device, api.org_id)
+    db.update_sync_state(conn, 'devices')
 
     # Close connection to DB
     db.close_connection(conn)
@@ -232,17 +159,22 @@ def lookup_device_details(api: WebexDeviceAPI, device_id: str) -> dict:
     return device
 
 
-def get_system_unit_information(device_id: str, device: dict) -> dict:
+def get_system_unit_information(api: WebexDeviceAPI, device_id: str, device: dict) -> dict:
     """
     Get System Unit Information for Webex Device, enrich with additional fields for display
+    :param api: WebexDeviceAPI instance of the device's org
     :param device_id: Unique Webex Device ID
     :param device: Raw device information dictionary
     :return: Enriched system unit information for dashboard display
     """
     system_unit = {'site': device['site'], 'ip': device['ip']}
 
-    # Get System Unit Information
-    system_unit_information = device_api.get_system_unit_information(device_id)
+    # Get System Unit Information (skipped for offline devices, they can't answer xAPI calls)
+    if collector.is_offline(device['connectionStatus']):
+        api.skip_request()
+        system_unit_information = {}
+    else:
+        system_unit_information = api.get_system_unit_information(device_id)
 
     system_unit['type'] = system_unit_information.get('ProductType', '')
     system_unit['product'] = system_unit_information.get('ProductPlatform', '')
@@ -268,17 +200,25 @@ def get_system_unit_information(device_id: str, device: dict) -> dict:
     return system_unit
 
 
-def get_room_analytics(device_id: str) -> dict:
+def get_room_analytics(api: WebexDeviceAPI, device_id: str, offline: bool = False) -> dict:
     """
     Get Room Analytics Information for Webex Device, enrich with additional fields for display
+    :param api: WebexDeviceAPI instance of the device's org
     :param device_id: Unique Webex Device id
+    :param offline: Device is offline (xAPI calls skipped, 'N/A' values returned)
     :return: Dictionary of enriched Room Analytics information for device and dashboard display
     """
     room_analytics = {}
 
-    # Get People Presence
-    analytics = device_api.get_room_analytics(device_id)
+    if offline:
+        api.skip_request()
+        api.skip_request()
+        analytics, audio = {}, {}
+    else:
+        analytics = api.get_room_analytics(device_id)
+        audio = api.get_audio_information(device_id)
 
+    # Get People Presence
     room_analytics['people_present'] = analytics.get('PeoplePresence', 'N/A')
 
     # People Count (Current / Capacity)
@@ -288,8 +228,6 @@ def get_room_analytics(device_id: str) -> dict:
         room_analytics['people_count'] = 'N/A'
 
     # Get Audio Information (Mics and Speakers)
-    audio = device_api.get_audio_information(device_id)
-
     if 'Microphones' in audio:
         room_analytics['mic_muted'] = audio['Microphones']['Mute']
         room_analytics['speaker_volume'] = audio['Volume']
@@ -300,16 +238,22 @@ def get_room_analytics(device_id: str) -> dict:
     return room_analytics
 
 
-def get_peripherals(device_id: str) -> list[dict]:
+def get_peripherals(api: WebexDeviceAPI, device_id: str, offline: bool = False) -> list[dict]:
     """
     Get Device Peripherals information for a specific device
+    :param api: WebexDeviceAPI instance of the device's org
     :param device_id: Unique Webex Device ID
+    :param offline: Device is offline (xAPI call skipped, no peripherals returned)
     :return: Dictionary of enriched Peripherals information for device and dashboard display
     """
     peripheral_information = []
 
     # Get peripherals
-    peripherals = device_api.get_peripherals(device_id)
+    if offline:
+        api.skip_request()
+        peripherals = []
+    else:
+        peripherals = api.get_peripherals(device_id)
 
     for peripheral in peripherals:
         peripheral_information.append({
@@ -331,67 +275,37 @@ def active_device_calls(device_ids: list[str], device_lookup: dict) -> list[dict
     :param device_lookup: Small dict, able to look up a device by ID and access additional fields
     :return: a list of active calls (dicts) to display on dashboard
     """
-    # Get All Active Calls Across Devices
-    current_calls = device_api.get_active_calls(device_ids)
-
-    # Build Web Page Display Table
+    # Get All Active Calls Across Devices (each device queried with its org's API instance, offline devices can't
+    # answer xAPI calls and are skipped)
+    org_device_ids = {}
+    for device_id in device_ids:
+        if collector.is_offline(device_lookup[device_id][1]):
+            get_org_api(device_lookup[device_id][15]).skip_request()
+            continue
+        org_device_ids.setdefault(device_lookup[device_id][15], []).append(device_id)
+
+    current_calls = []
+    for org_id, org_ids in org_device_ids.items():
+        current_calls += get_org_api(org_id).get_active_calls(org_ids)
+
+    # Build Web Page Display Table (stream metrics collected per call, MOSS scored for all calls at once below)
     device_calls = []
+    audio_metrics, video_metrics = [], []
     for call in current_calls:
         # Get Device Details
         device = device_lookup[call['deviceId']]
 
         # Get Device Media Channels (use this to determine Audio and Video MOSS for Call)
-        media_channels = device_api.get_call_media_channels(call['deviceId'], call['id'])
-
-        # Determine MOSS Audio
-        audio_in_jit = None
-        audio_out_jit = None
-        audio_in_loss = None
-        audio_out_loss = None
-
-        media_channels_audio = media_channels['Audio']
-        if media_channels_audio['Incoming']:
-            audio_in_jit = media_channels_audio['Incoming']['MaxJitter']
-            try:
-                audio_in_loss = round(((media_channels_audio['Incoming']['LastIntervalLost'] /
-                                        media_channels_audio['Incoming']['LastIntervalReceived']) * 100), 2)
-            except ZeroDivisionError:
-                audio_in_loss = 0.0
-
-        if media_channels_audio['Outgoing']:
-            audio_out_jit = media_channels_audio['Outgoing']['MaxJitter']
-            try:
-                audio_out_loss = round(((media_channels_audio['Outgoing']['LastIntervalLost'] /
-                                         media_channels_audio['Outgoing']['LastIntervalReceived']) * 100), 2)
-            except ZeroDivisionError:
-                audio_out_loss = 0.0
-
-        audio_moss = util.calculate_mos(audio_in_jit, audio_out_jit, audio_in_loss, audio_out_loss)
-
-        # Determine MOSS Video
-        video_in_jit = None
-        video_out_jit = None
-        video_in_loss = None
-        video_out_loss = None
-
-        media_channels_video = media_channels['Video']
-        if media_channels_video['Incoming']:
-            video_in_jit = media_channels_video['Incoming']['MaxJitter']
-            try:
-                video_in_loss = round(((media_channels_video['Incoming']['LastIntervalLost'] /
-                                    media_channels_video['Incoming']['LastIntervalReceived']) * 100), 2)
-            except ZeroDivisionError:
-                video_in_loss = 0.0
-
-        if media_channels_video['Outgoing']:
-            video_out_jit = media_channels_video['Outgoing']['MaxJitter']
-            try:
-                video_out_loss = round(((media_channels_video['Outgoing']['LastIntervalLost'] /
-                                     media_channels_video['Outgoing']['LastIntervalReceived']) * 100), 2)
-            except ZeroDivisionError:
-                video_out_loss = 0.0
-
-        video_moss = util.calculate_mos(video_in_jit, video_out_jit, video_in_loss, video_out_loss)
+        media_channels = get_org_api(device[15]).get_call_media_channels(call['deviceId'], call['id'])
+
+        # Determine MOSS Audio and Video inputs (jitter and last interval packet loss of each stream)
+        audio_in_jit, audio_in_loss = util.netstat_metrics(media_channels['Audio']['Incoming'])
+        audio_out_jit, audio_out_loss = util.netstat_metrics(media_channels['Audio']['Outgoing'])
+        audio_metrics.append((audio_in_jit, audio_out_jit, audio_in_loss, audio_out_loss))
+
+        video_in_jit, video_in_loss = util.netstat_metrics(media_channels['Video']['Incoming'])
+        video_out_jit, video_out_loss = util.netstat_metrics(media_channels['Video']['Outgoing'])
+        video_metrics.append((video_in_jit, video_out_jit, video_in_loss, video_out_loss))
 
         # Convert Raw Duration (seconds) to HH:MM:SS format
         if 'Duration' in call:
@@ -415,15 +329,68 @@ def active_device_calls(device_ids: list[str], device_lookup: dict) -> list[dict
             'startTime': start_time_string,
             'duration': duration_string,
             'status': call.get('Status', 'Unknown'),
-            'a_mos': audio_moss,
-            'v_mos': video_moss,
             'deviceType': call.get('DeviceType', 'Unknown'),
             'protocol': call.get('Protocol', 'Unknown')
         })
 
+    # Determine MOSS Audio and Video (Minimum of Incoming and Outgoing)
+    if device_calls:
+        audio_moss = util.mos_values(util.calculate_mos_batch(*zip(*audio_metrics)))
+        video_moss = util.mos_values(util.calculate_mos_batch(*zip(*video_metrics)))
+        for device_call, audio_value, video_value in zip(device_calls, audio_moss, video_moss):
+            device_call['a_mos'] = audio_value
+            device_call['v_mos'] = video_value
+
     return device_calls
 
 
+def build_call_report_rows(results: list[tuple], device_lookup: dict) -> list[dict]:
+    """
+    Convert raw call history entries into call report rows (device fields, local start/end times, formatted duration)
+    :param results: Call history entries (rows from call_history table)
+    :param device_lookup: Small dict, able to look up a device by ID and access additional fields
+    :return: a list of call report rows (dicts) to display on dashboard or export
+    """
+    if not results:
+        return []
+
+    # Get Device Details
+    devices = [device_lookup[call[1]] for call in results]
+
+    # Convert Raw Duration (seconds) to HH:MM:SS format (whole column at once)
+    duration_strings = util.convert_seconds_to_time_batch([call[7] for call in results])
+
+    # Convert UTC Start and End times to each device's local timezone (grouped by timezone, whole columns at once)
+    start_time_strings, end_time_strings = util.localize_time_columns([[call[5] for call in results],
+                                                                      [call[6] for call in results]],
+                                                                     [device[14] for device in devices])
+
+    display_table = []
+    for call, device, start_time_string, end_time_string, duration_string in zip(results, devices, start_time_strings,
+                                                                                  end_time_strings, duration_strings):
+        display_table.append({
+            'endpoint': device[0],
+            'region': device[11],
+            'site': device[8],
+            'ipAddr': device[4],
+            'displayName': call[2],
+            'callbackNumber': call[3],
+            'remoteNumber': call[4],
+            'startTime': start_time_string,
+            'endTime': end_time_string,
+            'duration': duration_string,
+            'disconnect_reason': call[8],
+            'a_moss': call[9],
+            'v_moss': call[10],
+            'a_pkt_loss_max': call[11],
+            'v_pkt_loss_max': call[12],
+            'a_jit_max': call[13],
+            'v_jit_max': call[14]
+        })
+
+    return display_table
+
+
 def get_conn() -> sqlite3.Connection:
     """
     Open a new database connection if there is none yet for the current application context.
@@ -443,6 +410,87 @@ def close_conn(error):
         db.close_connection(conn)
 
 
+def get_sync_validators(conn: sqlite3.Connection, tables: list[str], *params) -> tuple[str, datetime | None]:
+    """
+    Build HTTP cache validators (ETag, Last-Modified) from the last sync version of the tables backing a response
+    :param conn: DB connection object
+    :param tables: Tables the response is built from (ex: devices, call_history)
+    :param params: Request parameters that change the response (ex: endpoint, period)
+    :return: ETag value and Last-Modified datetime (None if the tables were never synced)
+    """
+    sync_state = db.query_sync_state(conn, tables)
+
+    # ETag covers table versions, sync times (versions restart if the DB is rebuilt) and request parameters
+    etag_source = f"{request.path}|{sync_state}|{params}"
+    etag = hashlib.sha1(etag_source.encode()).hexdigest()
+
+    last_syncs = [entry[2] for entry in sync_state if entry[2]]
+    if last_syncs:
+        last_modified = datetime.strptime(max(last_syncs), util.DB_TIME_FORMAT).replace(tzinfo=pytz.utc)
+    else:
+        last_modified = None
+
+    return etag, last_modified
+
+
+def set_validators(response: Response, etag: str, last_modified: datetime | None) -> Response:
+    """
+    Attach cache validators to a response, browsers must revalidate before reusing their cached copy
+    :param response: Flask Response object
+    :param etag: ETag value (weak, the body may be gzipped on the way out)
+    :param last_modified: Last-Modified datetime
+    :return: Response with validators set
+    """
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+def not_modified(etag: str, last_modified: datetime | None) -> Response | None:
+    """
+    Return a 304 response if the client's cached copy is still current (If-None-Match, else If-Modified-Since)
+    :param etag: Current ETag value
+    :param last_modified: Current Last-Modified datetime
+    :return: 304 Response, or None if the full response must be built
+    """
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        matched = last_modified <= request.if_modified_since
+    else:
+        matched = False
+
+    if matched:
+        return set_validators(Response(status=304), etag, last_modified)
+
+    return None
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """
+    Gzip large text responses (JSON, HTML) if the client accepts it, streamed and file responses are left untouched
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers
+            or not request.accept_encodings['gzip']):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
 # Routes
 @app.route('/')
 def index():
@@ -454,11 +502,26 @@ def index():
     # Get DB connection in request
     conn = get_conn()
 
+    # Return early if the device table hasn't changed since the client's cached copy
+    etag, last_modified = get_sync_validators(conn, ['devices'])
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
     # Get all devices
     devices = db.query_all_devices(conn, "*")
 
-    return render_template('index.html', hiddenLinks=False, devices=devices,
-                           timeAndLocation=getSystemTimeAndLocation())
+    # Footer (current time) is left out of the cached page, the page fetches it from /system_info
+    response = Response(render_template('index.html', hiddenLinks=False, devices=devices))
+    return set_validators(response, etag, last_modified)
+
+
+@app.route('/system_info')
+def get_system_info():
+    """
+    Page footer system information (location and current time), for pages cached by the browser
+    """
+    return jsonify({'timeAndLocation': getSystemTimeAndLocation()})
 
 
 @app.route('/active_calls')
@@ -518,24 +581,67 @@ def call_report():
                            timeAndLocation=getSystemTimeAndLocation())
 
 
-@app.route('/call_report/query', methods=['POST'])
+def parse_call_history_filters(values) -> dict:
+    """
+    Parse the optional call history metric filters of a request: min_<name> / max_<name> (name: mos, loss, a_loss,
+    v_loss, jitter, a_jitter, v_jitter, duration) and disconnect_reason (comma separated disconnect types)
+    :param values: Request values
+    :return: Filters (see db.build_call_history_query), raises ValueError on a non-numeric bound
+    """
+    filters = {}
+    for name in db.CALL_HISTORY_RANGE_FILTERS:
+        for bound in ('min', 'max'):
+            value = values.get(f'{bound}_{name}')
+            if value:
+                filters[f'{bound}_{name}'] = float(value)
+
+    disconnect_reason = values.get('disconnect_reason')
+    if disconnect_reason:
+        filters['disconnect_reason'] = disconnect_reason.split(',')
+
+    return filters
+
+
+@app.route('/call_report/query', methods=['GET', 'POST'])
 def query_call_history_db():
     """
-    Query Call History method (triggered via AJAX, returns calls for one or more specific devices)
+    Query Call History method (triggered via AJAX, returns calls for one or more specific devices, optionally filtered
+    by MOS, packet loss, jitter, duration and disconnect reason in the DB). GET requests are answered with a 304 if
+    nothing was synced since the client's last identical query
     """
     logger.info(f"Query Call History DB {request.method} Request:")
 
     # Get parameters of query
-    endpoint_id = request.form.get('endpoint')
+    endpoint_id = request.values.get('endpoint')
 
     if endpoint_id == 'all':
         endpoint_id = None
 
-    period_hours = request.form.get('period')
+    period_hours = int(request.values.get('period', 1))
+
+    # Optional Webex org filter (multi-org)
+    org_id = request.values.get('org')
+
+    # Optional metric filters (ex: ?max_mos=3.5&min_v_loss=5)
+    try:
+        filters = parse_call_history_filters(request.values)
+    except ValueError:
+        return jsonify({'error': 'Invalid call history filter value'}), 400
 
     # Get DB connection in request
     conn = get_conn()
 
+    # Return early if neither table changed since the client's cached copy of this query, and its window still starts
+    # in the same minute (older calls leave a relative window without any sync, moving its start counts as a change)
+    window_start = (datetime.now(pytz.utc) - timedelta(hours=period_hours)).replace(second=0, microsecond=0)
+    etag, last_modified = get_sync_validators(conn, ['devices', 'call_history'], endpoint_id, period_hours, org_id,
+                                              filters, window_start.strftime(util.DB_TIME_FORMAT))
+    if last_modified:
+        last_modified = max(last_modified, window_start)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
     # Get all devices
     devices = db.query_all_devices(conn, "*")
 
@@ -546,55 +652,13 @@ def query_call_history_db():
         values = list(device[1:])  # everything else
         device_lookup[key] = values
 
-    results = db.query_call_history(conn, endpoint_id=endpoint_id, time_period_hours=int(period_hours))
+    results = db.query_call_history(conn, endpoint_id=endpoint_id, time_period_hours=period_hours, org_id=org_id,
+                                    filters=filters)
 
     # Build Web Page Display Table
-    display_table = []
-    for call in results:
-        # Get Device Details
-        device = device_lookup[call[1]]
-
-        # Convert Raw Duration (seconds) to HH:MM:SS format
-        duration_string = util.convert_seconds_to_time(call[7])
-
-        # Convert Start and End time
-        start_time_utc = datetime.strptime(call[5], '%Y-%m-%d %H:%M:%S')
-        end_time_utc = datetime.strptime(call[6], '%Y-%m-%d %H:%M:%S')
+    display_table = build_call_report_rows(results, device_lookup)
 
-        # Convert UTC datetime objects to your local timezone
-        if device[14] != 'N/A':
-            local_timezone = pytz.timezone(device[14])
-        else:
-            local_timezone = pytz.utc
-
-        start_time_local = start_time_utc.replace(tzinfo=pytz.utc).astimezone(local_timezone)
-        end_time_local = end_time_utc.replace(tzinfo=pytz.utc).astimezone(local_timezone)
-
-        # Format the local datetime objects into the desired format
-        start_time_string = start_time_local.strftime('%m/%d/%y %I:%M:%S %p (%Z)')
-        end_time_string = end_time_local.strftime('%m/%d/%y %I:%M:%S %p (%Z)')
-
-        display_table.append({
-            'endpoint': device[0],
-            'region': device[11],
-            'site': device[8],
-            'ipAddr': device[4],
-            'displayName': call[2],
-            'callbackNumber': call[3],
-            'remoteNumber': call[4],
-            'startTime': start_time_string,
-            'endTime': end_time_string,
-            'duration': duration_string,
-            'disconnect_reason': call[8],
-            'a_moss': call[9],
-            'v_moss': call[10],
-            'a_pkt_loss_max': call[11],
-            'v_pkt_loss_max': call[12],
-            'a_jit_max': call[13],
-            'v_jit_max': call[14]
-        })
-
-    return display_table
+    return set_validators(jsonify(display_table), etag, last_modified)
 
 
 @app.route('/device/details')
@@ -605,14 +669,18 @@ def get_device_details():
     # Get Device ID from URL params
     deviceId = request.args.get('deviceId')
 
+    # Get Region value and Webex org of the device
+    conn = get_conn()
+    device_region, org_id = db.query_device(conn, deviceId, "region, org_id")[0]
+    api = get_org_api(org_id)
+
     # Get Specific Device from Device List (get most recent details from API, updates DB entry)
-    device = lookup_device_details(device_api, deviceId)
+    device = lookup_device_details(api, deviceId)
 
     logger.info(f"Device Detail {request.method} Request for {device['displayName']}:")
 
-    # Get Region value
-    conn = get_conn()
-    device_region = db.query_device(conn, deviceId, "region")[0][0]
+    # Offline devices can't answer xAPI calls (detail sections are skipped)
+    offline = collector.is_offline(device['connectionStatus'])
 
     # Get Existing Regions
     existing_regions = []
@@ -639,10 +707,10 @@ def get_device_details():
         "contactInformation": device.get('room', ''),
         "region": device_region,
         "localNumber": device.get('primarySipUrl', ''),
-        "systemUnit": get_system_unit_information(deviceId, device),
-        "roomAnalytics": get_room_analytics(deviceId),
+        "systemUnit": get_system_unit_information(api, deviceId, device),
+        "roomAnalytics": get_room_analytics(api, deviceId, offline),
         "activeCalls": active_device_calls([deviceId], device_lookup),
-        "peripherals": get_peripherals(deviceId)
+        "peripherals": get_peripherals(api, deviceId, offline)
     }
 
     return render_template('device_details.html', hiddenLinks=False, device_details=device_details,
@@ -670,8 +738,7 @@ def open_incidents():
                 endpoint_name = ""
 
             # Convert Open Time to Proper UTC Format
-            open_time_datetime = datetime.strptime(incident['opened_at'], "%Y-%m-%d %H:%M:%S")
-            formatted_open_time = open_time_datetime.strftime('%m/%d/%y %I:%M:%S %p (UTC)')
+            formatted_open_time = util.format_display_time(incident['opened_at'])
 
             display_table.append({
                 "incident_num": incident['number'],
@@ -719,11 +786,9 @@ def closed_incidents():
                 endpoint_name = ""
 
             # Convert Open/Close Time to Proper UTC Format
-            open_time_datetime = datetime.strptime(incident['opened_at'], "%Y-%m-%d %H:%M:%S")
-            formatted_open_time = open_time_datetime.strftime('%m/%d/%y %I:%M:%S %p (UTC)')
+            formatted_open_time = util.format_display_time(incident['opened_at'])
 
-            close_time_datetime = datetime.strptime(incident['closed_at'], "%Y-%m-%d %H:%M:%S")
-            formatted_close_time = close_time_datetime.strftime('%m/%d/%y %I:%M:%S %p (UTC)')
+            formatted_close_time = util.format_display_time(incident['closed_at'])
 
             display_table.append({
                 "incident_num": incident['number'],
@@ -783,6 +848,131 @@ def download_excel():
     return response
 
 
+def stream_call_report_csv(endpoint_id: str | None, period_hours: int, device_lookup: dict, filters: dict,
+                            org_id: str | None = None):
+    """
+    Generate call report CSV output chunk by chunk (one chunk per batch of DB rows)
+    :param endpoint_id: A specific endpoint to export call history entries for (None - all endpoints)
+    :param period_hours: Time period to export call history entries from
+    :param device_lookup: Small dict, able to look up a device by ID and access additional fields
+    :param filters: Call history metric filters (see parse_call_history_filters)
+    :param org_id: A specific Webex org to export call history entries for (None - all orgs)
+    :return: Generator of CSV text chunks
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow([header for _, header in CALL_REPORT_EXPORT_COLUMNS])
+    yield buffer.getvalue()
+
+    # Dedicated connection, the generator outlives the request's connection
+    conn = db.create_connection(app.config['DATABASE'])
+    try:
+        for results in db.iter_call_history(conn, endpoint_id, period_hours, EXPORT_BATCH_SIZE, org_id=org_id,
+                                             filters=filters):
+            buffer.seek(0)
+            buffer.truncate()
+
+            for row in build_call_report_rows(results, device_lookup):
+                writer.writerow([row[key] for key, _ in CALL_REPORT_EXPORT_COLUMNS])
+            yield buffer.getvalue()
+    finally:
+        db.close_connection(conn)
+
+
+def stream_call_report_xlsx(endpoint_id: str | None, period_hours: int, device_lookup: dict, filters: dict,
+                             org_id: str | None = None):
+    """
+    Generate call report XLSX output (written in constant memory mode to a temp file, then streamed back in chunks)
+    :param endpoint_id: A specific endpoint to export call history entries for (None - all endpoints)
+    :param period_hours: Time period to export call history entries from
+    :param device_lookup: Small dict, able to look up a device by ID and access additional fields
+    :param filters: Call history metric filters (see parse_call_history_filters)
+    :param org_id: A specific Webex org to export call history entries for (None - all orgs)
+    :return: Generator of XLSX file chunks
+    """
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as output:
+        # Constant memory mode flushes each row to disk once the next row is started
+        workbook = xlsxwriter.Workbook(output.name, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Call History')
+        worksheet.write_row(0, 0, [header for _, header in CALL_REPORT_EXPORT_COLUMNS])
+
+        # Dedicated connection, the generator outlives the request's connection
+        conn = db.create_connection(app.config['DATABASE'])
+        try:
+            row_num = 1
+            for results in db.iter_call_history(conn, endpoint_id, period_hours, EXPORT_BATCH_SIZE, org_id=org_id,
+                                                 filters=filters):
+                for row in build_call_report_rows(results, device_lookup):
+                    worksheet.write_row(row_num, 0, [row[key] for key, _ in CALL_REPORT_EXPORT_COLUMNS])
+                    row_num += 1
+        finally:
+            db.close_connection(conn)
+
+        workbook.close()
+
+        # Stream finished file back to the client
+        with open(output.name, 'rb') as xlsx_file:
+            while chunk := xlsx_file.read(EXPORT_CHUNK_SIZE):
+                yield chunk
+
+
+@app.route('/call_report/export/<file_type>')
+def export_call_history(file_type: str):
+    """
+    Export Call History method (same query parameters as /call_report/query), streams rows straight from the DB into an
+    XLSX or CSV download
+    """
+    logger.info(f"Export Call History {request.method} Request ({file_type}):")
+
+    if file_type not in ('xlsx', 'csv'):
+        return jsonify({'error': f'Unsupported export type: {file_type}'}), 400
+
+    # Get parameters of query
+    endpoint_id = request.values.get('endpoint')
+
+    if endpoint_id == 'all':
+        endpoint_id = None
+
+    period_hours = int(request.values.get('period', 1))
+
+    # Optional Webex org filter (multi-org)
+    org_id = request.values.get('org')
+
+    try:
+        filters = parse_call_history_filters(request.values)
+    except ValueError:
+        return jsonify({'error': 'Invalid call history filter value'}), 400
+
+    # Get DB connection in request
+    conn = get_conn()
+
+    # Get all devices (of the org)
+    devices = db.query_all_devices(conn, "*", org_id)
+
+    # Construct quick lookup dict and device_id list
+    device_lookup = {}
+    for device in devices:
+        key = device[0]  # device_id
+        values = list(device[1:])  # everything else
+        device_lookup[key] = values
+
+    # Set filename with current date and time
+    current_datetime = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename = f"call_history_{current_datetime}.{file_type}"
+
+    if file_type == 'csv':
+        generator = stream_call_report_csv(endpoint_id, period_hours, device_lookup, filters, org_id)
+        mimetype = 'text/csv'
+    else:
+        generator = stream_call_report_xlsx(endpoint_id, period_hours, device_lookup, filters, org_id)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    response = Response(stream_with_context(generator), mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+
 @app.route('/update_region', methods=['POST'])
 def update_region():
     """
@@ -809,22 +999,389 @@ def update_region():
     # Update Region
     conn = get_conn()
     db.update_device_region(conn, deviceId, updated_region)
+    db.update_sync_state(conn, 'devices')
 
     # Return updated region to update UI
     return jsonify({'new_region': updated_region}), 200
 
 
-# One Time Actions (schedule call history and device list background thread - every X minutes - trigger devices now,
-# call history in 5 minutes)
-job = scheduler.add_job(get_devices_periodically, args=[device_api_background], trigger='interval', minutes=5)
-job.modify(next_run_time=datetime.now())
+@app.route('/devices/changes')
+def device_changes():
+    """
+    Device change log, read incrementally with a cursor (ex: /devices/changes?since=120&limit=500). Pass the returned
+    'next' value as 'since' to get the following changes
+    """
+    # Get DB connection in request
+    conn = get_conn()
+
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 500, type=int)
+    device_id = request.args.get('deviceId')
+
+    columns = ['seq', 'device_id', 'org_id', 'field', 'old_value', 'new_value', 'change_time']
+    changes = [dict(zip(columns, entry)) for entry in db.query_device_changes(conn, since, limit, device_id)]
+
+    return jsonify({
+        'changes': changes,
+        'next': changes[-1]['seq'] if changes else since
+    })
+
+
+@app.route('/call_quality/timeline')
+def call_quality_timeline():
+    """
+    Media quality timeline of a device's sampled calls, for charts (ex: /call_quality/timeline?deviceId=<id>). Returns
+    the device's sampled calls (newest first) and the timeline of the call starting at 'callStart' (default: newest call)
+    """
+    # Get DB connection in request
+    conn = get_conn()
+
+    device_id = request.args.get('deviceId')
+    if not device_id:
+        return jsonify({'error': 'deviceId is required'}), 400
+
+    call_columns = ['call_id', 'call_start', 'last_bucket', 'samples', 'a_mos_min', 'v_mos_min']
+    calls = [dict(zip(call_columns, entry)) for entry in
+             db.query_media_timeline_calls(conn, device_id, request.args.get('limit', 20, type=int))]
+
+    call_start = request.args.get('callStart') or (calls[0]['call_start'] if calls else None)
+    timeline = db.query_media_timeline(conn, device_id, call_start) if call_start else []
+
+    # Column oriented series (one list per metric, aligned on bucket_time), ready for chart datasets
+    series_columns = ['bucket_time', 'samples', 'a_mos', 'v_mos', 'a_pkt_loss_max', 'v_pkt_loss_max', 'a_jit_max',
+                      'v_jit_max']
+    series = {column: [entry[index] for entry in timeline] for index, column in enumerate(series_columns)}
+
+    return jsonify({
+        'calls': calls,
+        'call_start': call_start,
+        'timeline': series
+    })
+
+
+def parse_time_param(value: str) -> datetime:
+    """
+    Parse a UTC date or date time request parameter ('%Y-%m-%d' or '%Y-%m-%d %H:%M:%S')
+    :param value: Parameter value
+    :return: UTC datetime
+    """
+    time_format = util.DB_TIME_FORMAT if ' ' in value else '%Y-%m-%d'
+    return datetime.strptime(value, time_format).replace(tzinfo=pytz.utc)
+
+
+def parse_time_window(args, default_period: int) -> tuple[datetime, datetime]:
+    """
+    Parse a request's time window: explicit start / end (UTC, end defaults to now), else the last 'period' hours
+    :param args: Request arguments
+    :param default_period: Period (hours) used without start / period
+    :return: Window start and end (UTC), raises ValueError on an invalid start / end
+    """
+    # Windows ending now are aligned to the minute (memoized results stay reusable between requests)
+    now = datetime.now(pytz.utc).replace(second=0, microsecond=0)
+    if args.get('start'):
+        start_time = parse_time_param(args['start'])
+        end_time = parse_time_param(args['end']) if args.get('end') else now
+    else:
+        end_time = now
+        start_time = end_time - timedelta(hours=args.get('period', default_period, type=int))
+
+    return start_time, end_time
+
+
+def get_memoized(cache: dict, cache_size: int, sync_state: list, key: tuple, compute):
+    """
+    Return a result memoized until the next device / call history sync, computed on a miss
+    :param cache: Result cache ({'sync_state', 'results'})
+    :param cache_size: Maximum number of results kept
+    :param sync_state: Current device / call history sync state (see db.query_sync_state)
+    :param key: Result key
+    :param compute: Callable computing the result
+    :return: Result
+    """
+    # A sync happened since the results were computed (or the cache is full), drop them all
+    if cache['sync_state'] != sync_state or len(cache['results']) >= cache_size:
+        cache['sync_state'] = sync_state
+        cache['results'] = {}
+
+    result = cache['results'].get(key)
+    if result is None:
+        result = cache['results'][key] = compute()
+
+    return result
+
+
+def get_call_quality(conn: sqlite3.Connection, sync_state: list, grouping: str, start_time: datetime,
+                     end_time: datetime, org_id: str | None) -> list[dict]:
+    """
+    Call quality summaries per group for a time window, memoized until the next device / call history sync
+    :param conn: DB connection object
+    :param sync_state: Current device / call history sync state (see db.query_sync_state)
+    :param grouping: Grouping (site, region, device, software or day)
+    :param start_time: Window start (UTC)
+    :param end_time: Window end (UTC)
+    :param org_id: A specific org (default: all orgs - None)
+    :return: Call quality summary per group (see util.summarize_call_quality)
+    """
+    return get_memoized(call_quality_cache, CALL_QUALITY_CACHE_SIZE, sync_state,
+                        (grouping, start_time, end_time, org_id),
+                        lambda: util.summarize_call_quality(db.query_call_quality(conn, grouping, start_time,
+                                                                                  end_time, org_id)))
+
+
+def build_call_quality_chart(conn: sqlite3.Connection, scope: str, scope_id: str | None, start_time: datetime,
+                             end_time: datetime, points: int, raw_series: list[str], org_id: str | None) -> dict:
+    """
+    Call volume and quality chart data of a scope: fixed time buckets aggregated in the DB (every bucket of the window,
+    empty buckets with 0 calls), plus raw per call series downsampled with LTTB
+    :param conn: DB connection object
+    :param scope: Chart scope (fleet, site or device)
+    :param scope_id: Site name or device id (ignored for the fleet)
+    :param start_time: Window start (UTC)
+    :param end_time: Window end (UTC)
+    :param points: Maximum number of points per series
+    :param raw_series: Raw series to include (CHART_RAW_SERIES names)
+    :param org_id: A specific org (default: all orgs - None)
+    :return: Chart data, column oriented series (one list per metric, aligned on time)
+    """
+
+    def format_times(epoch_seconds) -> list[str]:
+        return [datetime.fromtimestamp(int(seconds), pytz.utc).strftime(util.DB_TIME_FORMAT)
+                for seconds in epoch_seconds]
+
+    bucket_seconds = util.chart_bucket_seconds((end_time - start_time).total_seconds(), points)
+    rows = {row[0]: row[1:] for row in db.query_call_chart_buckets(conn, scope, scope_id, start_time, end_time,
+                                                                    bucket_seconds, org_id)}
+
+    first_bucket = int(start_time.timestamp()) // bucket_seconds * bucket_seconds
+    bucket_times = range(first_bucket, int(end_time.timestamp()), bucket_seconds)
+    bucket_values = [rows.get(bucket_time, (0, None, None, None, None)) for bucket_time in bucket_times]
+
+    buckets = {'time': format_times(bucket_times)}
+    for index, column in enumerate(['calls', 'avg_mos', 'min_mos', 'avg_loss', 'max_loss']):
+        buckets[column] = [round(values[index], 2) if values[index] is not None else None for values in bucket_values]
+
+    raw = {}
+    for name in raw_series:
+        call_points = np.array(db.query_call_chart_points(conn, scope, scope_id, start_time, end_time,
+                                                          CHART_RAW_SERIES[name], org_id), dtype=float).reshape(-1, 2)
+        kept = call_points[util.lttb(call_points[:, 0], call_points[:, 1], points)]
+        raw[name] = {'time': format_times(kept[:, 0]), name: [round(value, 2) for value in kept[:, 1].tolist()],
+                     'calls': len(call_points)}
+
+    return {'bucket_seconds': bucket_seconds, 'buckets': buckets, 'raw': raw}
+
+
+@app.route('/call_quality/analytics')
+def call_quality_analytics():
+    """
+    Call quality percentiles (p50/p90/p99 MOSS, packet loss, jitter) and call counts per site, region, device, software
+    version or day for a time window (ex: /call_quality/analytics?group=site&period=168&compare=true, or
+    &start=2024-05-01&end=2024-05-08). With 'compare', the previous window of the same length is returned as well
+    """
+    grouping = request.args.get('group', 'site')
+    if grouping not in db.CALL_QUALITY_GROUPINGS:
+        return jsonify({'error': f'Unsupported group: {grouping}'}), 400
+
+    # Window: explicit start / end (UTC, end defaults to now), else the last 'period' hours (default: 1 week)
+    try:
+        start_time, end_time = parse_time_window(request.args, 168)
+    except ValueError:
+        return jsonify({'error': 'Invalid start / end time'}), 400
+
+    org_id = request.args.get('org')
+    compare = request.args.get('compare', 'false').lower() == 'true'
+
+    # Get DB connection in request
+    conn = get_conn()
+
+    sync_state = db.query_sync_state(conn, ['devices', 'call_history'])
+    response = {
+        'group': grouping,
+        'start': start_time.strftime(util.DB_TIME_FORMAT),
+        'end': end_time.strftime(util.DB_TIME_FORMAT),
+        'groups': get_call_quality(conn, sync_state, grouping, start_time, end_time, org_id)
+    }
+
+    if compare:
+        previous_start = start_time - (end_time - start_time)
+        response['previous'] = {
+            'start': previous_start.strftime(util.DB_TIME_FORMAT),
+            'end': response['start'],
+            'groups': get_call_quality(conn, sync_state, grouping, previous_start, start_time, org_id)
+        }
+
+    return jsonify(response)
+
+
+@app.route('/call_quality/chart')
+def call_quality_chart():
+    """
+    Call volume, average / min MOS and packet loss over time for the fleet, a site or a device, for Chart.js (ex:
+    /call_quality/chart?scope=site&id=<site>&period=1440&points=200&raw=mos). Long windows are downsampled server side:
+    fixed buckets sized to at most 'points' buckets, and raw per call series ('raw': mos, loss, jitter) reduced to
+    'points' points with LTTB. Results are cached per window until the next sync
+    """
+    scope = request.args.get('scope', 'fleet')
+    if scope not in db.CHART_SCOPES:
+        return jsonify({'error': f'Unsupported scope: {scope}'}), 400
+
+    scope_id = request.args.get('id') if scope != 'fleet' else None
+    if scope != 'fleet' and not scope_id:
+        return jsonify({'error': 'id is required'}), 400
+
+    raw_series = [name for name in request.args.get('raw', '').split(',') if name]
+    unsupported = [name for name in raw_series if name not in CHART_RAW_SERIES]
+    if unsupported:
+        return jsonify({'error': f'Unsupported raw series: {unsupported}'}), 400
+
+    # Window: explicit start / end (UTC, end defaults to now), else the last 'period' hours (default: 1 week)
+    try:
+        start_time, end_time = parse_time_window(request.args, 168)
+    except ValueError:
+        return jsonify({'error': 'Invalid start / end time'}), 400
+
+    points = max(3, min(request.args.get('points', CHART_DEFAULT_POINTS, type=int), CHART_MAX_POINTS))
+    org_id = request.args.get('org')
+
+    # Get DB connection in request
+    conn = get_conn()
+
+    sync_state = db.query_sync_state(conn, ['devices', 'call_history'])
+    chart = get_memoized(chart_cache, CHART_CACHE_SIZE, sync_state,
+                         (scope, scope_id, start_time, end_time, points, tuple(raw_series), org_id),
+                         lambda: build_call_quality_chart(conn, scope, scope_id, start_time, end_time, points,
+                                                          raw_series, org_id))
+
+    return jsonify(dict(chart, scope=scope, id=scope_id, start=start_time.strftime(util.DB_TIME_FORMAT),
+                        end=end_time.strftime(util.DB_TIME_FORMAT)))
+
+
+@app.route('/call_quality/worst')
+def worst_offenders():
+    """
+    Worst offenders over the last 'days' days (UTC, default: 7): lowest MOS calls and highest peak packet loss devices
+    (ex: /call_quality/worst?days=7&limit=20), served from the per day worst offender indexes (history size independent)
+    """
+    # Get DB connection in request
+    conn = get_conn()
+
+    days = request.args.get('days', 7, type=int)
+    limit = min(request.args.get('limit', config.WORST_OFFENDERS_TOP_N, type=int), config.WORST_OFFENDERS_TOP_N)
+    org_id = request.args.get('org')
+
+    first_bucket = (datetime.now(pytz.utc) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+    call_columns = ['call_id', 'device_id', 'endpoint', 'site', 'region', 'org_id', 'start_time', 'mos', 'a_mos',
+                    'v_mos']
+    device_columns = ['device_id', 'endpoint', 'site', 'region', 'org_id', 'peak_loss', 'call_id', 'start_time']
+
+    return jsonify({
+        'since': first_bucket,
+        'calls': [dict(zip(call_columns, entry)) for entry in db.query_worst_calls(conn, first_bucket, limit, org_id)],
+        'devices': [dict(zip(device_columns, entry))
+                    for entry in db.query_worst_devices(conn, first_bucket, limit, org_id)]
+    })
+
+
+@app.route('/devices/degrading')
+def degrading_devices():
+    """
+    Devices whose recent call quality departs from their baseline, worst first (ex: /devices/degrading?limit=20). Score
+    is the largest deviation for the worse in baseline standard deviations, 'all=true' includes devices not flagged
+    """
+    # Get DB connection in request
+    conn = get_conn()
+
+    limit = request.args.get('limit', 20, type=int)
+    org_id = request.args.get('org')
+    include_all = request.args.get('all', 'false').lower() == 'true'
+
+    devices = []
+    for device_id, endpoint, site, region, device_org, score, degraded, state, updated in db.query_degrading_devices(
+            conn, limit, org_id, include_all):
+        metrics = {metric: {'baseline': round(mean, 3), 'deviation': round(variance ** 0.5, 3),
+                            'recent': round(recent, 3), 'calls': count}
+                   for metric, (mean, variance, recent, count) in json.loads(state).items()}
+
+        devices.append({
+            'device_id': device_id,
+            'endpoint': endpoint,
+            'site': site,
+            'region': region,
+            'org_id': device_org,
+            'score': score,
+            'degraded': degraded.split(',') if degraded else [],
+            'metrics': metrics,
+            'updated': updated
+        })
+
+    return jsonify(devices)
+
+
+@app.route('/collector/status')
+def collector_status():
+    """
+    Collector health and progress (sync job states, devices processed in the current run, heartbeat age), works for both
+    the in-process scheduler and the standalone collector
+    """
+    # Get DB connection in request
+    conn = get_conn()
+
+    columns = ['job', 'state', 'pid', 'last_start', 'last_end', 'last_duration', 'devices_processed', 'devices_total',
+               'last_error', 'heartbeat']
+    jobs = {entry[0]: dict(zip(columns, entry)) for entry in db.query_collector_status(conn)}
+
+    # Collector is healthy if its heartbeat is recent (heartbeat recorded by the scheduler lock holder)
+    heartbeat = jobs.pop('collector', {}).get('heartbeat')
+    if heartbeat:
+        heartbeat_time = datetime.strptime(heartbeat, util.DB_TIME_FORMAT).replace(tzinfo=pytz.utc)
+        heartbeat_age = (datetime.now(pytz.utc) - heartbeat_time).total_seconds()
+    else:
+        heartbeat_age = None
+
+    # Sharded call history collection timing (per org and shard)
+    shard_columns = ['org_id', 'shard', 'devices', 'runs', 'last_start', 'last_duration', 'max_duration']
+    shards = [dict(zip(shard_columns, entry)) for entry in db.query_shard_metrics(conn)]
+
+    return jsonify({
+        'healthy': heartbeat_age is not None and heartbeat_age < collector.HEARTBEAT_TIMEOUT,
+        'heartbeat': heartbeat,
+        'heartbeat_age': heartbeat_age,
+        'jobs': jobs,
+        'shards': shards
+    })
+
+
+@app.route('/collector/runs')
+def collector_runs():
+    """
+    Scheduler job run history (newest first), optionally filtered by job (ex: /collector/runs?job=call_history&limit=20)
+    """
+    # Get DB connection in request
+    conn = get_conn()
+
+    job = request.args.get('job')
+    limit = request.args.get('limit', 50, type=int)
+
+    columns = ['run_id', 'job', 'status', 'start_time', 'end_time', 'duration', 'devices_processed', 'api_calls',
+               'rate_limited', 'error', 'api_calls_skipped', 'time_saved']
+    runs = [dict(zip(columns, entry)) for entry in db.query_job_runs(conn, job, limit)]
+
+    return jsonify(runs)
+
+
+@app.route('/api_queue/stats')
+def api_queue_stats():
+    """
+    Webex API request gate state and per priority (interactive, bulk) queue wait stats for this process (per org)
+    """
+    return jsonify({org_id: gate.get_stats() for org_id, gate in request_schedulers.items()})
 
-job = scheduler.add_job(get_device_call_history_periodically, args=[device_api_background], trigger='interval',
-                        minutes=config.CALL_HISTORY_REFRESH_CYCLE)
-delayed_start = datetime.now() + timedelta(minutes=5)
-job.modify(next_run_time=delayed_start)
 
-scheduler.start()
+# One Time Actions (run the background sync jobs in this process, unless a standalone collector is used - see
+# collector.py - or another worker process already runs them)
+if config.RUN_COLLECTOR_IN_WEB:
+    collector.start_background_scheduler(scheduler, device_apis_background, logger)
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', debug=False)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import random
+import time
+import timeit
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+from rich.console import Console
+from rich.table import Table
+
+import util
+
+# Timezones used for synthetic call history (mix of DST / non-DST zones and the 'N/A' UTC fallback)
+TIMEZONES = ['America/New_York', 'America/Los_Angeles', 'Europe/London', 'Asia/Kolkata', 'Australia/Sydney', 'N/A']
+
+
+def timed(function, *args) -> tuple[float, object]:
+    """
+    Run function once, return elapsed wall clock time and the function result
+    :param function: Function to benchmark
+    :param args: Function arguments
+    :return: Elapsed seconds, function result
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def generate_call_rows(count: int) -> tuple[list[str], list[str], list[int], list[str]]:
+    """
+    Generate synthetic call history columns (UTC start/end strings in DB format, durations, device timezones)
+    :param count: Number of calls to generate
+    :return: Start times, end times, durations, timezones
+    """
+    random.seed(0)
+    now = datetime.utcnow()
+
+    start_times, end_times, durations, timezones = [], [], [], []
+    for _ in range(count):
+        start_time = now - timedelta(seconds=random.randint(0, 60 * 24 * 3600))
+        duration = random.randint(0, 4 * 3600)
+
+        start_times.append(start_time.strftime(util.DB_TIME_FORMAT))
+        end_times.append((start_time + timedelta(seconds=duration)).strftime(util.DB_TIME_FORMAT))
+        durations.append(duration)
+        timezones.append(random.choice(TIMEZONES))
+
+    return start_times, end_times, durations, timezones
+
+
+def format_call_rows_loop(start_times: list[str], end_times: list[str], durations: list[int],
+                          timezones: list[str]) -> tuple[list[str], list[str], list[str]]:
+    """
+    Reference per row implementation (original call report loop), used as the baseline
+    """
+    start_strings, end_strings, duration_strings = [], [], []
+    for start_time, end_time, duration, timezone in zip(start_times, end_times, durations, timezones):
+        duration_strings.append(util.convert_seconds_to_time(duration))
+
+        start_time_utc = datetime.strptime(start_time, util.DB_TIME_FORMAT)
+        end_time_utc = datetime.strptime(end_time, util.DB_TIME_FORMAT)
+
+        local_timezone = pytz.timezone(timezone) if timezone != 'N/A' else pytz.utc
+
+        start_strings.append(start_time_utc.replace(tzinfo=pytz.utc).astimezone(local_timezone).strftime(
+            '%m/%d/%y %I:%M:%S %p (%Z)'))
+        end_strings.append(end_time_utc.replace(tzinfo=pytz.utc).astimezone(local_timezone).strftime(
+            '%m/%d/%y %I:%M:%S %p (%Z)'))
+
+    return start_strings, end_strings, duration_strings
+
+
+def format_call_rows_batch(start_times: list[str], end_times: list[str], durations: list[int],
+                           timezones: list[str]) -> tuple[list[str], list[str], list[str]]:
+    """
+    Batched implementation (grouped by timezone, whole columns at once), as used by the call report
+    """
+    start_strings, end_strings = util.localize_time_columns([start_times, end_times], timezones)
+    duration_strings = util.convert_seconds_to_time_batch(durations)
+
+    return start_strings, end_strings, duration_strings
+
+
+def benchmark_call_report_formatting(table: Table, count: int):
+    """
+    Compare per row and batched call report time formatting (results must be identical)
+    :param table: Rich results table
+    :param count: Number of synthetic calls
+    """
+    columns = generate_call_rows(count)
+
+    loop_time, loop_result = timed(format_call_rows_loop, *columns)
+    batch_time, batch_result = timed(format_call_rows_batch, *columns)
+
+    assert loop_result == batch_result, "Batched call report formatting differs from per row formatting"
+
+    table.add_row(f"Call report formatting ({count} rows)", f"{loop_time:.3f}s", f"{batch_time:.3f}s",
+                  f"{loop_time / batch_time:.1f}x")
+
+
+def generate_stream_metrics(count: int) -> tuple[list, list, list, list]:
+    """
+    Generate synthetic incoming/outgoing jitter and packet loss columns (threshold boundary values and missing streams
+    included, so every calculate_mos branch is covered)
+    :param count: Number of calls to generate
+    :return: Incoming jitter, outgoing jitter, incoming packet loss, outgoing packet loss
+    """
+    rng = np.random.default_rng(0)
+
+    columns = []
+    for high in (60.0, 60.0, 10.0, 10.0):
+        values = np.round(rng.uniform(0.0, high, count), 2)
+
+        # Exact threshold values (jitter 10ms, packet loss 2% / 5%)
+        values[rng.random(count) < 0.05] = 10.0 if high > 10.0 else rng.choice([2.0, 5.0])
+
+        # Missing stream data (None, as returned for a stream without metrics)
+        column = values.tolist()
+        for index in np.flatnonzero(rng.random(count) < 0.1):
+            column[index] = None
+        columns.append(column)
+
+    return tuple(columns)
+
+
+def calculate_mos_loop(incoming_jitter: list, outgoing_jitter: list, incoming_packet_loss_percent: list,
+                       outgoing_packet_loss_percent: list) -> list[float | str]:
+    """
+    Reference per call implementation (calculate_mos per row), used as the baseline
+    """
+    return [util.calculate_mos(*metrics) for metrics in zip(incoming_jitter, outgoing_jitter,
+                                                           incoming_packet_loss_percent, outgoing_packet_loss_percent)]
+
+
+def calculate_mos_vectorized(incoming_jitter: list, outgoing_jitter: list, incoming_packet_loss_percent: list,
+                             outgoing_packet_loss_percent: list) -> list[float | str]:
+    """
+    Batched implementation (whole columns at once), as used by call history ingestion and active calls
+    """
+    return util.mos_values(util.calculate_mos_batch(incoming_jitter, outgoing_jitter, incoming_packet_loss_percent,
+                                                    outgoing_packet_loss_percent))
+
+
+def benchmark_mos_scoring(table: Table, count: int):
+    """
+    Compare per call and batched MOSS scoring (results must be identical, including 'N/A')
+    :param table: Rich results table
+    :param count: Number of synthetic calls
+    """
+    columns = generate_stream_metrics(count)
+
+    loop_time, loop_result = timed(calculate_mos_loop, *columns)
+    batch_time, batch_result = timed(calculate_mos_vectorized, *columns)
+
+    assert loop_result == batch_result, "Batched MOSS scoring differs from per call scoring"
+
+    table.add_row(f"MOSS scoring ({count} calls)", f"{loop_time:.3f}s", f"{batch_time:.3f}s",
+                  f"{loop_time / batch_time:.1f}x")
+
+
+def benchmark_mos_models(table: Table, count: int):
+    """
+    Batch scoring time of every registered MOS model, with the share of calls rated poor (MOS below 3.5)
+    :param table: Rich results table
+    :param count: Number of synthetic calls
+    """
+    columns = [np.array(column, dtype=float) for column in generate_stream_metrics(count)]
+
+    for model in util.MOS_MODELS:
+        model_time, scores = timed(util.calculate_mos_batch, *columns, model)
+        poor = np.mean(scores[~np.isnan(scores)] < 3.5) * 100
+
+        table.add_row(f"MOS model '{model}' ({count} calls, {poor:.1f}% poor)", "-", f"{model_time:.3f}s", "-")
+
+
+def calculate_start_time_uncached(duration_seconds: int, timezone: str) -> str:
+    """
+    Reference calculate_start_time without the timezone registry (timezone object resolved on every call)
+    """
+    zone = pytz.timezone(timezone) if timezone != 'N/A' else pytz.utc
+    start_time = datetime.now(zone) - timedelta(seconds=duration_seconds)
+    return start_time.strftime(util.DISPLAY_TIME_FORMAT)
+
+
+def per_call(statement, number: int) -> float:
+    """
+    Best of 5 timeit repeats, returned as seconds per call
+    :param statement: Callable to time
+    :param number: Calls per repeat
+    :return: Seconds per call
+    """
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number
+
+
+def benchmark_util_helpers(table: Table, number: int):
+    """
+    Micro-benchmarks for the per row util helpers (calculate_start_time, convert_seconds_to_time, calculate_mos)
+    :param table: Rich results table
+    :param number: Calls per timing repeat
+    """
+    timezone = 'America/New_York'
+
+    baseline = per_call(lambda: calculate_start_time_uncached(3600, timezone), number)
+    optimized = per_call(lambda: util.calculate_start_time(3600, timezone), number)
+    table.add_row("calculate_start_time (per call)", f"{baseline * 1e6:.2f}us", f"{optimized * 1e6:.2f}us",
+                  f"{baseline / optimized:.1f}x")
+
+    optimized = per_call(lambda: util.convert_seconds_to_time(45296), number)
+    table.add_row("convert_seconds_to_time (per call)", "-", f"{optimized * 1e6:.2f}us", "-")
+
+    optimized = per_call(lambda: util.calculate_mos(12.5, 30.0, 1, 4), number)
+    table.add_row("calculate_mos (per call)", "-", f"{optimized * 1e6:.2f}us", "-")
+
+
+# If running this python file, run all benchmarks and print a summary table
+if __name__ == "__main__":
+    results = Table(title="Dashboard Benchmarks")
+    results.add_column("Benchmark")
+    results.add_column("Baseline")
+    results.add_column("Optimized")
+    results.add_column("Speedup")
+
+    benchmark_util_helpers(results, 20000)
+    benchmark_call_report_formatting(results, 200000)
+    benchmark_mos_scoring(results, 1000000)
+    benchmark_mos_models(results, 1000000)
+
+    Console().print(results)
@@ -0,0 +1,1070 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import heapq
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, JobEvent
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+import alerts
+import config
+import db
+import util
+from webex import PRIORITY_BULK, WebexDeviceAPI, create_org_apis
+
+# Absolute Paths
+script_dir = os.path.dirname(os.path.abspath(__file__))
+scheduler_lock_path = os.path.join(script_dir, 'db/scheduler.lock')
+
+# Scheduler locks, one per org (only one process - web worker or standalone collector - runs an org's sync jobs),
+# retried every SCHEDULER_LOCK_RETRY seconds by standby processes
+scheduler_locks = {}
+SCHEDULER_LOCK_RETRY = 60
+
+# Next call history shard to poll per org (sharded collection, rotates through all shards once per refresh cycle)
+next_history_shard = {}
+
+# Device connection states which can't be polled (only checked for reconnection by the inventory sync)
+OFFLINE_STATUSES = ('Offline', 'Offline Expired')
+
+# Device fields tracked in the device change log (devices table column, enriched device key)
+CHANGE_LOG_FIELDS = (('connection_status', 'connectionStatus'), ('software', 'software'), ('ip_addr', 'ip'))
+
+# Sync job ids (jobs with run accounting)
+SYNC_JOBS = ('devices', 'call_history', 'media_quality', 'alerts')
+
+# Active call media samples per org ({(device_id, call_id): {'call_start', 'samples'}}), one ring buffer per call with
+# MEDIA_SAMPLE_COLUMNS values per sample (sample time, then audio and video incoming/outgoing jitter and packet loss)
+active_call_samples = {}
+MEDIA_SAMPLE_COLUMNS = ('time', 'a_in_jit', 'a_out_jit', 'a_in_loss', 'a_out_loss', 'v_in_jit', 'v_out_jit',
+                        'v_in_loss', 'v_out_loss')
+
+# MOS model used to score calls (MOS_MODEL in config.py), stored calls are rescored RESCORE_BATCH_SIZE at a time
+util.set_mos_model(config.MOS_MODEL, config.MOS_MODEL_PARAMETERS)
+RESCORE_BATCH_SIZE = 5000
+
+# Call quality alert engine per org (ALERT_FEATURE), its digest is sent every ALERT_DIGEST_INTERVAL seconds
+alert_engines = {}
+
+
+def org_job_name(job: str, org_id: str) -> str:
+    """
+    Scheduler job / collector status name of an org's sync job (plain job name when a single org is configured)
+    :param job: Sync job id (ex: devices, call_history)
+    :param org_id: Org name
+    :return: Job name (ex: devices, or devices:org1 with multiple orgs)
+    """
+    return job if len(config.WEBEX_ORGS) == 1 else f"{job}:{org_id}"
+
+
+def org_lock_path(org_id: str) -> str:
+    """
+    Scheduler lock file of an org (db/scheduler.lock when a single org is configured)
+    :param org_id: Org name
+    :return: Lock file path
+    """
+    if len(config.WEBEX_ORGS) == 1:
+        return scheduler_lock_path
+    return os.path.join(script_dir, f'db/scheduler-{org_id}.lock')
+
+
+def assigned_orgs(orgs: list[str] | None = None) -> list[str]:
+    """
+    Orgs synced by this process (explicit list, else COLLECTOR_ORGS, else every org in WEBEX_ORGS)
+    :param orgs: Explicit org list (ex: collector --orgs argument)
+    :return: Org names
+    """
+    orgs = orgs or config.COLLECTOR_ORGS or list(config.WEBEX_ORGS)
+
+    unknown_orgs = [org_id for org_id in orgs if org_id not in config.WEBEX_ORGS]
+    if unknown_orgs:
+        raise ValueError(f"Orgs not configured in WEBEX_ORGS: {unknown_orgs}")
+
+    return orgs
+
+
+# Collector heartbeat frequency (seconds), the web app reports the collector unhealthy after HEARTBEAT_TIMEOUT seconds
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 120
+
+
+def is_offline(connection_status: str | None) -> bool:
+    """
+    Device can't answer xAPI calls (latest known connection status is offline), calls to it are skipped
+    :param connection_status: Display connection status (devices table / enriched device)
+    :return: True if the device is offline
+    """
+    return connection_status in OFFLINE_STATUSES
+
+
+def query_device_states(conn, org_id: str | None = None, device_id: str | None = None) -> dict[str, dict]:
+    """
+    Return the stored state of the fields tracked in the device change log
+    :param conn: DB connection object
+    :param org_id: Specific org to return devices for (default: all orgs - None)
+    :param device_id: Specific device to return (default: all devices - None)
+    :return: Dictionary mapping device id to its tracked fields (plus uptime_seconds)
+    """
+    columns = [column for column, _ in CHANGE_LOG_FIELDS] + ['uptime_seconds']
+    if device_id:
+        entries = db.query_device(conn, device_id, f"device_id, {', '.join(columns)}")
+    else:
+        entries = db.query_all_devices(conn, f"device_id, {', '.join(columns)}", org_id)
+
+    return {entry[0]: dict(zip(columns, entry[1:])) for entry in entries}
+
+
+def record_device_changes(conn, previous_state: dict | None, device: dict, org_id: str):
+    """
+    Append a device's state transitions to the change log (connection status, software version, IP, uptime reset -
+    uptime lower than the last stored uptime). New devices are logged as added
+    :param conn: DB connection object
+    :param previous_state: Stored tracked fields of the device (query_device_states entry), None if it's a new device
+    :param device: Enriched device (new state, before it's written to the DB)
+    :param org_id: Org the device belongs to
+    """
+    if previous_state is None:
+        changes = [('device', None, 'added')]
+    else:
+        changes = [(column, previous_state[column], device[key]) for column, key in CHANGE_LOG_FIELDS
+                   if previous_state[column] != device[key]]
+
+        # Uptime reset (device rebooted), unknown while the device is offline
+        previous_uptime, uptime = previous_state['uptime_seconds'], device['uptimeSeconds']
+        if uptime is not None and previous_uptime is not None and uptime < previous_uptime:
+            changes.append(('uptime', str(previous_uptime), str(uptime)))
+
+    db.add_device_changes(conn, device['id'], org_id, changes)
+
+
+def get_devices_periodically(api: WebexDeviceAPI) -> int:
+    """
+    Get Webex Devices periodically and update the DB (runs every 5 minutes by default, per org)
+    :param api: WebexDeviceAPI instance - get all devices of the api's org, add to DB in the background)
+    :return: Number of devices processed
+    """
+    job = org_job_name('devices', api.org_id)
+
+    # Connection to DB (one-time)
+    conn = db.create_connection(db.db_path)
+    db.update_collector_status(conn, job, 'running')
+
+    try:
+        # Get Device List
+        devices = api.get_all_devices(config.DEVICE_TYPE)
+
+        # Clear org devices from table not returned in devices api call (no longer have xapi permission, removed, etc.)
+        new_device_ids = [device['id'] for device in devices]
+        current_device_ids = db.query_all_devices(conn, "device_id", api.org_id)
+        for device_id in current_device_ids:
+            if device_id[0] not in new_device_ids:
+                db.delete_old_device_entries(conn, device_id[0])
+                db.add_device_changes(conn, device_id[0], api.org_id, [('device', None, 'removed')])
+
+        # Previous device state (detect reconnected devices, change log transitions)
+        previous_states = query_device_states(conn, api.org_id)
+
+        # xAPI calls skipped for offline devices (reported at the end of the sync)
+        start_skipped, start_time_saved = api.get_skipped_counts()
+
+        # Add devices to db
+        for count, device in enumerate(devices, start=1):
+            # Enrich Device Details
+            device = enrich_device_fields(api, device)
+
+            # Log state transitions, add device to db
+            previous_state = previous_states.get(device['id'])
+            record_device_changes(conn, previous_state, device, api.org_id)
+            db.add_device_entries(conn, device, api.org_id)
+
+            # Poll call history soon for devices in a call or back online (adaptive polling)
+            previous_status = previous_state['connection_status'] if previous_state else None
+            reconnected = is_offline(previous_status) and not is_offline(device['connectionStatus'])
+            db.update_device_activity(conn, device['id'], device['activeCalls'],
+                                      device['activeCalls'] > 0 or reconnected)
+
+            db.update_collector_progress(conn, job, count, len(devices))
+
+        skipped, time_saved = api.get_skipped_counts()
+        if skipped > start_skipped:
+            api.logger.info(f"Skipped {skipped - start_skipped} xAPI calls to offline devices "
+                            f"(~{time_saved - start_time_saved:.1f}s saved)")
+
+        # Mark devices table as changed (invalidates cached dashboard responses)
+        db.update_sync_state(conn, 'devices')
+        db.update_collector_status(conn, job, 'idle')
+
+        return len(devices)
+    except Exception as e:
+        db.update_collector_status(conn, job, 'failed', f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        db.close_connection(conn)
+
+
+def next_poll_interval(interval: int | None, new_calls: int, active_calls: int, last_call: str | None) -> int:
+    """
+    Determine a device's next call history poll interval (adaptive polling). Devices in a call are polled often, devices
+    with recent calls every refresh cycle, idle devices back off exponentially up to the configured maximum
+    :param interval: Current poll interval (minutes, None if never polled)
+    :param new_calls: New call history entries found by this poll
+    :param active_calls: Active calls on the device (as of the last inventory sync)
+    :param last_call: Start time of the device's most recent call (DB format), None if no calls seen
+    :return: Next poll interval (minutes)
+    """
+    if active_calls:
+        return config.ADAPTIVE_POLL_MIN_INTERVAL
+
+    recent_call = False
+    if last_call:
+        last_call_time = datetime.strptime(last_call, util.DB_TIME_FORMAT).replace(tzinfo=pytz.utc)
+        recent_call = datetime.now(pytz.utc) - last_call_time < timedelta(hours=config.ADAPTIVE_POLL_RECENT_CALL_HOURS)
+
+    if new_calls or recent_call or interval is None:
+        return config.CALL_HISTORY_REFRESH_CYCLE
+
+    # Idle, back off
+    return min(interval * 2, config.ADAPTIVE_POLL_MAX_INTERVAL)
+
+
+def select_devices_to_poll(conn, org_id: str, shard: int, shards: int) -> list[tuple]:
+    """
+    Select devices due for a call history poll (adaptive polling skips offline devices and devices polled recently).
+    With sharding, devices never polled before are only picked up in their own shard's slot (staggers the first cycle)
+    :param conn: DB connection object
+    :param org_id: Org to select devices for
+    :param shard: Current shard
+    :param shards: Number of shards
+    :return: Poll state entries (device_id, connection_status, active_calls, interval, next_poll, last_poll, last_call,
+    last_success)
+    """
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+
+    due_devices = []
+    for poll_state in db.query_device_poll_state(conn, org_id):
+        device_id, connection_status, next_poll, last_poll = poll_state[0], poll_state[1], poll_state[4], poll_state[5]
+        if is_offline(connection_status):
+            continue
+        if last_poll is None and util.device_shard(device_id, shards) != shard:
+            continue
+        if next_poll is None or next_poll <= now:
+            due_devices.append(poll_state)
+
+    return due_devices
+
+
+def get_device_call_history_periodically(api: WebexDeviceAPI) -> int:
+    """
+    Get All Call history across all Webex Devices in the background (every X minutes, only retain calls younger than X days - both configured in config.py).
+    With adaptive polling, the job runs every ADAPTIVE_POLL_MIN_INTERVAL minutes and only polls devices which are due.
+    With sharding, each run polls the next shard (bucket) of devices. Devices are polled stalest first, and progress is
+    checkpointed so a run interrupted by a restart resumes with the devices it hadn't synced yet
+    :param api: WebexDeviceAPI used to get call history for all devices of the api's org, add to DB table
+    :return: Number of devices polled
+    """
+    job = org_job_name('call_history', api.org_id)
+
+    # Connection to DB (one-time)
+    conn = db.create_connection(db.db_path)
+    db.update_collector_status(conn, job, 'running')
+    start_time = datetime.now(pytz.utc)
+
+    # Resume an interrupted cycle (same shard and cycle start), else poll the next shard (rotation survives restarts)
+    shards = config.CALL_HISTORY_SHARDS
+    checkpoint = db.query_sync_checkpoint(conn, job)
+    resume = checkpoint is not None and not checkpoint[6]
+    if resume:
+        shard, cycle_start = checkpoint[1] % shards, checkpoint[2]
+        api.logger.info(f"Resuming interrupted {job} cycle (shard {shard}, started {cycle_start}, last device "
+                        f"{checkpoint[3]}, {checkpoint[4]}/{checkpoint[5]} devices synced)")
+    else:
+        if api.org_id in next_history_shard or checkpoint is None:
+            shard = next_history_shard.get(api.org_id, 0) % shards
+        else:
+            shard = (checkpoint[1] + 1) % shards
+        cycle_start = start_time.strftime(util.DB_TIME_FORMAT)
+    next_history_shard[api.org_id] = (shard + 1) % shards
+
+    try:
+        # Get Device List (all devices in the current shard, or only devices due for a poll)
+        if config.ADAPTIVE_POLLING:
+            devices = select_devices_to_poll(conn, api.org_id, shard, shards)
+        else:
+            devices = [poll_state for poll_state in db.query_device_poll_state(conn, api.org_id)
+                       if util.device_shard(poll_state[0], shards) == shard]
+
+        # Skip devices the interrupted cycle already synced, then sync the stalest devices first (never synced first)
+        if resume:
+            devices = [poll_state for poll_state in devices if poll_state[7] is None or poll_state[7] < cycle_start]
+        devices.sort(key=lambda poll_state: poll_state[7] or '')
+
+        db.start_sync_checkpoint(conn, job, shard, cycle_start, len(devices))
+
+        # Calculate x days ago (ensure only historical entries within x days saved)
+        x_days_ago = datetime.now(pytz.utc) - timedelta(days=config.CALL_HISTORY_MAX_PERIOD)
+
+        # Get Call History device by device (progress is visible to the web app while the cycle runs)
+        changed_entries = 0
+        for count, (device_id, _, active_calls, interval, _, _, last_call, _) in enumerate(devices, start=1):
+            call_history = api.get_call_history([device_id])
+
+            new_calls = 0
+            if device_id in call_history:
+                new_entries = db.add_history_entries(conn, x_days_ago, call_history[device_id], api.org_id)
+                db.update_device_sync_success(conn, device_id)
+
+                # Feed the new calls (oldest first) to the device's quality degradation detector, and the worst
+                # offender indexes
+                if new_entries:
+                    update_device_quality(conn, device_id, api.org_id,
+                                          [call_quality_observation(entry) for entry in reversed(new_entries)])
+                    update_worst_offenders(conn, api.org_id, new_entries)
+                    evaluate_call_alerts(api.org_id, device_id, new_entries)
+                new_calls = len(new_entries)
+
+                # Most recent call first
+                if call_history[device_id]:
+                    last_call = datetime.strptime(call_history[device_id][0]['StartTimeUTC'],
+                                                  '%Y-%m-%dT%H:%M:%SZ').strftime(util.DB_TIME_FORMAT)
+            changed_entries += new_calls
+
+            # Schedule next poll
+            if config.ADAPTIVE_POLLING:
+                interval = next_poll_interval(interval, new_calls, active_calls, last_call)
+                next_poll = datetime.now(pytz.utc) + timedelta(minutes=interval)
+                db.update_device_poll_state(conn, device_id, interval, next_poll, last_call)
+
+            db.update_collector_progress(conn, job, count, len(devices))
+            db.update_sync_checkpoint(conn, job, device_id, count)
+
+        db.complete_sync_checkpoint(conn, job)
+
+        # Delete all entries older than 30 days (cleanup)
+        changed_entries += db.delete_old_call_entries(conn, x_days_ago)
+        db.delete_old_worst_offenders(conn, x_days_ago)
+
+        # Mark call history table as changed (invalidates cached call report responses)
+        if changed_entries:
+            db.update_sync_state(conn, 'call_history')
+
+        if shards > 1:
+            duration = (datetime.now(pytz.utc) - start_time).total_seconds()
+            db.update_shard_metrics(conn, api.org_id, shard, len(devices), start_time, duration)
+
+        db.update_collector_status(conn, job, 'idle')
+
+        return len(devices)
+    except Exception as e:
+        db.update_collector_status(conn, job, 'failed', f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        # Close connection to DB
+        db.close_connection(conn)
+
+
+def call_quality_observation(entry: tuple) -> dict:
+    """
+    Quality detector observation of a call history entry
+    :param entry: Call history entry (call_history column order)
+    :return: Metric values (MOSS 'N/A' as None, call failure as 0 / 1) and the call's start time
+    """
+    return {
+        'start_time': entry[5],
+        'a_mos': entry[9] if entry[9] != 'N/A' else None,
+        'v_mos': entry[10] if entry[10] != 'N/A' else None,
+        'a_pkt_loss_max': entry[11],
+        'v_pkt_loss_max': entry[12],
+        'a_jit_max': entry[13],
+        'v_jit_max': entry[14],
+        'failure_rate': float(entry[8] in config.CALL_FAILURE_DISCONNECT_TYPES)
+    }
+
+
+def media_sample_observation(audio_in_jit: float | None, audio_out_jit: float | None, audio_in_loss: float | None,
+                             audio_out_loss: float | None, video_in_jit: float | None, video_out_jit: float | None,
+                             video_in_loss: float | None, video_out_loss: float | None) -> dict:
+    """
+    Quality detector observation of an active call media sample (same metrics as a call history entry, no failure rate)
+    :return: Metric values (None if not sampled)
+    """
+
+    def stream_max(incoming: float | None, outgoing: float | None) -> float | None:
+        values = [value for value in (incoming, outgoing) if value is not None]
+        return max(values) if values else None
+
+    audio_moss = util.calculate_mos(audio_in_jit, audio_out_jit, audio_in_loss, audio_out_loss)
+    video_moss = util.calculate_mos(video_in_jit, video_out_jit, video_in_loss, video_out_loss)
+
+    return {
+        'a_mos': audio_moss if audio_moss != 'N/A' else None,
+        'v_mos': video_moss if video_moss != 'N/A' else None,
+        'a_pkt_loss_max': stream_max(audio_in_loss, audio_out_loss),
+        'v_pkt_loss_max': stream_max(video_in_loss, video_out_loss),
+        'a_jit_max': stream_max(audio_in_jit, audio_out_jit),
+        'v_jit_max': stream_max(video_in_jit, video_out_jit)
+    }
+
+
+def update_device_quality(conn, device_id: str, org_id: str, observations: list[dict], update_baseline: bool = True):
+    """
+    Update a device's quality degradation detector with new observations, incrementally (only the device's persisted
+    detector state is read, never its call history)
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param org_id: Org the device belongs to
+    :param observations: New observations, oldest first (see call_quality_observation, media_sample_observation)
+    :param update_baseline: False for active call samples (only recent quality moves)
+    """
+    state, last_call = db.query_device_quality_state(conn, device_id)
+
+    # Skip calls the detector already saw (after a call history reset, its backfill comes back as new entries)
+    if last_call:
+        observations = [observation for observation in observations
+                        if observation.get('start_time') is None or observation['start_time'] > last_call]
+    if not observations:
+        return
+
+    call_times = [observation['start_time'] for observation in observations if observation.get('start_time')]
+    if call_times:
+        last_call = max(call_times)
+
+    for observation in observations:
+        util.update_quality_state(state, observation, config.QUALITY_BASELINE_ALPHA, config.QUALITY_RECENT_ALPHA,
+                                  config.QUALITY_BASELINE_MIN_CALLS, config.QUALITY_DEGRADATION_THRESHOLD,
+                                  update_baseline)
+
+    # No baseline yet (ex: active call samples of a device without completed calls)
+    if not state:
+        return
+
+    score, degraded = util.score_quality_state(state, config.QUALITY_BASELINE_MIN_CALLS,
+                                               config.QUALITY_DEGRADATION_THRESHOLD)
+    db.update_device_quality_state(conn, device_id, org_id, state, score, degraded, last_call)
+
+
+def update_worst_offenders(conn, org_id: str, new_entries: list[tuple]):
+    """
+    Merge new calls into the worst offender indexes of their day (bounded top WORST_OFFENDERS_TOP_N heaps: lowest MOS
+    calls, highest peak packet loss devices). A device's peak loss only grows within a day, so a device left out of a
+    day's index can only come back with a higher loss than it had
+    :param conn: DB connection object
+    :param org_id: Org the calls belong to
+    :param new_entries: New call history entries (call_history column order)
+    """
+    top_n = config.WORST_OFFENDERS_TOP_N
+
+    buckets = {}
+    for entry in new_entries:
+        buckets.setdefault(entry[5][:10], []).append(entry)
+
+    for bucket, entries in buckets.items():
+        calls = db.query_worst_calls_bucket(conn, org_id, bucket)
+        devices = {device_id: (peak_loss, call_id, start_time)
+                   for device_id, peak_loss, call_id, start_time in db.query_worst_devices_bucket(conn, org_id, bucket)}
+
+        for entry in entries:
+            # Call MOS: worst of audio / video (calls without a MOS value aren't ranked)
+            moss = [value for value in (entry[9], entry[10]) if value != 'N/A']
+            if moss:
+                calls.append((entry[0], entry[1], entry[5], min(moss), entry[9], entry[10]))
+
+            peak_loss = max(entry[11], entry[12])
+            if entry[1] not in devices or peak_loss > devices[entry[1]][0]:
+                devices[entry[1]] = (peak_loss, entry[0], entry[5])
+
+        worst_calls = heapq.nsmallest(top_n, calls, key=lambda call: call[3])
+        worst_devices = heapq.nlargest(top_n, ((device_id, *peak) for device_id, peak in devices.items()),
+                                       key=lambda device: device[1])
+        db.replace_worst_offenders_bucket(conn, org_id, bucket, worst_calls, worst_devices)
+
+
+def rescore_call_history(logger, batch_size: int = RESCORE_BATCH_SIZE) -> int:
+    """
+    Recompute the stored MOSS of every call with the active MOS model (ex: after changing MOS_MODEL or its parameters),
+    in batches. The worst offender indexes are rebuilt and the quality detector's MOSS baselines are learned again
+    :param logger: Logger Object
+    :param batch_size: Calls rescored per batch
+    :return: Number of calls rescored
+    """
+    model, _ = util.get_mos_model()
+    logger.info(f"Rescoring call history with MOS model '{model}'...")
+
+    # Get DB connection in thread
+    conn = db.create_connection(db.db_path)
+    db.delete_worst_offenders(conn)
+
+    rescored, after_rowid = 0, 0
+    while True:
+        batch = db.query_call_history_batch(conn, after_rowid, batch_size)
+        if not batch:
+            break
+
+        # Per stream metrics (rowid first, then call_history columns)
+        streams = np.array([entry[17:25] for entry in batch], dtype=float)
+
+        # Calls stored without per stream metrics: score the stored maxima as a single (worst case) stream
+        maxima = np.array([entry[12:16] for entry in batch], dtype=float)
+        missing = np.isnan(streams).all(axis=1)
+        streams[missing, 0], streams[missing, 2] = maxima[missing, 2], maxima[missing, 0]
+        streams[missing, 4], streams[missing, 6] = maxima[missing, 3], maxima[missing, 1]
+
+        audio_moss = util.mos_values(util.calculate_mos_batch(streams[:, 0], streams[:, 1], streams[:, 2],
+                                                              streams[:, 3]))
+        video_moss = util.mos_values(util.calculate_mos_batch(streams[:, 4], streams[:, 5], streams[:, 6],
+                                                              streams[:, 7]))
+        db.update_call_mos(conn, [(audio_mos, video_mos, entry[0])
+                                  for entry, audio_mos, video_mos in zip(batch, audio_moss, video_moss)])
+
+        # Rebuild the worst offender indexes from the rescored calls
+        org_entries = {}
+        for entry, audio_mos, video_mos in zip(batch, audio_moss, video_moss):
+            org_entries.setdefault(entry[16], []).append(entry[1:10] + (audio_mos, video_mos) + entry[12:])
+        for org_id, entries in org_entries.items():
+            update_worst_offenders(conn, org_id, entries)
+
+        rescored += len(batch)
+        after_rowid = batch[-1][0]
+        logger.info(f"Rescored {rescored} calls")
+
+    # Learned MOSS baselines no longer match the stored scores
+    for device_id, org_id, state in db.query_device_quality_states(conn):
+        state.pop('a_mos', None)
+        state.pop('v_mos', None)
+        score, degraded = util.score_quality_state(state, config.QUALITY_BASELINE_MIN_CALLS,
+                                                   config.QUALITY_DEGRADATION_THRESHOLD)
+        db.update_device_quality_state(conn, device_id, org_id, state, score, degraded)
+
+    # Mark call history table as changed (invalidates cached call report responses)
+    db.update_sync_state(conn, 'call_history')
+    db.close_connection(conn)
+
+    logger.info(f"Rescoring complete, {rescored} calls rescored with MOS model '{model}'")
+    return rescored
+
+
+def build_media_timeline(samples: np.ndarray, bucket_seconds: int) -> list[tuple]:
+    """
+    Aggregate a call's media samples into fixed time buckets (worst MOSS, max packet loss and jitter per bucket)
+    :param samples: Sample rows (MEDIA_SAMPLE_COLUMNS, oldest first)
+    :param bucket_seconds: Timeline bucket size (seconds)
+    :return: List of (bucket_time, samples, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max)
+    entries, missing values as None
+    """
+    if not len(samples):
+        return []
+
+    # MOSS per sample (Minimum of Incoming and Outgoing)
+    audio_moss = util.calculate_mos_batch(samples[:, 1], samples[:, 2], samples[:, 3], samples[:, 4])
+    video_moss = util.calculate_mos_batch(samples[:, 5], samples[:, 6], samples[:, 7], samples[:, 8])
+
+    # Samples are chronological, each bucket is a contiguous run of samples
+    buckets = samples[:, 0] // bucket_seconds * bucket_seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+
+    # fmin / fmax ignore missing (NaN) values, a bucket value is only missing if all its samples are
+    columns = [np.fmin.reduceat(audio_moss, starts), np.fmin.reduceat(video_moss, starts),
+               np.fmax.reduceat(np.fmax(samples[:, 3], samples[:, 4]), starts),
+               np.fmax.reduceat(np.fmax(samples[:, 7], samples[:, 8]), starts),
+               np.fmax.reduceat(np.fmax(samples[:, 1], samples[:, 2]), starts),
+               np.fmax.reduceat(np.fmax(samples[:, 5], samples[:, 6]), starts)]
+    columns = [[None if value != value else round(value, 2) for value in column.tolist()] for column in columns]
+
+    bucket_times = [datetime.fromtimestamp(bucket, pytz.utc).strftime(util.DB_TIME_FORMAT)
+                    for bucket in buckets[starts].tolist()]
+
+    return list(zip(bucket_times, counts.tolist(), *columns))
+
+
+def sample_active_call_media(api: WebexDeviceAPI) -> int:
+    """
+    Sample the media channel netstat of an org's in-progress calls (devices in a call as of the last inventory sync, and
+    devices with calls being sampled). Calls which ended are aggregated into the persisted media quality timeline
+    :param api: The org's WebexDeviceAPI instance
+    :return: Number of devices sampled
+    """
+    calls = active_call_samples.setdefault(api.org_id, {})
+
+    # Get DB connection in thread
+    conn = db.create_connection(db.db_path)
+
+    device_states = {device_id: (connection_status, active_calls)
+                     for device_id, connection_status, active_calls, *_ in db.query_device_poll_state(conn, api.org_id)}
+    device_ids = ({device_id for device_id, (_, active_calls) in device_states.items() if active_calls} |
+                  {device_id for device_id, _ in calls})
+
+    devices_sampled = 0
+    for device_id in device_ids:
+        # Removed and offline devices have no calls in progress (calls being sampled have ended)
+        connection_status, _ = device_states.get(device_id, ('Offline', 0))
+        if is_offline(connection_status):
+            active_calls = []
+        else:
+            active_calls = api.get_active_calls([device_id])
+            devices_sampled += 1
+
+        now = datetime.now(pytz.utc)
+        active_call_ids = set()
+        sample_observations = []
+        for call in active_calls:
+            call_id = str(call.get('id', '-1'))
+            active_call_ids.add(call_id)
+
+            state = calls.get((device_id, call_id))
+            if state is None:
+                call_start = now - timedelta(seconds=int(call.get('Duration', 0)))
+                state = calls[(device_id, call_id)] = {
+                    'call_start': call_start.strftime(util.DB_TIME_FORMAT),
+                    'samples': util.RingBuffer(config.MEDIA_SAMPLE_BUFFER_SIZE, len(MEDIA_SAMPLE_COLUMNS))}
+
+            media_channels = api.get_call_media_channels(device_id, call_id)
+            audio_in_jit, audio_in_loss = util.netstat_metrics(media_channels['Audio']['Incoming'])
+            audio_out_jit, audio_out_loss = util.netstat_metrics(media_channels['Audio']['Outgoing'])
+            video_in_jit, video_in_loss = util.netstat_metrics(media_channels['Video']['Incoming'])
+            video_out_jit, video_out_loss = util.netstat_metrics(media_channels['Video']['Outgoing'])
+
+            state['samples'].append([now.timestamp(), audio_in_jit, audio_out_jit, audio_in_loss, audio_out_loss,
+                                     video_in_jit, video_out_jit, video_in_loss, video_out_loss])
+
+            # Active call quality moves the device's recent quality (baseline only learns from completed calls), and
+            # may raise an alert while the call is still in progress
+            observation = media_sample_observation(audio_in_jit, audio_out_jit, audio_in_loss, audio_out_loss,
+                                                   video_in_jit, video_out_jit, video_in_loss, video_out_loss)
+            sample_observations.append(observation)
+            if api.org_id in alert_engines:
+                alert_engines[api.org_id].evaluate(device_id, call_id, 'active', observation,
+                                                   call_start=state['call_start'])
+
+        if sample_observations:
+            update_device_quality(conn, device_id, api.org_id, sample_observations, update_baseline=False)
+
+        # Persist the timeline of calls which ended
+        ended_calls = [key for key in calls if key[0] == device_id and key[1] not in active_call_ids]
+        for key in ended_calls:
+            state = calls.pop(key)
+            timeline = build_media_timeline(state['samples'].values(), config.MEDIA_TIMELINE_BUCKET)
+            db.add_media_timeline(conn, device_id, api.org_id, key[1], state['call_start'], timeline)
+            api.logger.info(f"Call {key[1]} on device {device_id} ended, stored media quality timeline "
+                            f"({len(state['samples'])} samples, {len(timeline)} buckets)")
+
+        # Keep the device's call count current, a call ended - pull the call history poll forward (new entry)
+        if not is_offline(connection_status):
+            db.update_device_activity(conn, device_id, len(active_calls), bool(ended_calls))
+
+    # Delete timelines older than the call history period (cleanup)
+    db.delete_old_media_timelines(conn, datetime.now(pytz.utc) - timedelta(days=config.CALL_HISTORY_MAX_PERIOD))
+
+    db.close_connection(conn)
+
+    return devices_sampled
+
+
+def evaluate_call_alerts(org_id: str, device_id: str, new_entries: list[tuple]):
+    """
+    Check a device's new call history entries against the alert thresholds (calls which ended more than
+    ALERT_MAX_CALL_AGE minutes ago never alert, ex: history backfilled on first sync)
+    :param org_id: Org the device belongs to
+    :param device_id: Device ID
+    :param new_entries: New call history entries (call_history column order)
+    """
+    if org_id not in alert_engines:
+        return
+
+    oldest_end_time = (datetime.now(pytz.utc) - timedelta(minutes=config.ALERT_MAX_CALL_AGE)).strftime(
+        util.DB_TIME_FORMAT)
+    for entry in reversed(new_entries):
+        if entry[6] >= oldest_end_time:
+            alert_engines[org_id].evaluate(device_id, entry[0], 'history', call_quality_observation(entry),
+                                           call_start=entry[5])
+
+
+def send_alert_digest(api: WebexDeviceAPI) -> int:
+    """
+    Send the alerts queued since the last digest to every configured sink, as one digest (a burst of bad calls is a
+    single message per sink). A sink which fails keeps its digest, it is sent again with the next one
+    :param api: The org's WebexDeviceAPI instance
+    :return: Number of alerts sent (new alerts, and alerts sent again to a sink which failed before)
+    """
+    engine = alert_engines[api.org_id]
+    digest = engine.take_digest()
+
+    # Label alerts with the device name and site
+    if digest is not None:
+        conn = db.create_connection(db.db_path)
+        labels = db.query_device_labels(conn, [alert['device_id'] for alert in digest['alerts']])
+        db.close_connection(conn)
+        for alert in digest['alerts']:
+            alert['endpoint'], alert['site'] = labels.get(alert['device_id'], (None, None))
+
+    sent, failed = 0, []
+    for name, sink in zip(config.ALERT_SINKS, alerts.create_alert_sinks(config.ALERT_SINKS, api, api.logger)):
+        sink_digest = engine.sink_digest(name, digest)
+        if sink_digest is None:
+            continue
+
+        if sink.send(sink_digest):
+            sent = max(sent, sink_digest['total'])
+        else:
+            engine.requeue(name, sink_digest)
+            failed.append(name)
+
+    if failed:
+        raise RuntimeError(f"Alert digest not delivered by {failed}, queued for the next digest")
+
+    return sent
+
+
+def record_job_run(job: str, status: str, start_time: datetime, end_time: datetime | None = None, **run_details):
+    """
+    Persist a scheduler job run (and drop run history older than JOB_RUN_HISTORY_DAYS)
+    :param job: Job name
+    :param status: Run outcome (ok, failed, skipped, missed)
+    :param start_time: Run start time (UTC)
+    :param end_time: Run end time (UTC), defaults to start_time (runs which never started)
+    :param run_details: Optional devices_processed, api_calls, rate_limited, error, api_calls_skipped, time_saved
+    """
+    conn = db.create_connection(db.db_path)
+    db.add_job_run(conn, job, status, start_time, end_time or start_time, **run_details)
+    db.delete_old_job_runs(conn, datetime.now(pytz.utc) - timedelta(days=config.JOB_RUN_HISTORY_DAYS))
+    db.close_connection(conn)
+
+
+class JobRunner:
+    """
+    Scheduler job wrapper: single-flight (a run is skipped while the previous run is still in progress) and persisted run
+    accounting (start, end, duration, devices processed, API calls and 429s made by the run)
+    """
+
+    def __init__(self, name: str, function, api: WebexDeviceAPI, logger):
+        self.name = name
+        self.function = function
+        self.api = api
+        self.logger = logger
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        start_time = datetime.now(pytz.utc)
+
+        if not self.lock.acquire(blocking=False):
+            self.logger.warning(f"Previous {self.name} run still in progress, skipping this run")
+            record_job_run(self.name, 'skipped', start_time)
+            return
+
+        try:
+            # Request counters are per thread, the difference is what this run made
+            start_api_calls, start_rate_limited = self.api.get_request_counts()
+            start_skipped, start_time_saved = self.api.get_skipped_counts()
+
+            status, error, devices_processed = 'ok', None, 0
+            try:
+                devices_processed = self.function(self.api)
+            except Exception as e:
+                status, error = 'failed', f"{type(e).__name__}: {e}"
+                self.logger.error(f"{self.name} run failed: {error}")
+
+            api_calls, rate_limited = self.api.get_request_counts()
+            skipped, time_saved = self.api.get_skipped_counts()
+            record_job_run(self.name, status, start_time, datetime.now(pytz.utc), devices_processed=devices_processed,
+                           api_calls=api_calls - start_api_calls, rate_limited=rate_limited - start_rate_limited,
+                           error=error, api_calls_skipped=skipped - start_skipped,
+                           time_saved=round(time_saved - start_time_saved, 3))
+        finally:
+            self.lock.release()
+
+
+def record_skipped_run(event: JobEvent):
+    """
+    Scheduler listener, records runs APScheduler didn't start (previous run still in progress, or misfire grace time
+    exceeded)
+    :param event: APScheduler job event (execution event when missed, submission event when max instances reached)
+    """
+    if event.job_id.split(':')[0] not in SYNC_JOBS:
+        return
+
+    if event.code == EVENT_JOB_MISSED:
+        record_job_run(event.job_id, 'missed', event.scheduled_run_time.astimezone(pytz.utc))
+    else:
+        for scheduled_run_time in event.scheduled_run_times:
+            record_job_run(event.job_id, 'skipped', scheduled_run_time.astimezone(pytz.utc))
+
+
+def update_heartbeat():
+    """
+    Record collector liveness (read by the web app to report collector health)
+    """
+    conn = db.create_connection(db.db_path)
+    db.update_collector_heartbeat(conn, os.getpid())
+    db.close_connection(conn)
+
+
+def enrich_device_fields(api: WebexDeviceAPI, device: dict) -> dict:
+    """
+    Obtains additional fields and information about each device for webpage display (ex: location name given a location id)
+    :param api: WebexDeviceAPI instance used for the lookups
+    :param device: Specific device, originally containing only native API fields
+    :return: "Enriched" device dictionary, additional fields added for further processing and displaying on dashboard
+    """
+    # Get Device Location Name (if possible)
+    if 'locationId' in device:
+        location_details = api.get_location_details(device['locationId'])
+        device['site'] = location_details.get('name', 'Unknown')
+        device['timeZone'] = location_details.get('timeZone', 'N/A')
+    else:
+        device['site'] = 'Unknown'
+        device['timeZone'] = 'N/A'
+
+    # Display friendly status
+    device['connectionStatus'] = device['connectionStatus'].capitalize()
+
+    if device['connectionStatus'] == 'Connected_with_issues':
+        device['connectionStatus'] = "Issues"
+    elif device['connectionStatus'] == 'Offline_expired':
+        device['connectionStatus'] = "Offline Expired"
+
+    # Determine 'mode' (and Workspace name if relevant)
+    if 'workspaceId' in device:
+        device['mode'] = 'Shared'
+
+        # Get workspace name
+        workspace_details = api.get_workspace_details(device['workspaceId'])
+
+        if workspace_details:
+            device['room'] = ''
+            device['email'] = ''
+
+            if 'displayName' in workspace_details:
+                device['room'] = workspace_details['displayName']
+
+            # Get mailbox info (if integration enabled and assigned)
+            if 'calendar' in workspace_details and workspace_details['calendar']['type'] != 'none':
+                device['email'] = workspace_details['calendar'].get('emailAddress', "Unknown")
+        else:
+            device['room'] = ''
+            device['email'] = ''
+    else:
+        # Personal mode
+        device['mode'] = 'Personal'
+        device['room'] = ''
+        device['email'] = ''
+
+    # Offline devices can't answer xAPI calls, keep the cached xAPI fields (xapiUpdated marks when they were fetched)
+    if is_offline(device['connectionStatus']):
+        api.skip_request()
+        device['uptime'] = None
+        device['uptimeSeconds'] = None
+        device['xapiUpdated'] = None
+        device['activeCalls'] = 0
+        return device
+
+    # Get Uptime
+    system_unit_information = api.get_system_unit_information(device['id'])
+    if 'Uptime' in system_unit_information:
+        uptime = system_unit_information['Uptime']
+        device['uptime'] = util.convert_seconds_to_time(uptime)
+        device['uptimeSeconds'] = int(uptime)
+    else:
+        device['uptime'] = 'Unknown'
+        device['uptimeSeconds'] = None
+    device['xapiUpdated'] = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+
+    # Get Active Call Count (drives adaptive call history polling)
+    device['activeCalls'] = int(system_unit_information.get('State', {}).get('NumberOfActiveCalls', 0))
+
+    return device
+
+
+def add_org_jobs(scheduler: BackgroundScheduler | BlockingScheduler, api: WebexDeviceAPI, logger):
+    """
+    Add an org's sync jobs (device inventory, call history, active call media sampling and alert digests) to the
+    scheduler
+    :param scheduler: APScheduler instance
+    :param api: The org's WebexDeviceAPI instance
+    :param logger: Logger Object
+    """
+    # Single-flight (max_instances), missed runs coalesced and dropped past the misfire grace time
+    job_defaults = {'max_instances': 1, 'coalesce': True, 'misfire_grace_time': config.JOB_MISFIRE_GRACE_TIME}
+
+    # Schedule call history and device list background thread - every X minutes - trigger both now (call history
+    # resumes an interrupted cycle right away, devices not synced yet are picked up by later runs)
+    devices_job = org_job_name('devices', api.org_id)
+    scheduler.add_job(JobRunner(devices_job, get_devices_periodically, api, logger), id=devices_job,
+                      trigger='interval', minutes=5, next_run_time=datetime.now(), **job_defaults)
+
+    # Adaptive polling runs the call history job more often, but each run only polls the devices which are due. Sharding
+    # splits the refresh cycle into one slot per shard (each device is still polled once per refresh cycle)
+    if config.ADAPTIVE_POLLING:
+        history_cycle = config.ADAPTIVE_POLL_MIN_INTERVAL * 60
+    else:
+        history_cycle = config.CALL_HISTORY_REFRESH_CYCLE * 60 / config.CALL_HISTORY_SHARDS
+    history_job = org_job_name('call_history', api.org_id)
+    scheduler.add_job(JobRunner(history_job, get_device_call_history_periodically, api, logger), id=history_job,
+                      trigger='interval', seconds=history_cycle, next_run_time=datetime.now(), **job_defaults)
+
+    # Active call media quality sampling (every MEDIA_SAMPLE_INTERVAL seconds, 0 disables it)
+    if config.MEDIA_SAMPLE_INTERVAL:
+        media_job = org_job_name('media_quality', api.org_id)
+        scheduler.add_job(JobRunner(media_job, sample_active_call_media, api, logger), id=media_job,
+                          trigger='interval', seconds=config.MEDIA_SAMPLE_INTERVAL, **job_defaults)
+
+    # Call quality alerts, queued by the call history and media sampling jobs and sent as a digest
+    if config.ALERT_FEATURE:
+        alert_engines[api.org_id] = alerts.AlertEngine(api.org_id, config.ALERT_THRESHOLDS,
+                                                       config.ALERT_DEBOUNCE_MINUTES, config.ALERT_DIGEST_MAX_ALERTS)
+        alerts_job = org_job_name('alerts', api.org_id)
+        scheduler.add_job(JobRunner(alerts_job, send_alert_digest, api, logger), id=alerts_job, trigger='interval',
+                          seconds=config.ALERT_DIGEST_INTERVAL, **job_defaults)
+
+
+def acquire_org_locks(scheduler: BackgroundScheduler | BlockingScheduler, apis: dict[str, WebexDeviceAPI],
+                      logger) -> list[str]:
+    """
+    Acquire the scheduler lock of every org not yet synced by this process, and add the sync jobs of the orgs acquired
+    :param scheduler: APScheduler instance
+    :param apis: WebexDeviceAPI instance per org assigned to this process
+    :param logger: Logger Object
+    :return: Orgs acquired by this call
+    """
+    acquired = []
+    for org_id, api in apis.items():
+        if org_id in scheduler_locks:
+            continue
+
+        lock = util.acquire_lock(org_lock_path(org_id))
+        if lock is None:
+            continue
+
+        scheduler_locks[org_id] = lock
+        add_org_jobs(scheduler, api, logger)
+        acquired.append(org_id)
+
+    if acquired:
+        logger.info(f"Scheduler lock acquired (pid {os.getpid()}) for orgs {acquired}, starting background sync jobs")
+
+    return acquired
+
+
+def start_scheduler(scheduler: BackgroundScheduler | BlockingScheduler, apis: dict[str, WebexDeviceAPI],
+                    logger) -> bool:
+    """
+    Add the sync jobs to scheduler and start it if this process wins the scheduler lock of at least one assigned org.
+    Exactly one process (a web worker or a standalone collector) runs an org's sync jobs, the others stay stateless web
+    workers / standby collectors. Orgs locked by another process are retried while the scheduler runs
+    :param scheduler: APScheduler instance (background scheduler in the web app, blocking scheduler in the collector)
+    :param apis: WebexDeviceAPI instance per org assigned to this process
+    :param logger: Logger Object
+    :return: True if a lock was acquired and the scheduler started (a blocking scheduler only returns on shutdown)
+    """
+    if not acquire_org_locks(scheduler, apis, logger):
+        logger.info(f"Scheduler locks held by other processes, retrying in {SCHEDULER_LOCK_RETRY} seconds...")
+        return False
+
+    # Single-flight (max_instances), missed runs coalesced and dropped past the misfire grace time
+    job_defaults = {'max_instances': 1, 'coalesce': True, 'misfire_grace_time': config.JOB_MISFIRE_GRACE_TIME}
+
+    # Pick up orgs whose lock holder exits later on
+    if len(scheduler_locks) < len(apis):
+        scheduler.add_job(acquire_org_locks, id='org_locks', trigger='interval', seconds=SCHEDULER_LOCK_RETRY,
+                          args=[scheduler, apis, logger], **job_defaults)
+
+    scheduler.add_job(update_heartbeat, id='heartbeat', trigger='interval', seconds=HEARTBEAT_INTERVAL,
+                      next_run_time=datetime.now(), **job_defaults)
+
+    # Record runs the scheduler skipped or dropped
+    scheduler.add_listener(record_skipped_run, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+
+    scheduler.start()
+    return True
+
+
+def start_background_scheduler(scheduler: BackgroundScheduler, apis: dict[str, WebexDeviceAPI], logger):
+    """
+    Start the sync jobs on a background scheduler inside the web app, standby web workers retry the lock periodically
+    (take over the sync if the holding process exits)
+    :param scheduler: APScheduler background scheduler
+    :param apis: WebexDeviceAPI instance per org assigned to this process
+    :param logger: Logger Object
+    """
+    if not start_scheduler(scheduler, apis, logger):
+        retry = threading.Timer(SCHEDULER_LOCK_RETRY, start_background_scheduler, args=[scheduler, apis, logger])
+        retry.daemon = True
+        retry.start()
+
+
+def run_once(apis: dict[str, WebexDeviceAPI], logger):
+    """
+    Run a single device sync followed by a single call history sync (every shard) for each org, then return (alerts
+    raised by the new calls are sent before returning)
+    :param apis: WebexDeviceAPI instance per org to sync
+    :param logger: Logger Object
+    """
+    for org_id, api in apis.items():
+        logger.info(f"Running one device and call history sync cycle for org {org_id}...")
+        JobRunner(org_job_name('devices', org_id), get_devices_periodically, api, logger)()
+
+        if config.ALERT_FEATURE:
+            alert_engines[org_id] = alerts.AlertEngine(org_id, config.ALERT_THRESHOLDS, config.ALERT_DEBOUNCE_MINUTES,
+                                                       config.ALERT_DIGEST_MAX_ALERTS)
+
+        history_runner = JobRunner(org_job_name('call_history', org_id), get_device_call_history_periodically, api,
+                                   logger)
+        for _ in range(config.CALL_HISTORY_SHARDS):
+            history_runner()
+
+        # Alerts raised by the new calls, as one digest
+        if config.ALERT_FEATURE:
+            JobRunner(org_job_name('alerts', org_id), send_alert_digest, api, logger)()
+    logger.info("Sync cycle complete!")
+
+
+# Standalone collector process: runs the sync jobs against the shared DB on its own (set RUN_COLLECTOR_IN_WEB = False in
+# config.py so the web app only serves requests)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webex Devices Dashboard collector (device and call history sync)")
+    parser.add_argument('--once', action='store_true', help="run one sync cycle and exit")
+    parser.add_argument('--orgs', help="comma separated orgs to sync (default: COLLECTOR_ORGS, else all WEBEX_ORGS)")
+    parser.add_argument('--rescore', action='store_true',
+                        help="recompute stored call MOS with the configured MOS_MODEL and exit")
+    args = parser.parse_args()
+
+    logger = util.set_up_logging()
+
+    if args.rescore:
+        rescore_call_history(logger)
+        sys.exit(0)
+    logger_background = util.set_up_logging_background()
+
+    # Get Valid Webex Access Tokens (one API instance per assigned org)
+    orgs = assigned_orgs(args.orgs.split(',') if args.orgs else None)
+    collector_apis = create_org_apis(orgs, logger_background, PRIORITY_BULK)
+
+    if args.once:
+        run_once(collector_apis, logger)
+    else:
+        # Wait for a scheduler lock (other collectors or web workers may currently run the sync jobs)
+        while not start_scheduler(BlockingScheduler(), collector_apis, logger):
+            time.sleep(SCHEDULER_LOCK_RETRY)
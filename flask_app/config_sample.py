@@ -5,10 +5,99 @@ DEVICE_TYPE = ""
 CALL_HISTORY_MAX_PERIOD = 60
 CALL_HISTORY_REFRESH_CYCLE = 10
 
+# Adaptive call history polling (per device): devices in a call are polled every ADAPTIVE_POLL_MIN_INTERVAL minutes,
+# devices with calls in the last ADAPTIVE_POLL_RECENT_CALL_HOURS every CALL_HISTORY_REFRESH_CYCLE minutes, idle devices
+# back off exponentially up to ADAPTIVE_POLL_MAX_INTERVAL minutes, offline devices are skipped until they reconnect
+ADAPTIVE_POLLING = True
+ADAPTIVE_POLL_MIN_INTERVAL = 2
+ADAPTIVE_POLL_MAX_INTERVAL = 240
+ADAPTIVE_POLL_RECENT_CALL_HOURS = 24
+
+# Sharded call history collection: devices are split into CALL_HISTORY_SHARDS buckets (stable hash of the device id) and
+# one bucket is polled per slot, spreading requests evenly across the refresh cycle instead of one burst (1 = disabled)
+CALL_HISTORY_SHARDS = 1
+
+# Scheduler jobs: overlapping runs are never started (a run still in progress skips the next one), missed runs are
+# coalesced into one and dropped if more than JOB_MISFIRE_GRACE_TIME seconds late. Run history is kept JOB_RUN_HISTORY_DAYS
+JOB_MISFIRE_GRACE_TIME = 300
+JOB_RUN_HISTORY_DAYS = 30
+
+# Active call media quality sampling: MediaChannels netstat of in-progress calls is sampled every MEDIA_SAMPLE_INTERVAL
+# seconds (0 disables it), the last MEDIA_SAMPLE_BUFFER_SIZE samples are kept per call and aggregated into
+# MEDIA_TIMELINE_BUCKET second timeline buckets when the call ends. Calls are picked up by the next device sync
+MEDIA_SAMPLE_INTERVAL = 30
+MEDIA_SAMPLE_BUFFER_SIZE = 240
+MEDIA_TIMELINE_BUCKET = 60
+
+# MOS model used to score calls: 'heuristic' (default, see README) or 'e-model' (ITU-T G.107 R-factor). Model
+# parameters can be overridden with MOS_MODEL_PARAMETERS (ex: {'jitter_threshold': 20.0}). After a change, rescore stored
+# calls with: python collector.py --rescore
+MOS_MODEL = 'heuristic'
+MOS_MODEL_PARAMETERS = {}
+
+# Device quality degradation detector: per device baseline (slow EWMA and variance, QUALITY_BASELINE_ALPHA) and recent
+# quality (fast EWMA, QUALITY_RECENT_ALPHA) of MOS, packet loss, jitter and call failure rate (calls ending with one of
+# CALL_FAILURE_DISCONNECT_TYPES). A device is flagged as degrading once its recent quality is
+# QUALITY_DEGRADATION_THRESHOLD standard deviations worse than its baseline (baseline of QUALITY_BASELINE_MIN_CALLS calls)
+QUALITY_BASELINE_ALPHA = 0.05
+QUALITY_RECENT_ALPHA = 0.3
+QUALITY_DEGRADATION_THRESHOLD = 3.0
+QUALITY_BASELINE_MIN_CALLS = 10
+CALL_FAILURE_DISCONNECT_TYPES = ['Error', 'NetworkRejected', 'Timeout', 'Unavailable', 'UnknownRemoteSite']
+
+# Worst offenders view: lowest MOS calls and highest packet loss devices kept per day (top N, maintained as calls are
+# ingested)
+WORST_OFFENDERS_TOP_N = 20
+
+# Call quality alerts: new call history entries and active call samples are checked against ALERT_THRESHOLDS (metric ->
+# ('below' | 'above', value), metrics: a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max). A call alerts
+# once, a device at most once per ALERT_DEBOUNCE_MINUTES (later breaches are counted as suppressed), and only calls which
+# ended in the last ALERT_MAX_CALL_AGE minutes alert. Alerts are batched into one digest per org every
+# ALERT_DIGEST_INTERVAL seconds (ALERT_DIGEST_MAX_ALERTS listed, the rest counted), sent to every sink in ALERT_SINKS:
+# 'log', 'webex' (message to the ALERT_WEBEX_ROOM_ID room, posted with WEBEX_BOT_TOKEN from .env if set) and 'webhook'
+# (digest JSON posted to ALERT_WEBHOOK_URL)
+ALERT_FEATURE = False
+ALERT_THRESHOLDS = {'a_mos': ('below', 3.0), 'v_mos': ('below', 3.0), 'a_pkt_loss_max': ('above', 5.0),
+                    'v_pkt_loss_max': ('above', 5.0)}
+ALERT_DEBOUNCE_MINUTES = 30
+ALERT_MAX_CALL_AGE = 60
+ALERT_DIGEST_INTERVAL = 300
+ALERT_DIGEST_MAX_ALERTS = 50
+ALERT_SINKS = ['log']
+ALERT_WEBEX_ROOM_ID = ""
+ALERT_WEBHOOK_URL = ""
+ALERT_WEBHOOK_TIMEOUT = 10
+
+# Webex orgs to collect from: org name -> tokens file (generate one per org: python webex_tokens.py --org <name>). Each
+# org has its own token, API request gate and sync jobs, devices and calls are stored with their org name
+WEBEX_ORGS = {'default': 'tokens.json'}
+
+# Orgs synced by this process (empty = all orgs in WEBEX_ORGS). Split the orgs across collector instances by giving each
+# instance a different list (or: python collector.py --orgs org1,org2)
+COLLECTOR_ORGS = []
+
+# Webex API request gate (per process): at most API_MAX_CONCURRENT_REQUESTS in flight and API_REQUESTS_PER_SECOND on
+# average. Interactive page requests are served before background sync requests, which always leave
+# API_INTERACTIVE_RESERVE requests of budget unused
+API_MAX_CONCURRENT_REQUESTS = 4
+API_REQUESTS_PER_SECOND = 10
+API_INTERACTIVE_RESERVE = 3
+
+# Production serving (gunicorn -c gunicorn.conf.py wsgi:app): number of web worker processes. Only one process runs
+# the background sync jobs (elected via lock file)
+WEB_WORKERS = 4
+
+# Run the background sync jobs inside the web app (set to False when running the standalone collector: python collector.py)
+RUN_COLLECTOR_IN_WEB = True
+
 # ServiceNow Functionality (Open Incident Page, Closed Incident Page)
 SERVICE_NOW_FEATURE = False
 INCLUDE_ENDPOINT_NAME = False
 
+# ServiceNow incident requests: records fetched per page (sysparm_limit), request timeout in seconds (connect, read)
+SERVICE_NOW_PAGE_SIZE = 500
+SERVICE_NOW_TIMEOUT = (5, 30)
+
 # ServiceNow Filters (controls which incidents are returned to the dashboard - by default: active tickets (open),
 # last 48 hours (closed) For all available filter parameters, build filter with UI, right click query string,
 # copy query to sysparm_query
@@ -17,7 +17,9 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import argparse
 import hashlib
+import json
 import os
 import sqlite3
 from datetime import datetime, timedelta
@@ -66,15 +68,46 @@ def create_connection(db_file: str) -> sqlite3.Connection:
     return conn
 
 
-def create_tables(conn: sqlite3.Connection):
+def add_missing_column(c: sqlite3.Cursor, table: str, column: str, definition: str):
     """
-    Create initial tables (device_ids, mapping one to many to call_history table)
+    Add a column to an existing table (tables created before the column was introduced)
+    :param c: DB cursor
+    :param table: Table name
+    :param column: Column name
+    :param definition: Column type / constraints
+    """
+    columns = [entry[1] for entry in c.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in columns:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_tables(conn: sqlite3.Connection, reset: bool = False):
+    """
+    Create initial tables (device_ids, mapping one to many to call_history table). Existing data is kept (a restart
+    resumes an interrupted call history sync), unless reset or the call history table predates the current schema
     :param conn: DB connection object
+    :param reset: Remove the existing call history (and its collection state) before creating the tables
     """
     c = conn.cursor()
 
-    # Remove Existing Data (call history)
-    c.execute("DROP TABLE IF EXISTS call_history")
+    # Write-ahead logging, lets web workers read while the background sync writes
+    c.execute("PRAGMA journal_mode=WAL")
+
+    # Call history created before the generated metric columns (call report filters) can't be migrated, rebuild it
+    call_history_columns = [entry[1] for entry in c.execute("PRAGMA table_xinfo(call_history)").fetchall()]
+    if call_history_columns and 'jit_max' not in call_history_columns:
+        reset = True
+
+    # Remove Existing Data (call history, its sharded collection timing metrics and worst offender indexes). Poll state
+    # and sync checkpoints go with it, so every device is polled on the first cycle instead of waiting for a next_poll
+    # time, or being skipped by a resumed cycle, recorded before the history was dropped
+    if reset:
+        c.execute("DROP TABLE IF EXISTS call_history")
+        c.execute("DROP TABLE IF EXISTS device_poll_state")
+        c.execute("DROP TABLE IF EXISTS sync_checkpoints")
+        c.execute("DROP TABLE IF EXISTS call_history_shards")
+        c.execute("DROP TABLE IF EXISTS worst_calls")
+        c.execute("DROP TABLE IF EXISTS worst_devices")
 
     c.execute("""
               CREATE TABLE IF NOT EXISTS devices
@@ -93,9 +126,18 @@ def create_tables(conn: sqlite3.Connection):
                [region] TEXT,
                [uptime] TEXT,
                [email] TEXT,
-               [timezone] TEXT)
+               [timezone] TEXT,
+               [org_id] TEXT,
+               [xapi_updated] TEXT,
+               [uptime_seconds] INTEGER)
               """)
 
+    # Devices table created before multi-org support / xAPI field staleness tracking / uptime reset tracking
+    add_missing_column(c, 'devices', 'org_id', 'TEXT')
+    add_missing_column(c, 'devices', 'xapi_updated', 'TEXT')
+    add_missing_column(c, 'devices', 'uptime_seconds', 'INTEGER')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_devices_org_id ON devices(org_id)")
+
     c.execute("""
               CREATE TABLE IF NOT EXISTS call_history
               ([call_id] TEXT PRIMARY KEY, 
@@ -109,10 +151,24 @@ def create_tables(conn: sqlite3.Connection):
                [disconnect_reason] TEXT,
                [a_mos] REAL,
                [v_mos] REAL,
-               [a_pkt_loss_max] TEXT,
-               [v_pkt_loss_max] TEXT,
-               [a_jit_max] TEXT,
-               [v_jit_max] TEXT,
+               [a_pkt_loss_max] REAL,
+               [v_pkt_loss_max] REAL,
+               [a_jit_max] REAL,
+               [v_jit_max] REAL,
+               [org_id] TEXT,
+               [a_in_jit] REAL,
+               [a_out_jit] REAL,
+               [a_in_loss] REAL,
+               [a_out_loss] REAL,
+               [v_in_jit] REAL,
+               [v_out_jit] REAL,
+               [v_in_loss] REAL,
+               [v_out_loss] REAL,
+               [mos] REAL GENERATED ALWAYS AS (CASE WHEN typeof(a_mos) = 'real' AND typeof(v_mos) = 'real'
+                   THEN min(a_mos, v_mos) WHEN typeof(a_mos) = 'real' THEN a_mos WHEN typeof(v_mos) = 'real'
+                   THEN v_mos END) VIRTUAL,
+               [pkt_loss_max] REAL GENERATED ALWAYS AS (max(a_pkt_loss_max, v_pkt_loss_max)) VIRTUAL,
+               [jit_max] REAL GENERATED ALWAYS AS (max(a_jit_max, v_jit_max)) VIRTUAL,
                FOREIGN KEY (device_id) REFERENCES devices (device_id))
               """)
 
@@ -122,19 +178,193 @@ def create_tables(conn: sqlite3.Connection):
     # Create index for start_time column
     c.execute("CREATE INDEX IF NOT EXISTS idx_start_time ON call_history(start_time)")
 
+    # Create index for org_id column (per org call history)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_call_history_org_id ON call_history(org_id, start_time)")
+
+    # Create indexes for call report range filters (see CALL_HISTORY_RANGE_FILTERS) and disconnect reason
+    for column in CALL_HISTORY_RANGE_FILTERS.values():
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_call_history_{column} ON call_history({column})")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_call_history_disconnect ON call_history(disconnect_reason, start_time)")
+
+    # Sync state table (per table version and last sync time, used as HTTP cache validators)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS sync_state
+              ([name] TEXT PRIMARY KEY,
+               [version] INTEGER,
+               [last_sync] TEXT)
+              """)
+
+    # Collector status table (per sync job state and progress, plus the collector process heartbeat)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS collector_status
+              ([job] TEXT PRIMARY KEY,
+               [state] TEXT,
+               [pid] INTEGER,
+               [last_start] TEXT,
+               [last_end] TEXT,
+               [last_duration] REAL,
+               [devices_processed] INTEGER,
+               [devices_total] INTEGER,
+               [last_error] TEXT,
+               [heartbeat] TEXT)
+              """)
+
+    # Append-only device change log (connection status, software version, IP and uptime reset transitions), read
+    # incrementally by sequence number
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS device_changes
+              ([seq] INTEGER PRIMARY KEY AUTOINCREMENT,
+               [device_id] TEXT,
+               [org_id] TEXT,
+               [field] TEXT,
+               [old_value] TEXT,
+               [new_value] TEXT,
+               [change_time] TEXT)
+              """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_device_changes_device_id ON device_changes(device_id, seq)")
+
+    # Per device call history poll state (adaptive polling: current interval, next poll time, activity)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS device_poll_state
+              ([device_id] TEXT PRIMARY KEY,
+               [active_calls] INTEGER,
+               [interval] INTEGER,
+               [next_poll] TEXT,
+               [last_poll] TEXT,
+               [last_call] TEXT,
+               [last_success] TEXT,
+               FOREIGN KEY (device_id) REFERENCES devices (device_id))
+              """)
+
+    # Poll state table created before per device sync success times
+    add_missing_column(c, 'device_poll_state', 'last_success', 'TEXT')
+
+    # Per job sync checkpoints (current cycle shard, start time and progress), lets an interrupted run resume
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS sync_checkpoints
+              ([job] TEXT PRIMARY KEY,
+               [shard] INTEGER,
+               [cycle_start] TEXT,
+               [last_device] TEXT,
+               [devices_processed] INTEGER,
+               [devices_total] INTEGER,
+               [completed] INTEGER)
+              """)
+
+    # Sharded call history collection timing metrics (one entry per org and shard)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS call_history_shards
+              ([org_id] TEXT,
+               [shard] INTEGER,
+               [devices] INTEGER,
+               [runs] INTEGER,
+               [last_start] TEXT,
+               [last_duration] REAL,
+               [max_duration] REAL,
+               PRIMARY KEY (org_id, shard))
+              """)
+
+    # Worst offender indexes, top WORST_OFFENDERS_TOP_N per org and day (UTC): lowest MOS calls, highest peak packet
+    # loss devices
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS worst_calls
+              ([org_id] TEXT,
+               [bucket] TEXT,
+               [call_id] TEXT,
+               [device_id] TEXT,
+               [start_time] TEXT,
+               [mos] REAL,
+               [a_mos] REAL,
+               [v_mos] REAL,
+               PRIMARY KEY (org_id, bucket, call_id))
+              """)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS worst_devices
+              ([org_id] TEXT,
+               [bucket] TEXT,
+               [device_id] TEXT,
+               [peak_loss] REAL,
+               [call_id] TEXT,
+               [start_time] TEXT,
+               PRIMARY KEY (org_id, bucket, device_id))
+              """)
+
+    # Device quality degradation detector state (one entry per device: per metric baseline / recent EWMA state, JSON)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS device_quality
+              ([device_id] TEXT PRIMARY KEY,
+               [org_id] TEXT,
+               [state] TEXT,
+               [score] REAL,
+               [degraded] TEXT,
+               [updated] TEXT,
+               [last_call] TEXT)
+              """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_device_quality_score ON device_quality(score)")
+
+    # Detector state created before the newest observed call was tracked (a reset call history is not fed again)
+    add_missing_column(c, 'device_quality', 'last_call', 'TEXT')
+
+    # Active call media quality timeline (sampled MediaChannels netstat, one entry per call and time bucket)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS call_media_timeline
+              ([device_id] TEXT,
+               [org_id] TEXT,
+               [call_id] TEXT,
+               [call_start] TEXT,
+               [bucket_time] TEXT,
+               [samples] INTEGER,
+               [a_mos] REAL,
+               [v_mos] REAL,
+               [a_pkt_loss_max] REAL,
+               [v_pkt_loss_max] REAL,
+               [a_jit_max] REAL,
+               [v_jit_max] REAL,
+               PRIMARY KEY (device_id, call_start, bucket_time))
+              """)
+
+    # Scheduler job run history (one entry per run, including skipped / missed runs)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS job_runs
+              ([run_id] INTEGER PRIMARY KEY AUTOINCREMENT,
+               [job] TEXT,
+               [status] TEXT,
+               [start_time] TEXT,
+               [end_time] TEXT,
+               [duration] REAL,
+               [devices_processed] INTEGER,
+               [api_calls] INTEGER,
+               [rate_limited] INTEGER,
+               [error] TEXT,
+               [api_calls_skipped] INTEGER,
+               [time_saved] REAL)
+              """)
+
+    # Job runs table created before skipped call accounting
+    add_missing_column(c, 'job_runs', 'api_calls_skipped', 'INTEGER')
+    add_missing_column(c, 'job_runs', 'time_saved', 'REAL')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, start_time)")
+
     conn.commit()
 
+    # Call history was just cleared, invalidate any validators handed out for the old data
+    update_sync_state(conn, 'call_history')
+
 
-def query_all_devices(conn: sqlite3.Connection, column: str) -> list[tuple[int, str]]:
+def query_all_devices(conn: sqlite3.Connection, column: str, org_id: str | None = None) -> list[tuple[int, str]]:
     """
     Return table contents for Devices table
     :param conn: DB connection object
     :param column: Optional Column to grab specific data (or *)
+    :param org_id: Specific org to return devices for (default: all orgs - None)
     :return: All entries in devices table
     """
     c = conn.cursor()
 
-    c.execute(f"""SELECT {column} FROM devices""")
+    if org_id:
+        c.execute(f"""SELECT {column} FROM devices WHERE org_id = ?""", (org_id,))
+    else:
+        c.execute(f"""SELECT {column} FROM devices""")
     devices = c.fetchall()
 
     return devices
@@ -156,6 +386,23 @@ def query_device(conn: sqlite3.Connection, device_id: str, column: str) -> list[
     return device
 
 
+def query_device_labels(conn: sqlite3.Connection, device_ids: list[str]) -> dict[str, tuple[str, str]]:
+    """
+    Return the display name and site of devices
+    :param conn: DB connection object
+    :param device_ids: Device ids to query
+    :return: Device id -> (endpoint, site), devices not found are left out
+    """
+    c = conn.cursor()
+
+    placeholders = ', '.join('?' * len(device_ids))
+    c.execute(f"""SELECT device_id, endpoint, site FROM devices WHERE device_id IN ({placeholders})""",
+              list(device_ids))
+    labels = {device_id: (endpoint, site) for device_id, endpoint, site in c.fetchall()}
+
+    return labels
+
+
 def query_all_call_history(conn: sqlite3.Connection) -> list[tuple[int, str]]:
     """
     Return table contents for Call History table
@@ -170,36 +417,115 @@ def query_all_call_history(conn: sqlite3.Connection) -> list[tuple[int, str]]:
     return call_history
 
 
-def query_call_history(conn: sqlite3.Connection, endpoint_id=None, time_period_hours=1) -> list[tuple[int, str]]:
+# Call history range filters: filter name -> indexed call_history column, filtered with min_<name> / max_<name>. A
+# call's MOS, packet loss and jitter are those of its worst stream (MOS NULL if no stream could be scored)
+CALL_HISTORY_RANGE_FILTERS = {'mos': 'mos', 'loss': 'pkt_loss_max', 'a_loss': 'a_pkt_loss_max',
+                              'v_loss': 'v_pkt_loss_max', 'jitter': 'jit_max', 'a_jitter': 'a_jit_max',
+                              'v_jitter': 'v_jit_max', 'duration': 'duration'}
+
+
+def build_call_history_query(endpoint_id=None, time_period_hours=1, org_id=None,
+                             filters: dict | None = None) -> tuple[str, tuple]:
     """
-    Return a subset of call history entries based on endpoint (default all) and/or time period (default: 60 minutes)
-    :param conn: DB connection object
+    Build the call history SQL query based on endpoint (default all) and/or time period (default: 60 minutes)
     :param endpoint_id: A specific endpoint to select call history entries for (default: all endpoint - None)
     :param time_period_hours: time period to select call history entries from (default: last 1 hour)
-    :return: All call history entries for a specific device (or all)
+    :param org_id: A specific org to select call history entries for (default: all orgs - None)
+    :param filters: Optional metric filters: min_<name> / max_<name> (see CALL_HISTORY_RANGE_FILTERS, inclusive) and
+    disconnect_reason (list of disconnect types)
+    :return: SQL query string and query parameters
     """
-    c = conn.cursor()
-
     # Calculate the start time based on the current time and the specified time period
     x_hours_ago_datetime = datetime.now(pytz.utc) - timedelta(hours=time_period_hours)
 
     # Construct the SQL query based on the selected endpoint ID and time period
+    conditions = ["start_time >= ?"]
+    params = [x_hours_ago_datetime.strftime(util.DB_TIME_FORMAT)]
     if endpoint_id:
-        query = """
-            SELECT *
-            FROM call_history
-            WHERE device_id = ? AND start_time >= ?
-            ORDER BY start_time DESC
-        """
-        c.execute(query, (endpoint_id, x_hours_ago_datetime.strftime('%Y-%m-%d %H:%M:%S')))
+        conditions.append("device_id = ?")
+        params.append(endpoint_id)
+    elif org_id:
+        conditions.append("org_id = ?")
+        params.append(org_id)
+
+    # Metric filters (indexed columns)
+    for name, value in (filters or {}).items():
+        if name == 'disconnect_reason':
+            conditions.append(f"disconnect_reason IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        else:
+            bound, metric = name.split('_', 1)
+            conditions.append(f"{CALL_HISTORY_RANGE_FILTERS[metric]} {'>=' if bound == 'min' else '<='} ?")
+            params.append(value)
+
+    query = f"""
+        SELECT *
+        FROM call_history
+        WHERE {' AND '.join(conditions)}
+        ORDER BY start_time DESC
+    """
+
+    return query, tuple(params)
+
+
+def query_device_changes(conn: sqlite3.Connection, since: int = 0, limit: int = 500,
+                         device_id: str | None = None) -> list[tuple]:
+    """
+    Return device change log entries after a sequence number (oldest first)
+    :param conn: DB connection object
+    :param since: Return entries with a sequence number greater than this (cursor, 0 = from the start)
+    :param limit: Maximum number of entries to return
+    :param device_id: Specific device to return entries for (default: all devices - None)
+    :return: List of (seq, device_id, org_id, field, old_value, new_value, change_time) entries
+    """
+    c = conn.cursor()
+
+    if device_id:
+        c.execute("""SELECT * FROM device_changes WHERE device_id = ? AND seq > ? ORDER BY seq LIMIT ?""",
+                  (device_id, since, limit))
     else:
-        query = """
-                SELECT *
-                FROM call_history
-                WHERE start_time >= ?
-                ORDER BY start_time DESC
-            """
-        c.execute(query, (x_hours_ago_datetime.strftime('%Y-%m-%d %H:%M:%S'),))
+        c.execute("""SELECT * FROM device_changes WHERE seq > ? ORDER BY seq LIMIT ?""", (since, limit))
+    device_changes = c.fetchall()
+
+    return device_changes
+
+
+def add_device_changes(conn: sqlite3.Connection, device_id: str, org_id: str | None,
+                       changes: list[tuple[str, str | None, str | None]]):
+    """
+    Append device state transitions to the change log
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param org_id: Org the device belongs to
+    :param changes: List of (field, old value, new value) transitions
+    """
+    if not changes:
+        return
+
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.executemany("""
+        INSERT INTO device_changes (device_id, org_id, field, old_value, new_value, change_time) VALUES (?, ?, ?, ?, ?, ?)
+    """, [(device_id, org_id, field, old_value, new_value, now) for field, old_value, new_value in changes])
+    conn.commit()
+
+
+def query_call_history(conn: sqlite3.Connection, endpoint_id=None, time_period_hours=1, org_id=None,
+                       filters: dict | None = None) -> list[tuple[int, str]]:
+    """
+    Return a subset of call history entries based on endpoint (default all) and/or time period (default: 60 minutes)
+    :param conn: DB connection object
+    :param endpoint_id: A specific endpoint to select call history entries for (default: all endpoint - None)
+    :param time_period_hours: time period to select call history entries from (default: last 1 hour)
+    :param org_id: A specific org to select call history entries for (default: all orgs - None)
+    :param filters: Optional metric filters (see build_call_history_query)
+    :return: All call history entries for a specific device (or all)
+    """
+    c = conn.cursor()
+
+    query, params = build_call_history_query(endpoint_id, time_period_hours, org_id, filters)
+    c.execute(query, params)
 
     # Fetch all rows from the query result
     rows = c.fetchall()
@@ -207,92 +533,965 @@ def query_call_history(conn: sqlite3.Connection, endpoint_id=None, time_period_h
     return rows
 
 
-def add_device_entries(conn: sqlite3.Connection, device: dict):
+def iter_call_history(conn: sqlite3.Connection, endpoint_id=None, time_period_hours=1, batch_size=1000, org_id=None,
+                      filters: dict | None = None):
+    """
+    Yield call history entries in batches (same filters as query_call_history), keeps memory constant for large exports
+    :param conn: DB connection object
+    :param endpoint_id: A specific endpoint to select call history entries for (default: all endpoint - None)
+    :param time_period_hours: time period to select call history entries from (default: last 1 hour)
+    :param batch_size: Number of rows fetched from the cursor per batch
+    :param org_id: A specific org to select call history entries for (default: all orgs - None)
+    :param filters: Optional metric filters (see build_call_history_query)
+    :return: Generator of call history entry lists (at most batch_size entries each)
+    """
+    c = conn.cursor()
+
+    query, params = build_call_history_query(endpoint_id, time_period_hours, org_id, filters)
+    c.execute(query, params)
+
+    while True:
+        rows = c.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+# Call quality analytics groupings: grouping -> (group key, group label) SQL expressions over call_history (h) joined to
+# the calling device (d, current device attributes)
+CALL_QUALITY_GROUPINGS = {
+    'site': ("COALESCE(d.site, 'Unknown')", "COALESCE(d.site, 'Unknown')"),
+    'region': ("COALESCE(d.region, 'Unknown')", "COALESCE(d.region, 'Unknown')"),
+    'device': ("h.device_id", "COALESCE(d.endpoint, h.device_id)"),
+    'software': ("COALESCE(d.software, 'Unknown')", "COALESCE(d.software, 'Unknown')"),
+    'day': ("substr(h.start_time, 1, 10)", "substr(h.start_time, 1, 10)"),
+}
+
+
+def query_call_quality(conn: sqlite3.Connection, grouping: str, start_time: datetime, end_time: datetime,
+                       org_id: str | None = None) -> list[tuple]:
+    """
+    Return the quality metrics of calls started within a time window, with each call's group (see CALL_QUALITY_GROUPINGS)
+    :param conn: DB connection object
+    :param grouping: Grouping (site, region, device, software or day)
+    :param start_time: Window start (UTC, inclusive)
+    :param end_time: Window end (UTC, exclusive)
+    :param org_id: A specific org to select calls for (default: all orgs - None)
+    :return: List of (group, label, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max) entries,
+    missing metrics as None
+    """
+    c = conn.cursor()
+
+    # MOSS 'N/A' returned as NULL
+    group_key, group_label = CALL_QUALITY_GROUPINGS[grouping]
+    query = f"""
+        SELECT {group_key}, {group_label},
+        CASE WHEN typeof(h.a_mos) IN ('real', 'integer') THEN h.a_mos END,
+        CASE WHEN typeof(h.v_mos) IN ('real', 'integer') THEN h.v_mos END,
+        h.a_pkt_loss_max, h.v_pkt_loss_max, h.a_jit_max, h.v_jit_max
+        FROM call_history h
+        LEFT JOIN devices d ON d.device_id = h.device_id
+        WHERE h.start_time >= ? AND h.start_time < ?
+    """
+    params = (start_time.strftime(util.DB_TIME_FORMAT), end_time.strftime(util.DB_TIME_FORMAT))
+
+    if org_id:
+        query += " AND h.org_id = ?"
+        params += (org_id,)
+
+    c.execute(query, params)
+    calls = c.fetchall()
+
+    return calls
+
+
+# Call quality chart scopes: scope -> SQL condition over call_history (h) joined to the calling device (d), the scope id
+# (site name or device id) is its parameter
+CHART_SCOPES = {
+    'fleet': None,
+    'site': "d.site = ?",
+    'device': "h.device_id = ?",
+}
+
+
+def build_chart_filter(scope: str, scope_id: str | None, start_time: datetime, end_time: datetime,
+                       org_id: str | None) -> tuple[str, tuple]:
+    """
+    Build the FROM / WHERE clauses selecting a chart scope's calls started within a time window
+    :param scope: Chart scope (fleet, site or device, see CHART_SCOPES)
+    :param scope_id: Site name or device id (ignored for the fleet)
+    :param start_time: Window start (UTC, inclusive)
+    :param end_time: Window end (UTC, exclusive)
+    :param org_id: A specific org (default: all orgs - None)
+    :return: SQL clauses and query parameters
+    """
+    clauses = """
+        FROM call_history h
+        LEFT JOIN devices d ON d.device_id = h.device_id
+        WHERE h.start_time >= ? AND h.start_time < ?
+    """
+    params = (start_time.strftime(util.DB_TIME_FORMAT), end_time.strftime(util.DB_TIME_FORMAT))
+
+    if CHART_SCOPES[scope]:
+        clauses += f" AND {CHART_SCOPES[scope]}"
+        params += (scope_id,)
+
+    if org_id:
+        clauses += " AND h.org_id = ?"
+        params += (org_id,)
+
+    return clauses, params
+
+
+def query_call_chart_buckets(conn: sqlite3.Connection, scope: str, scope_id: str | None, start_time: datetime,
+                             end_time: datetime, bucket_seconds: int, org_id: str | None = None) -> list[tuple]:
+    """
+    Return call volume and quality per fixed time bucket (aggregated in the DB, one row per non-empty bucket)
+    :param conn: DB connection object
+    :param scope: Chart scope (fleet, site or device, see CHART_SCOPES)
+    :param scope_id: Site name or device id (ignored for the fleet)
+    :param start_time: Window start (UTC, inclusive)
+    :param end_time: Window end (UTC, exclusive)
+    :param bucket_seconds: Bucket size (buckets are aligned on multiples of the size since the epoch)
+    :param org_id: A specific org (default: all orgs - None)
+    :return: List of (bucket start epoch seconds, calls, avg MOS, min MOS, avg packet loss, max packet loss) entries, in
+    time order (a call's MOS and packet loss are those of its worst stream)
+    """
+    c = conn.cursor()
+
+    clauses, params = build_chart_filter(scope, scope_id, start_time, end_time, org_id)
+    c.execute(f"""
+        SELECT CAST(strftime('%s', h.start_time) AS INTEGER) / ? * ? AS bucket, COUNT(*), AVG(h.mos), MIN(h.mos),
+        AVG(h.pkt_loss_max), MAX(h.pkt_loss_max)
+        {clauses}
+        GROUP BY bucket
+        ORDER BY bucket
+    """, (bucket_seconds, bucket_seconds) + params)
+    buckets = c.fetchall()
+
+    return buckets
+
+
+def query_call_chart_points(conn: sqlite3.Connection, scope: str, scope_id: str | None, start_time: datetime,
+                            end_time: datetime, column: str, org_id: str | None = None) -> list[tuple]:
+    """
+    Return the raw per call values of a metric (calls without a value are left out)
+    :param conn: DB connection object
+    :param scope: Chart scope (fleet, site or device, see CHART_SCOPES)
+    :param scope_id: Site name or device id (ignored for the fleet)
+    :param start_time: Window start (UTC, inclusive)
+    :param end_time: Window end (UTC, exclusive)
+    :param column: Numeric call_history column (ex: mos, pkt_loss_max)
+    :param org_id: A specific org (default: all orgs - None)
+    :return: List of (start time epoch seconds, value) entries, in time order
+    """
+    c = conn.cursor()
+
+    clauses, params = build_chart_filter(scope, scope_id, start_time, end_time, org_id)
+    c.execute(f"""
+        SELECT CAST(strftime('%s', h.start_time) AS INTEGER), h.{column}
+        {clauses} AND h.{column} IS NOT NULL
+        ORDER BY h.start_time
+    """, params)
+    points = c.fetchall()
+
+    return points
+
+
+def query_sync_state(conn: sqlite3.Connection, names: list[str]) -> list[tuple[str, int, str]]:
+    """
+    Return sync state (version, last sync time) for one or more tables
+    :param conn: DB connection object
+    :param names: Table names to return sync state for (ex: devices, call_history)
+    :return: List of (name, version, last_sync) entries, ordered by name
+    """
+    c = conn.cursor()
+
+    placeholders = ','.join('?' for _ in names)
+    c.execute(f"""SELECT name, version, last_sync FROM sync_state WHERE name IN ({placeholders}) ORDER BY name""",
+              tuple(names))
+    sync_state = c.fetchall()
+
+    return sync_state
+
+
+def update_sync_state(conn: sqlite3.Connection, name: str):
+    """
+    Bump the version and last sync time of a table (called whenever a sync or user action changes the table contents)
+    :param conn: DB connection object
+    :param name: Table name to update sync state for
+    """
+    c = conn.cursor()
+
+    last_sync = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        INSERT INTO sync_state (name, version, last_sync) VALUES (?, 1, ?)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1, last_sync = excluded.last_sync
+    """, (name, last_sync))
+    conn.commit()
+
+
+def query_collector_status(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    Return collector status entries (one per sync job, plus the 'collector' heartbeat entry)
+    :param conn: DB connection object
+    :return: All entries in collector status table
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT * FROM collector_status ORDER BY job""")
+    collector_status = c.fetchall()
+
+    return collector_status
+
+
+def update_collector_status(conn: sqlite3.Connection, job: str, state: str, error: str | None = None):
     """
-    Add (or update) device entries
+    Record a sync job state change (running: job started, idle: job finished, failed: job raised an error)
+    :param conn: DB connection object
+    :param job: Sync job name (ex: devices, call_history)
+    :param state: New job state (running, idle, failed)
+    :param error: Error details (failed state only)
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    if state == 'running':
+        c.execute("""
+            INSERT INTO collector_status (job, state, pid, last_start, devices_processed, devices_total, heartbeat)
+            VALUES (?, ?, ?, ?, 0, 0, ?)
+            ON CONFLICT(job) DO UPDATE SET state = excluded.state, pid = excluded.pid, last_start = excluded.last_start,
+            devices_processed = 0, devices_total = 0, heartbeat = excluded.heartbeat
+        """, (job, state, os.getpid(), now, now))
+    else:
+        c.execute("""
+            UPDATE collector_status
+            SET state = ?, last_end = ?, last_duration = (julianday(?) - julianday(last_start)) * 86400,
+            last_error = ?, heartbeat = ?
+            WHERE job = ?
+        """, (state, now, now, error, now, job))
+    conn.commit()
+
+
+def update_collector_progress(conn: sqlite3.Connection, job: str, devices_processed: int, devices_total: int):
+    """
+    Record sync job progress (devices processed so far in the current run)
+    :param conn: DB connection object
+    :param job: Sync job name (ex: devices, call_history)
+    :param devices_processed: Devices processed so far
+    :param devices_total: Devices to process in this run
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        UPDATE collector_status SET devices_processed = ?, devices_total = ?, heartbeat = ? WHERE job = ?
+    """, (devices_processed, devices_total, now, job))
+    conn.commit()
+
+
+def update_collector_heartbeat(conn: sqlite3.Connection, pid: int):
+    """
+    Record collector process liveness
+    :param conn: DB connection object
+    :param pid: Collector (scheduler lock holder) process id
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        INSERT INTO collector_status (job, state, pid, heartbeat) VALUES ('collector', 'running', ?, ?)
+        ON CONFLICT(job) DO UPDATE SET state = excluded.state, pid = excluded.pid, heartbeat = excluded.heartbeat
+    """, (pid, now))
+    conn.commit()
+
+
+def query_device_poll_state(conn: sqlite3.Connection, org_id: str) -> list[tuple]:
+    """
+    Return call history poll state for all devices of an org (devices never polled have None poll fields)
+    :param conn: DB connection object
+    :param org_id: Org to return device poll state for
+    :return: List of (device_id, connection_status, active_calls, interval, next_poll, last_poll, last_call,
+    last_success) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""
+        SELECT d.device_id, d.connection_status, p.active_calls, p.interval, p.next_poll, p.last_poll, p.last_call,
+        p.last_success
+        FROM devices d
+        LEFT JOIN device_poll_state p ON p.device_id = d.device_id
+        WHERE d.org_id = ?
+    """, (org_id,))
+    poll_state = c.fetchall()
+
+    return poll_state
+
+
+def update_device_activity(conn: sqlite3.Connection, device_id: str, active_calls: int, poll_now: bool):
+    """
+    Record device activity seen by the inventory sync (pulls the next call history poll forward if required)
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param active_calls: Number of active calls on the device
+    :param poll_now: Poll call history at the next opportunity (ex: device reconnected, device in a call)
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        INSERT INTO device_poll_state (device_id, active_calls, next_poll) VALUES (?, ?, ?)
+        ON CONFLICT(device_id) DO UPDATE SET active_calls = excluded.active_calls,
+        next_poll = CASE WHEN ? THEN excluded.next_poll ELSE next_poll END
+    """, (device_id, active_calls, now, poll_now))
+    conn.commit()
+
+
+def update_device_poll_state(conn: sqlite3.Connection, device_id: str, interval: int, next_poll: datetime,
+                             last_call: str | None):
+    """
+    Record a completed call history poll for a device and schedule the next one
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param interval: Current poll interval (minutes)
+    :param next_poll: Next poll time (UTC)
+    :param last_call: Start time of the device's most recent call (DB format), None if no calls seen
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        INSERT INTO device_poll_state (device_id, active_calls, interval, next_poll, last_poll, last_call)
+        VALUES (?, 0, ?, ?, ?, ?)
+        ON CONFLICT(device_id) DO UPDATE SET interval = excluded.interval, next_poll = excluded.next_poll,
+        last_poll = excluded.last_poll, last_call = COALESCE(excluded.last_call, last_call)
+    """, (device_id, interval, next_poll.strftime(util.DB_TIME_FORMAT), now, last_call))
+    conn.commit()
+
+
+def update_device_sync_success(conn: sqlite3.Connection, device_id: str):
+    """
+    Record a successful call history sync for a device (used to sync the stalest devices first)
+    :param conn: DB connection object
+    :param device_id: Device ID
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        INSERT INTO device_poll_state (device_id, active_calls, last_success) VALUES (?, 0, ?)
+        ON CONFLICT(device_id) DO UPDATE SET last_success = excluded.last_success
+    """, (device_id, now))
+    conn.commit()
+
+
+def query_sync_checkpoint(conn: sqlite3.Connection, job: str) -> tuple | None:
+    """
+    Return the sync checkpoint of a job
+    :param conn: DB connection object
+    :param job: Sync job name (ex: call_history)
+    :return: (job, shard, cycle_start, last_device, devices_processed, devices_total, completed) entry, None if the job
+    never ran
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT * FROM sync_checkpoints WHERE job = ?""", (job,))
+    checkpoint = c.fetchone()
+
+    return checkpoint
+
+
+def start_sync_checkpoint(conn: sqlite3.Connection, job: str, shard: int, cycle_start: str, devices_total: int):
+    """
+    Record the start (or resumption) of a sync job cycle
+    :param conn: DB connection object
+    :param job: Sync job name (ex: call_history)
+    :param shard: Shard synced by the cycle
+    :param cycle_start: Cycle start time (DB format, kept when an interrupted cycle is resumed)
+    :param devices_total: Devices to sync in this run
+    """
+    c = conn.cursor()
+
+    c.execute("""
+        INSERT INTO sync_checkpoints (job, shard, cycle_start, last_device, devices_processed, devices_total, completed)
+        VALUES (?, ?, ?, NULL, 0, ?, 0)
+        ON CONFLICT(job) DO UPDATE SET shard = excluded.shard, cycle_start = excluded.cycle_start, last_device = NULL,
+        devices_processed = 0, devices_total = excluded.devices_total, completed = 0
+    """, (job, shard, cycle_start, devices_total))
+    conn.commit()
+
+
+def update_sync_checkpoint(conn: sqlite3.Connection, job: str, last_device: str, devices_processed: int):
+    """
+    Record sync job cycle progress (last device synced)
+    :param conn: DB connection object
+    :param job: Sync job name (ex: call_history)
+    :param last_device: Last device synced
+    :param devices_processed: Devices synced so far in this run
+    """
+    c = conn.cursor()
+
+    c.execute("""UPDATE sync_checkpoints SET last_device = ?, devices_processed = ? WHERE job = ?""",
+              (last_device, devices_processed, job))
+    conn.commit()
+
+
+def complete_sync_checkpoint(conn: sqlite3.Connection, job: str):
+    """
+    Mark a sync job cycle as completed (the next run starts a new cycle)
+    :param conn: DB connection object
+    :param job: Sync job name (ex: call_history)
+    """
+    c = conn.cursor()
+
+    c.execute("""UPDATE sync_checkpoints SET completed = 1 WHERE job = ?""", (job,))
+    conn.commit()
+
+
+def query_shard_metrics(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    Return sharded call history collection timing metrics
+    :param conn: DB connection object
+    :return: List of (org_id, shard, devices, runs, last_start, last_duration, max_duration) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT org_id, shard, devices, runs, last_start, last_duration, max_duration FROM call_history_shards
+                 ORDER BY org_id, shard""")
+    shard_metrics = c.fetchall()
+
+    return shard_metrics
+
+
+def update_shard_metrics(conn: sqlite3.Connection, org_id: str, shard: int, devices: int, start_time: datetime,
+                         duration: float):
+    """
+    Record a sharded call history collection run
+    :param conn: DB connection object
+    :param org_id: Org the shard belongs to
+    :param shard: Shard number
+    :param devices: Devices polled in this run
+    :param start_time: Run start time (UTC)
+    :param duration: Run duration (seconds)
+    """
+    c = conn.cursor()
+
+    c.execute("""
+        INSERT INTO call_history_shards (org_id, shard, devices, runs, last_start, last_duration, max_duration)
+        VALUES (?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT(org_id, shard) DO UPDATE SET devices = excluded.devices, runs = runs + 1, last_start = excluded.last_start,
+        last_duration = excluded.last_duration, max_duration = MAX(max_duration, excluded.last_duration)
+    """, (org_id, shard, devices, start_time.strftime(util.DB_TIME_FORMAT), duration, duration))
+    conn.commit()
+
+
+def add_job_run(conn: sqlite3.Connection, job: str, status: str, start_time: datetime, end_time: datetime,
+                devices_processed: int = 0, api_calls: int = 0, rate_limited: int = 0, error: str | None = None,
+                api_calls_skipped: int = 0, time_saved: float = 0.0):
+    """
+    Record a scheduler job run
+    :param conn: DB connection object
+    :param job: Job name (ex: devices, call_history)
+    :param status: Run outcome (ok, failed, skipped - previous run still in progress, missed - misfire grace time exceeded)
+    :param start_time: Run start time (UTC)
+    :param end_time: Run end time (UTC)
+    :param devices_processed: Devices processed in the run
+    :param api_calls: Webex API requests made in the run
+    :param rate_limited: 429 responses received in the run
+    :param error: Error details (failed runs only)
+    :param api_calls_skipped: Webex API requests skipped in the run (ex: xAPI calls to offline devices)
+    :param time_saved: Estimated seconds saved by the skipped requests
+    """
+    c = conn.cursor()
+
+    c.execute("""
+        INSERT INTO job_runs (job, status, start_time, end_time, duration, devices_processed, api_calls, rate_limited,
+        error, api_calls_skipped, time_saved) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (job, status, start_time.strftime(util.DB_TIME_FORMAT), end_time.strftime(util.DB_TIME_FORMAT),
+          (end_time - start_time).total_seconds(), devices_processed, api_calls, rate_limited, error, api_calls_skipped,
+          time_saved))
+    conn.commit()
+
+
+def query_job_runs(conn: sqlite3.Connection, job: str | None = None, limit: int = 50) -> list[tuple]:
+    """
+    Return most recent scheduler job runs (newest first)
+    :param conn: DB connection object
+    :param job: Specific job to return runs for (default: all jobs - None)
+    :param limit: Maximum number of runs to return
+    :return: List of job run entries
+    """
+    c = conn.cursor()
+
+    if job:
+        c.execute("""SELECT * FROM job_runs WHERE job = ? ORDER BY run_id DESC LIMIT ?""", (job, limit))
+    else:
+        c.execute("""SELECT * FROM job_runs ORDER BY run_id DESC LIMIT ?""", (limit,))
+    job_runs = c.fetchall()
+
+    return job_runs
+
+
+def delete_old_job_runs(conn: sqlite3.Connection, x_days_ago: datetime):
+    """
+    Hard Delete job run entries > x days old
+    :param conn: DB connection object
+    :param x_days_ago: x days ago UTC time stamp, removes data > x days
+    """
+    c = conn.cursor()
+
+    c.execute("""DELETE FROM job_runs WHERE start_time < ?""", (x_days_ago.strftime(util.DB_TIME_FORMAT),))
+    conn.commit()
+
+
+def query_worst_calls_bucket(conn: sqlite3.Connection, org_id: str, bucket: str) -> list[tuple]:
+    """
+    Return the worst calls index of an org's day
+    :param conn: DB connection object
+    :param org_id: Org ID
+    :param bucket: Day (UTC, '%Y-%m-%d')
+    :return: List of (call_id, device_id, start_time, mos, a_mos, v_mos) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT call_id, device_id, start_time, mos, a_mos, v_mos FROM worst_calls
+                 WHERE org_id = ? AND bucket = ?""", (org_id, bucket))
+    calls = c.fetchall()
+
+    return calls
+
+
+def query_worst_devices_bucket(conn: sqlite3.Connection, org_id: str, bucket: str) -> list[tuple]:
+    """
+    Return the worst devices index of an org's day
+    :param conn: DB connection object
+    :param org_id: Org ID
+    :param bucket: Day (UTC, '%Y-%m-%d')
+    :return: List of (device_id, peak_loss, call_id, start_time) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT device_id, peak_loss, call_id, start_time FROM worst_devices
+                 WHERE org_id = ? AND bucket = ?""", (org_id, bucket))
+    devices = c.fetchall()
+
+    return devices
+
+
+def replace_worst_offenders_bucket(conn: sqlite3.Connection, org_id: str, bucket: str, calls: list[tuple],
+                                   devices: list[tuple]):
+    """
+    Replace the worst calls and worst devices indexes of an org's day
+    :param conn: DB connection object
+    :param org_id: Org ID
+    :param bucket: Day (UTC, '%Y-%m-%d')
+    :param calls: List of (call_id, device_id, start_time, mos, a_mos, v_mos) entries
+    :param devices: List of (device_id, peak_loss, call_id, start_time) entries
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM worst_calls WHERE org_id = ? AND bucket = ?", (org_id, bucket))
+    c.executemany("""
+        INSERT INTO worst_calls (org_id, bucket, call_id, device_id, start_time, mos, a_mos, v_mos)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(org_id, bucket, *entry) for entry in calls])
+
+    c.execute("DELETE FROM worst_devices WHERE org_id = ? AND bucket = ?", (org_id, bucket))
+    c.executemany("""
+        INSERT INTO worst_devices (org_id, bucket, device_id, peak_loss, call_id, start_time)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(org_id, bucket, *entry) for entry in devices])
+    conn.commit()
+
+
+def query_worst_calls(conn: sqlite3.Connection, first_bucket: str, limit: int, org_id: str | None = None) -> list[tuple]:
+    """
+    Return the lowest MOS calls since a day (merged from the per day worst calls indexes)
+    :param conn: DB connection object
+    :param first_bucket: First day to include (UTC, '%Y-%m-%d')
+    :param limit: Maximum number of calls to return
+    :param org_id: A specific org (default: all orgs - None)
+    :return: List of (call_id, device_id, endpoint, site, region, org_id, start_time, mos, a_mos, v_mos) entries,
+    worst first
+    """
+    c = conn.cursor()
+
+    org_filter = "AND w.org_id = ?" if org_id else ""
+    c.execute(f"""
+        SELECT w.call_id, w.device_id, d.endpoint, d.site, d.region, w.org_id, w.start_time, w.mos, w.a_mos, w.v_mos
+        FROM worst_calls w
+        LEFT JOIN devices d ON d.device_id = w.device_id
+        WHERE w.bucket >= ? {org_filter}
+        ORDER BY w.mos, w.start_time DESC
+        LIMIT ?
+    """, (first_bucket, org_id, limit) if org_id else (first_bucket, limit))
+    calls = c.fetchall()
+
+    return calls
+
+
+def query_worst_devices(conn: sqlite3.Connection, first_bucket: str, limit: int,
+                        org_id: str | None = None) -> list[tuple]:
+    """
+    Return the highest peak packet loss devices since a day (merged from the per day worst devices indexes)
+    :param conn: DB connection object
+    :param first_bucket: First day to include (UTC, '%Y-%m-%d')
+    :param limit: Maximum number of devices to return
+    :param org_id: A specific org (default: all orgs - None)
+    :return: List of (device_id, endpoint, site, region, org_id, peak_loss, call_id, start_time) entries, worst first
+    """
+    c = conn.cursor()
+
+    # Bare columns of a MAX() aggregate come from the row holding the maximum (the call with the peak loss)
+    org_filter = "AND w.org_id = ?" if org_id else ""
+    c.execute(f"""
+        SELECT w.device_id, d.endpoint, d.site, d.region, w.org_id, MAX(w.peak_loss), w.call_id, w.start_time
+        FROM worst_devices w
+        LEFT JOIN devices d ON d.device_id = w.device_id
+        WHERE w.bucket >= ? {org_filter}
+        GROUP BY w.device_id
+        ORDER BY MAX(w.peak_loss) DESC
+        LIMIT ?
+    """, (first_bucket, org_id, limit) if org_id else (first_bucket, limit))
+    devices = c.fetchall()
+
+    return devices
+
+
+def delete_old_worst_offenders(conn: sqlite3.Connection, x_days_ago: datetime):
+    """
+    Delete worst offender indexes of days older than x days (expired with call history retention)
+    :param conn: DB connection object
+    :param x_days_ago: x days ago UTC time stamp, removes days before it
+    """
+    c = conn.cursor()
+
+    first_bucket = x_days_ago.strftime('%Y-%m-%d')
+    c.execute("DELETE FROM worst_calls WHERE bucket < ?", (first_bucket,))
+    c.execute("DELETE FROM worst_devices WHERE bucket < ?", (first_bucket,))
+    conn.commit()
+
+
+def query_device_quality_state(conn: sqlite3.Connection, device_id: str) -> tuple[dict, str | None]:
+    """
+    Return a device's quality degradation detector state
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :return: Detector state (see util.update_quality_state), empty if the device has no state yet, and start time of
+             the newest call fed to it (None if none)
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT state, last_call FROM device_quality WHERE device_id = ?""", (device_id,))
+    entry = c.fetchone()
+
+    return (json.loads(entry[0]), entry[1]) if entry else ({}, None)
+
+
+def update_device_quality_state(conn: sqlite3.Connection, device_id: str, org_id: str, state: dict, score: float,
+                                degraded: list[str], last_call: str | None = None):
+    """
+    Store a device's quality degradation detector state and score
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param org_id: Org the device belongs to
+    :param state: Detector state (see util.update_quality_state)
+    :param score: Degradation score (see util.score_quality_state)
+    :param degraded: Degraded metrics
+    :param last_call: Start time of the newest call fed to the detector (None keeps the stored one)
+    """
+    c = conn.cursor()
+
+    now = datetime.now(pytz.utc).strftime(util.DB_TIME_FORMAT)
+    c.execute("""
+        INSERT INTO device_quality (device_id, org_id, state, score, degraded, updated, last_call)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (device_id) DO UPDATE SET org_id = excluded.org_id, state = excluded.state, score = excluded.score,
+            degraded = excluded.degraded, updated = excluded.updated, last_call = COALESCE(excluded.last_call, last_call)
+    """, (device_id, org_id, json.dumps(state), score, ','.join(degraded), now, last_call))
+    conn.commit()
+
+
+def query_degrading_devices(conn: sqlite3.Connection, limit: int = 20, org_id: str | None = None,
+                            include_all: bool = False) -> list[tuple]:
+    """
+    Return devices ranked by quality degradation score (worst first)
+    :param conn: DB connection object
+    :param limit: Maximum number of devices to return
+    :param org_id: A specific org to return devices for (default: all orgs - None)
+    :param include_all: Include devices with no degraded metric
+    :return: List of (device_id, endpoint, site, region, org_id, score, degraded, state, updated) entries
+    """
+    c = conn.cursor()
+
+    conditions, params = [], ()
+    if not include_all:
+        conditions.append("q.degraded != ''")
+    if org_id:
+        conditions.append("q.org_id = ?")
+        params += (org_id,)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    c.execute(f"""
+        SELECT q.device_id, d.endpoint, d.site, d.region, q.org_id, q.score, q.degraded, q.state, q.updated
+        FROM device_quality q
+        LEFT JOIN devices d ON d.device_id = q.device_id
+        {where}
+        ORDER BY q.score DESC
+        LIMIT ?
+    """, params + (limit,))
+    devices = c.fetchall()
+
+    return devices
+
+
+def add_media_timeline(conn: sqlite3.Connection, device_id: str, org_id: str, call_id: str, call_start: str,
+                       timeline: list[tuple]):
+    """
+    Persist the media quality timeline of a call (replaces buckets already stored for the call)
+    :param conn: DB connection object
+    :param device_id: Device the call was made on
+    :param org_id: Org the device belongs to
+    :param call_id: Device call id (xAPI)
+    :param call_start: Call start time (DB format, UTC)
+    :param timeline: List of (bucket_time, samples, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max,
+    v_jit_max) entries
+    """
+    c = conn.cursor()
+
+    c.executemany("""
+        INSERT OR REPLACE INTO call_media_timeline (device_id, org_id, call_id, call_start, bucket_time, samples, a_mos,
+        v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(device_id, org_id, call_id, call_start, *entry) for entry in timeline])
+    conn.commit()
+
+
+def query_media_timeline_calls(conn: sqlite3.Connection, device_id: str, limit: int = 20) -> list[tuple]:
+    """
+    Return the calls of a device with a media quality timeline (newest first)
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param limit: Maximum number of calls to return
+    :return: List of (call_id, call_start, last_bucket, samples, min a_mos, min v_mos) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""
+        SELECT call_id, call_start, MAX(bucket_time), SUM(samples), MIN(a_mos), MIN(v_mos)
+        FROM call_media_timeline
+        WHERE device_id = ?
+        GROUP BY call_start
+        ORDER BY call_start DESC
+        LIMIT ?
+    """, (device_id, limit))
+    calls = c.fetchall()
+
+    return calls
+
+
+def query_media_timeline(conn: sqlite3.Connection, device_id: str, call_start: str) -> list[tuple]:
+    """
+    Return the media quality timeline of a call
+    :param conn: DB connection object
+    :param device_id: Device ID
+    :param call_start: Call start time (DB format, UTC)
+    :return: List of (bucket_time, samples, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max)
+    entries, oldest first
+    """
+    c = conn.cursor()
+
+    c.execute("""
+        SELECT bucket_time, samples, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max
+        FROM call_media_timeline
+        WHERE device_id = ? AND call_start = ?
+        ORDER BY bucket_time
+    """, (device_id, call_start))
+    timeline = c.fetchall()
+
+    return timeline
+
+
+def delete_old_media_timelines(conn: sqlite3.Connection, x_days_ago: datetime) -> int:
+    """
+    Delete media quality timelines of calls started more than x days ago
+    :param conn: DB connection object
+    :param x_days_ago: x days ago UTC time stamp, removes data > x days
+    :return: Number of deleted entries
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM call_media_timeline WHERE call_start < ?", (x_days_ago.strftime(util.DB_TIME_FORMAT),))
+    conn.commit()
+
+    return c.rowcount
+
+
+def add_device_entries(conn: sqlite3.Connection, device: dict, org_id: str):
+    """
+    Add (or update) device entries. xAPI fields (uptime) left as None keep their cached value (offline devices)
     :param conn: DB connection object
     :param device: Device information dictionary
+    :param org_id: Org the device belongs to
     """
     c = conn.cursor()
 
     # Update device if already in table (skip custom fields)
     update_statement = (f"UPDATE devices SET endpoint=?, connection_status=?, product=?, serial=?, "
-                        f"ip_addr=?, mac=?, software=?, mode=?, site=?, room=?, local_number=?, uptime=?, email=?, timezone=?"
-                        f"WHERE device_id=?")
+                        f"ip_addr=?, mac=?, software=?, mode=?, site=?, room=?, local_number=?, uptime=COALESCE(?, uptime), "
+                        f"email=?, timezone=?, org_id=?, xapi_updated=COALESCE(?, xapi_updated), "
+                        f"uptime_seconds=COALESCE(?, uptime_seconds) WHERE device_id=?")
     c.execute(update_statement, (
         device['displayName'], device['connectionStatus'], device['product'], device['serial'],
         device['ip'], device['mac'], device['software'], device['mode'], device['site'], device['room'],
-        device['primarySipUrl'], device['uptime'], device['email'], device['timeZone'], device['id'],))
+        device['primarySipUrl'], device['uptime'], device['email'], device['timeZone'], org_id, device['xapiUpdated'],
+        device['uptimeSeconds'], device['id'],))
 
     # Add to device table if device not in device table (set custom fields to starting defaults)
     insert_statement = (f"INSERT OR IGNORE into devices (device_id, endpoint, connection_status, product, serial, "
-                        f"ip_addr, mac, software, mode, site, room, local_number, region, uptime, email, timezone) VALUES (?,?,?,?,?,?,?,?,?,?,"
-                        f"?,?,?,?,?,?)")
+                        f"ip_addr, mac, software, mode, site, room, local_number, region, uptime, email, timezone, org_id, xapi_updated, "
+                        f"uptime_seconds) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)")
     c.execute(insert_statement, (
         device['id'], device['displayName'], device['connectionStatus'], device['product'], device['serial'],
         device['ip'],
         device['mac'], device['software'], device['mode'], device['site'], device['room'], device['primarySipUrl'],
-        "None", device['uptime'], device['email'], device['timeZone']))
+        "None", device['uptime'] or 'Unknown', device['email'], device['timeZone'], org_id, device['xapiUpdated'],
+        device['uptimeSeconds']))
 
     conn.commit()
 
 
-def add_history_entries(conn: sqlite3.Connection, x_days_ago: datetime, device_call_history: list[dict]):
+def add_history_entries(conn: sqlite3.Connection, x_days_ago: datetime, device_call_history: list[dict],
+                        org_id: str) -> list[tuple]:
     """
     Add call_history entries
     :param conn: DB connection object
     :param x_days_ago: X days ago UTC time stamp, prevents storing data > X days
     :param device_call_history: Call history list for specific device with relevant call history entry fields
+    :param org_id: Org the device belongs to
+    :return: New call history entries, in call_history column order (entries already present are ignored)
     """
     c = conn.cursor()
 
-    # Add All Call Entries for device if not present in call_history table
+    # Keep entries within the last X days (due to chronological ordering, stop at the first older entry)
+    recent_calls = []
     for call in device_call_history:
         # Convert the start_time, end_time to a datetime object
         start_time_datetime = datetime.strptime(call['StartTimeUTC'], '%Y-%m-%dT%H:%M:%SZ')
         end_time_datetime = datetime.strptime(call['EndTimeUTC'], '%Y-%m-%dT%H:%M:%SZ')
 
-        # Check if the start_time is within the last 30 days
-        if start_time_datetime.replace(tzinfo=pytz.utc) >= x_days_ago:
-            # Generate unique call hash
-            hash_val = generate_unique_hash(call['deviceId'], call['CallbackNumber'], call['StartTimeUTC'],
-                                            call['EndTimeUTC'])
-
-            # Calculate MOSS Values For Audio and Video Streams (Minimum of Incoming and Outgoing)
-            audio_metrics_incoming = call['Audio']['Incoming']
-            audio_metrics_outgoing = call['Audio']['Outgoing']
-            audio_moss = util.calculate_mos(audio_metrics_incoming['MaxJitter'], audio_metrics_outgoing['MaxJitter'],
-                                            audio_metrics_incoming['PacketLossPercent'],
-                                            audio_metrics_outgoing['PacketLossPercent'])
-
-            video_metrics_incoming = call['Video']['Incoming']
-            video_metrics_outgoing = call['Video']['Outgoing']
-            video_moss = util.calculate_mos(video_metrics_incoming['MaxJitter'], video_metrics_outgoing['MaxJitter'],
-                                            video_metrics_incoming['PacketLossPercent'],
-                                            video_metrics_outgoing['PacketLossPercent'])
-
-            # Calculate Max Audio and Video PacketLoss and Jitter
-            audio_pkt_loss_max = max(audio_metrics_incoming['PacketLossPercent'],
-                                     audio_metrics_outgoing['PacketLossPercent'])
-            video_pkt_loss_max = max(video_metrics_incoming['PacketLossPercent'],
-                                     video_metrics_outgoing['PacketLossPercent'])
-            audio_jit_max = max(audio_metrics_incoming['MaxJitter'], audio_metrics_outgoing['MaxJitter'])
-            video_jit_max = max(video_metrics_incoming['MaxJitter'], video_metrics_outgoing['MaxJitter'])
-
-            # Insert a new call history entry, ignoring duplicates based on call_id
-            update_statement = f"INSERT OR IGNORE INTO call_history (call_id, device_id, display_name, callback_number, remote_number, start_time, end_time, duration, disconnect_reason, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-            c.execute(update_statement, (
-                hash_val, call['deviceId'], call['DisplayName'], call['CallbackNumber'],
-                call['RemoteNumber'],
-                start_time_datetime.strftime('%Y-%m-%d %H:%M:%S'), end_time_datetime.strftime('%Y-%m-%d %H:%M:%S'),
-                call['Duration'], call['DisconnectCauseType'], audio_moss, video_moss, str(audio_pkt_loss_max),
-                str(video_pkt_loss_max), str(audio_jit_max), str(video_jit_max)))
-        else:
-            # Found entry > x days (due to chronological ordering, any remaining entries will also be > 30 days)
+        if start_time_datetime.replace(tzinfo=pytz.utc) < x_days_ago:
             break
 
+        recent_calls.append((call, start_time_datetime, end_time_datetime))
+
+    if not recent_calls:
+        return []
+
+    # Calculate MOSS Values For Audio and Video Streams for all calls at once (Minimum of Incoming and Outgoing)
+    moss_columns = {}
+    for media in ('Audio', 'Video'):
+        moss_columns[media] = util.mos_values(util.calculate_mos_batch(
+            [call[media]['Incoming']['MaxJitter'] for call, _, _ in recent_calls],
+            [call[media]['Outgoing']['MaxJitter'] for call, _, _ in recent_calls],
+            [call[media]['Incoming']['PacketLossPercent'] for call, _, _ in recent_calls],
+            [call[media]['Outgoing']['PacketLossPercent'] for call, _, _ in recent_calls]))
+
+    rows = []
+    for (call, start_time_datetime, end_time_datetime), audio_moss, video_moss in zip(recent_calls,
+                                                                                      moss_columns['Audio'],
+                                                                                      moss_columns['Video']):
+        # Generate unique call hash
+        hash_val = generate_unique_hash(call['deviceId'], call['CallbackNumber'], call['StartTimeUTC'],
+                                        call['EndTimeUTC'])
+
+        # Calculate Max Audio and Video PacketLoss and Jitter
+        audio_metrics_incoming, audio_metrics_outgoing = call['Audio']['Incoming'], call['Audio']['Outgoing']
+        video_metrics_incoming, video_metrics_outgoing = call['Video']['Incoming'], call['Video']['Outgoing']
+        audio_pkt_loss_max = max(audio_metrics_incoming['PacketLossPercent'],
+                                 audio_metrics_outgoing['PacketLossPercent'])
+        video_pkt_loss_max = max(video_metrics_incoming['PacketLossPercent'],
+                                 video_metrics_outgoing['PacketLossPercent'])
+        audio_jit_max = max(audio_metrics_incoming['MaxJitter'], audio_metrics_outgoing['MaxJitter'])
+        video_jit_max = max(video_metrics_incoming['MaxJitter'], video_metrics_outgoing['MaxJitter'])
+
+        # Per stream metrics are kept as well (stored MOSS can be recomputed with another MOS model)
+        rows.append((
+            hash_val, call['deviceId'], call['DisplayName'], call['CallbackNumber'], call['RemoteNumber'],
+            start_time_datetime.strftime(util.DB_TIME_FORMAT), end_time_datetime.strftime(util.DB_TIME_FORMAT),
+            call['Duration'], call['DisconnectCauseType'], audio_moss, video_moss, audio_pkt_loss_max,
+            video_pkt_loss_max, audio_jit_max, video_jit_max, org_id,
+            audio_metrics_incoming['MaxJitter'], audio_metrics_outgoing['MaxJitter'],
+            audio_metrics_incoming['PacketLossPercent'], audio_metrics_outgoing['PacketLossPercent'],
+            video_metrics_incoming['MaxJitter'], video_metrics_outgoing['MaxJitter'],
+            video_metrics_incoming['PacketLossPercent'], video_metrics_outgoing['PacketLossPercent']))
+
+    # Insert new call history entries, ignoring duplicates based on call_id (one transaction)
+    update_statement = f"INSERT OR IGNORE INTO call_history (call_id, device_id, display_name, callback_number, remote_number, start_time, end_time, duration, disconnect_reason, a_mos, v_mos, a_pkt_loss_max, v_pkt_loss_max, a_jit_max, v_jit_max, org_id, a_in_jit, a_out_jit, a_in_loss, a_out_loss, v_in_jit, v_out_jit, v_in_loss, v_out_loss) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    new_entries = []
+    for row in rows:
+        c.execute(update_statement, row)
+        if c.rowcount:
+            new_entries.append(row)
+
     conn.commit()
 
+    return new_entries
+
+
+def query_call_history_batch(conn: sqlite3.Connection, after_rowid: int, batch_size: int) -> list[tuple]:
+    """
+    Return a batch of call history entries in storage order (keyset pagination, whole table walks)
+    :param conn: DB connection object
+    :param after_rowid: Return entries after this rowid (0 for the first batch)
+    :param batch_size: Maximum number of entries to return
+    :return: List of (rowid, *call_history columns) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT rowid, * FROM call_history WHERE rowid > ? ORDER BY rowid LIMIT ?""",
+              (after_rowid, batch_size))
+    entries = c.fetchall()
+
+    return entries
+
+
+def update_call_mos(conn: sqlite3.Connection, scores: list[tuple]):
+    """
+    Update stored call MOSS values
+    :param conn: DB connection object
+    :param scores: List of (a_mos, v_mos, rowid) entries
+    """
+    c = conn.cursor()
+
+    c.executemany("""UPDATE call_history SET a_mos = ?, v_mos = ? WHERE rowid = ?""", scores)
+    conn.commit()
+
+
+def delete_worst_offenders(conn: sqlite3.Connection):
+    """
+    Clear the worst offender indexes (rebuilt from call history)
+    :param conn: DB connection object
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM worst_calls")
+    c.execute("DELETE FROM worst_devices")
+    conn.commit()
+
+
+def query_device_quality_states(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    Return every device's quality degradation detector state
+    :param conn: DB connection object
+    :return: List of (device_id, org_id, state) entries
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT device_id, org_id, state FROM device_quality""")
+    states = [(device_id, org_id, json.loads(state)) for device_id, org_id, state in c.fetchall()]
+
+    return states
+
 
 def update_device_region(conn: sqlite3.Connection, device_id: str, region: str):
     """
@@ -323,14 +1522,17 @@ def delete_old_device_entries(conn: sqlite3.Connection, device_id: str):
         DELETE FROM devices
         WHERE devices.device_id = ?
     """, (device_id,))
+    c.execute("DELETE FROM device_poll_state WHERE device_id = ?", (device_id,))
+    c.execute("DELETE FROM device_quality WHERE device_id = ?", (device_id,))
     conn.commit()
 
 
-def delete_old_call_entries(conn: sqlite3.Connection, x_days_ago: datetime):
+def delete_old_call_entries(conn: sqlite3.Connection, x_days_ago: datetime) -> int:
     """
     Hard Delete Call History entries > 30 days old
     :param conn: DB connection object
     :param x_days_ago: x days ago UTC time stamp, removes data > x days
+    :return: Number of deleted entries
     """
     c = conn.cursor()
 
@@ -338,9 +1540,11 @@ def delete_old_call_entries(conn: sqlite3.Connection, x_days_ago: datetime):
     c.execute("""
         DELETE FROM call_history
         WHERE start_time < ?
-    """, (x_days_ago.strftime('%Y-%m-%d %H:%M:%S'),))
+    """, (x_days_ago.strftime(util.DB_TIME_FORMAT),))
     conn.commit()
 
+    return c.rowcount
+
 
 def close_connection(conn: sqlite3.Connection):
     """
@@ -353,8 +1557,13 @@ def close_connection(conn: sqlite3.Connection):
 # If running this python file, create connection to database, create tables, and print out the results of queries of
 # every table
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the Webex Devices Dashboard database tables")
+    parser.add_argument('--reset', action='store_true',
+                        help="Remove the existing call history and its sync state (poll schedule, checkpoints) first")
+    args = parser.parse_args()
+
     conn = create_connection(db_path)
-    create_tables(conn)
+    create_tables(conn, args.reset)
     pprint(f"Devices Table: {query_all_devices(conn, '*')}")
     pprint(f"Call History Table: {query_all_call_history(conn)}")
     close_connection(conn)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+# Gunicorn settings for production serving (gunicorn -c gunicorn.conf.py wsgi:app). Every worker imports the app, the
+# first to take the scheduler lock runs the background sync jobs, the rest only serve web requests
+# (module level names are read as gunicorn settings, don't import the dashboard config module as 'config')
+from config import WEB_WORKERS
+
+bind = '0.0.0.0:5000'
+workers = WEB_WORKERS
+timeout = 120
+accesslog = '-'
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from rich.console import Console
+from rich.table import Table
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds to wait for a launched gunicorn server to answer
+SERVER_START_TIMEOUT = 60
+
+
+def run_load_test(url: str, concurrency: int, duration: int) -> tuple[int, int, list[float]]:
+    """
+    Send requests to url from concurrency threads for duration seconds
+    :param url: Target URL (dashboard page or JSON endpoint)
+    :param concurrency: Number of concurrent client threads
+    :param duration: Test length in seconds
+    :return: Successful request count, failed request count, request latencies (seconds)
+    """
+    results = {'ok': 0, 'failed': 0}
+    latencies = []
+    lock = threading.Lock()
+    end_time = time.perf_counter() + duration
+
+    def client():
+        # One pooled session per client thread
+        session = requests.Session()
+        while time.perf_counter() < end_time:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=30).ok
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                results['ok' if ok else 'failed'] += 1
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results['ok'], results['failed'], latencies
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    """
+    Launch the dashboard under gunicorn (gunicorn.conf.py settings) with a given worker count, wait until it answers
+    :param workers: Number of web worker processes
+    :param port: Local port to bind
+    :return: gunicorn process
+    """
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+                               '-b', f'127.0.0.1:{port}', 'wsgi:app'],
+                              cwd=script_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.perf_counter() + SERVER_START_TIMEOUT
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {server.returncode} ({workers} workers)")
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=5)
+            return server
+        except requests.RequestException:
+            time.sleep(0.5)
+
+    stop_server(server)
+    raise RuntimeError(f"gunicorn didn't answer within {SERVER_START_TIMEOUT}s ({workers} workers)")
+
+
+def stop_server(server: subprocess.Popen):
+    """
+    Stop a launched gunicorn server (graceful shutdown, then kill)
+    :param server: gunicorn process
+    """
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def summarize(ok: int, latencies: list[float], duration: int) -> tuple[float, float, float]:
+    """
+    Throughput and latency percentiles of a load test run
+    :return: Requests/second, p50 and p99 latency (ms)
+    """
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+
+    return ok / duration, p50 * 1000, p99 * 1000
+
+
+# Run against a running dashboard, ex: python load_test.py --url "http://localhost:5000/call_report/query?endpoint=all"
+# or launch it under gunicorn once per worker count and compare requests/second, ex: python load_test.py --workers 1,2,4
+# (the url's port is used for the launched servers, stop the dashboard on it first)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simple throughput load test for the dashboard web workers")
+    parser.add_argument('--url', default='http://localhost:5000/call_report/query?endpoint=all&period=720')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=int, default=30)
+    parser.add_argument('--workers', help="Comma separated gunicorn worker counts to launch and compare (ex: 1,2,4,8)")
+    args = parser.parse_args()
+
+    console = Console()
+
+    if not args.workers:
+        ok, failed, latencies = run_load_test(args.url, args.concurrency, args.duration)
+        rate, p50, p99 = summarize(ok, latencies, args.duration)
+
+        console.print(f"{args.url} ({args.concurrency} clients, {args.duration}s)")
+        console.print(f"Requests: {ok} ok, {failed} failed - {rate:.1f} req/s - p50 {p50:.1f}ms, p99 {p99:.1f}ms")
+        sys.exit(0)
+
+    target = urlparse(args.url)
+    url = target._replace(netloc=f'127.0.0.1:{target.port or 80}').geturl()
+
+    table = Table(title=f"{args.url} ({args.concurrency} clients, {args.duration}s per worker count)")
+    for column in ('Workers', 'OK', 'Failed', 'req/s', 'Speedup', 'p50 (ms)', 'p99 (ms)'):
+        table.add_column(column, justify='right')
+
+    baseline = None
+    for workers in [int(count) for count in args.workers.split(',')]:
+        console.print(f"Launching gunicorn with {workers} worker(s)...")
+        server = start_server(workers, target.port or 80)
+        try:
+            ok, failed, latencies = run_load_test(url, args.concurrency, args.duration)
+        finally:
+            stop_server(server)
+
+        rate, p50, p99 = summarize(ok, latencies, args.duration)
+        baseline = baseline or rate
+        table.add_row(str(workers), str(ok), str(failed), f"{rate:.1f}", f"{rate / baseline:.2f}x" if baseline else '-',
+                      f"{p50:.1f}", f"{p99:.1f}")
+        console.print(f"{workers} worker(s): {rate:.1f} req/s")
+
+    console.print(table)
@@ -22,6 +22,10 @@ import os
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+import config
 
 # Load in Environment Variables
 load_dotenv()
@@ -29,6 +33,16 @@ SERVICENOW_INSTANCE = os.getenv('SERVICENOW_INSTANCE')
 SERVICENOW_USERNAME = os.getenv('SERVICENOW_USERNAME')
 SERVICENOW_PASSWORD = os.getenv('SERVICENOW_PASSWORD')
 
+# Incident fields rendered by the incident pages (only these columns are returned by the incident table API)
+INCIDENT_FIELDS = ('number', 'opened_at', 'closed_at', 'state', 'urgency', 'severity', 'short_description',
+                   'description')
+
+# Pooled connections kept open to the instance, and retries of failed GET requests (connection errors, 429 - honoring
+# Retry-After - and 5XX responses, with exponential backoff)
+CONNECTION_POOL_SIZE = 4
+REQUEST_RETRIES = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                        allowed_methods=('GET',))
+
 
 class ServiceNow:
     """
@@ -37,25 +51,69 @@ class ServiceNow:
 
     def __init__(self, logger: logging.Logger):
         """
-        Initialize the ServiceNow class
+        Initialize the ServiceNow class (one pooled HTTP session, reused by every request)
         """
         self.headers = {"Content-Type": "application/json", "Accept": "application/json"}
         self.auth = (SERVICENOW_USERNAME, SERVICENOW_PASSWORD)
         self.logger = logger
 
-    def get_service_now_incidents(self, params: dict) -> list[dict]:
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.auth = self.auth
+        adapter = HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE,
+                              max_retries=REQUEST_RETRIES)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_table_records(self, table: str, params: dict, fields: tuple[str, ...]) -> list[dict] | None:
         """
-        Get ServiceNow Tickets using filter query
+        Get all records of a table matching a filter query, page by page (SERVICE_NOW_PAGE_SIZE records per request)
+        :param table: Table name (ex: incident)
+        :param params: Table API query params (sysparm_query, sysparm_display_value, ...)
+        :param fields: Fields to return (projection, all other columns are left out of the responses)
+        :return: Records (all pages), None if a request failed
         """
-        # Create new ServiceNow Ticket using ticket_data
-        response = requests.get(SERVICENOW_INSTANCE + "/api/now/table/incident", auth=self.auth, headers=self.headers,
-                                params=params)
+        page_size = config.SERVICE_NOW_PAGE_SIZE
+
+        # Pages must come back in a stable order (records shifting between pages would be skipped or repeated)
+        query = params.get('sysparm_query', '')
+        if 'ORDERBY' not in query:
+            query = f"{query}^ORDERBYsys_id" if query else "ORDERBYsys_id"
+
+        page_params = dict(params, sysparm_query=query, sysparm_fields=','.join(fields), sysparm_limit=page_size,
+                           sysparm_exclude_reference_link='true', sysparm_no_count='true')
+
+        records = []
+        while True:
+            page_params['sysparm_offset'] = len(records)
+            try:
+                response = self.session.get(f"{SERVICENOW_INSTANCE}/api/now/table/{table}", params=page_params,
+                                            timeout=config.SERVICE_NOW_TIMEOUT)
+            except requests.RequestException as e:
+                self.logger.error(f'Failed to retrieve Service Now {table} records: {e}')
+                return None
 
-        if response.ok:
-            incidents = response.json()['result']
+            if not response.ok:
+                self.logger.error(f'Failed to retrieve Service Now {table} records: {response.text}')
+                return None
 
-            self.logger.info(f'{len(incidents)} total ServiceNow Incidents Retrieved')
-            return incidents
-        else:
-            self.logger.error(f'Failed to retrieve Service Now incidents: {response.text}')
+            page = response.json()['result']
+            records.extend(page)
+
+            # A short page is the last one
+            if len(page) < page_size:
+                return records
+
+    def get_service_now_incidents(self, params: dict) -> list[dict]:
+        """
+        Get ServiceNow Tickets using filter query (only the fields displayed on the incident pages)
+        :param params: Incident table query params (see OPEN/CLOSED_SERVICE_NOW_INCIDENT_FILTER)
+        :return: Incidents (empty on failure)
+        """
+        incidents = self.get_table_records('incident', params, INCIDENT_FIELDS)
+
+        if incidents is None:
             return []
+
+        self.logger.info(f'{len(incidents)} total ServiceNow Incidents Retrieved')
+        return incidents
@@ -17,11 +17,16 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import fcntl
+import hashlib
 import logging
 import os
 from datetime import datetime, timedelta
+from functools import lru_cache
 from logging.handlers import TimedRotatingFileHandler
 
+import numpy as np
+import pandas as pd
 import pytz
 import rich.logging
 
@@ -29,6 +34,40 @@ import rich.logging
 script_dir = os.path.dirname(os.path.abspath(__file__))
 logs_path = os.path.join(script_dir, 'logs')
 
+# Shared datetime formats (DB storage format, dashboard display format) and timezone registry size
+DB_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DISPLAY_TIME_FORMAT = '%m/%d/%y %I:%M:%S %p (%Z)'
+TIMEZONE_CACHE_SIZE = 256
+
+# MOS models (see README), default parameter tables. Heuristic: base score, jitter threshold (ms) and penalty per 10ms
+# over it, packet loss good/fair thresholds (%) and penalties, score floor
+HEURISTIC_MOS_PARAMETERS = {
+    'base_score': 5.00,
+    'jitter_threshold': 10.00,
+    'jitter_penalty_per_10ms': 0.1,
+    'packet_loss_good_threshold': 2.0,
+    'packet_loss_fair_threshold': 5.0,
+    'packet_loss_penalty_good_to_fair': 0.5,
+    'packet_loss_penalty_fair_to_poor': 1.0,
+    'min_score': 1.0,
+}
+
+# ITU-T G.107 E-model: basic signal-to-noise ratio (Ro - Is), assumed one way delay without the jitter buffer (ms, not
+# reported by devices), jitter buffer delay per ms of jitter, codec equipment impairment (Ie) and packet loss robustness
+# (Bpl, G.711 with packet loss concealment), burst ratio (1 = random loss), advantage factor (A)
+E_MODEL_MOS_PARAMETERS = {
+    'r0': 93.2,
+    'one_way_delay': 50.0,
+    'jitter_buffer_factor': 2.0,
+    'ie': 0.0,
+    'bpl': 25.1,
+    'burst_ratio': 1.0,
+    'advantage': 0.0,
+}
+
+# Zero padded '00' - '99' strings, indexed by value (vectorized datetime formatting)
+TWO_DIGIT_STRINGS = np.array([f'{i:02d}' for i in range(100)], dtype=object)
+
 
 def set_up_logging() -> logging.Logger:
     """
@@ -79,6 +118,61 @@ def set_up_logging_background() -> logging.Logger:
     return logger
 
 
+def acquire_lock(lock_path: str):
+    """
+    Try to take an exclusive, non-blocking lock on a lock file (released by the OS if the holding process dies)
+    :param lock_path: Lock file path
+    :return: Open lock file (keep a reference for as long as the lock should be held), or None if already locked
+    """
+    lock_file = open(lock_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+
+    # Record holder for troubleshooting
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+
+    return lock_file
+
+
+def device_shard(device_id: str, shards: int) -> int:
+    """
+    Stable shard (bucket) assignment for a device, the same device always maps to the same bucket across processes
+    :param device_id: Unique Webex Device ID
+    :param shards: Number of shards
+    :return: Shard number (0 - shards-1)
+    """
+    return int(hashlib.sha1(device_id.encode()).hexdigest(), 16) % shards
+
+
+@lru_cache(maxsize=TIMEZONE_CACHE_SIZE)
+def get_timezone(timezone: str) -> datetime.tzinfo:
+    """
+    Return timezone object for a timezone name (memoized, bounded LRU registry shared across the dashboard)
+    :param timezone: Timezone name (typically determined by associated device's location timezone), 'N/A' for UTC
+    :return: Timezone object
+    """
+    if timezone != 'N/A':
+        return pytz.timezone(timezone)
+    else:
+        return pytz.utc
+
+
+def format_display_time(time_string: str, timezone: str = 'N/A', time_format: str = DB_TIME_FORMAT) -> str:
+    """
+    Convert a UTC time string to the dashboard display format in the provided timezone
+    :param time_string: UTC time string
+    :param timezone: Display timezone name ('N/A' for UTC)
+    :param time_format: Format of time_string (default: DB storage format)
+    :return: Formatted local time string
+    """
+    utc_time = datetime.strptime(time_string, time_format).replace(tzinfo=pytz.utc)
+    return utc_time.astimezone(get_timezone(timezone)).strftime(DISPLAY_TIME_FORMAT)
+
+
 def convert_seconds_to_time(seconds: int) -> str:
     """
     Convert seconds to formatted string of HH MM SS (used primarily for 'Duration' conversations)
@@ -91,41 +185,193 @@ def convert_seconds_to_time(seconds: int) -> str:
     return '{:02d}H: {:02d}M: {:02d}S'.format(hours, minutes, seconds)
 
 
-def calculate_start_time(duration_seconds: int, timezone: datetime.tzinfo):
+def convert_seconds_to_time_batch(seconds: list[int]) -> list[str]:
+    """
+    Batch version of convert_seconds_to_time, formats a whole column of durations at once (same output strings)
+    :param seconds: Seconds values
+    :return: Formatted strings (easier to read)
+    """
+    seconds = pd.Series(np.asarray(seconds, dtype=np.int64))
+
+    hours = (seconds // 3600).astype(str).str.zfill(2)
+    minutes = ((seconds % 3600) // 60).astype(str).str.zfill(2)
+    seconds = (seconds % 60).astype(str).str.zfill(2)
+
+    return (hours + 'H: ' + minutes + 'M: ' + seconds + 'S').tolist()
+
+
+def format_local_time_column(local_times: pd.Series) -> np.ndarray:
+    """
+    Format a column of timezone aware datetimes as '%m/%d/%y %I:%M:%S %p (%Z)' strings, built from vectorized datetime
+    components (timezone abbreviation looked up once per distinct UTC offset)
+    :param local_times: Timezone aware datetime Series (single timezone)
+    :return: Formatted string array
+    """
+    pad = TWO_DIGIT_STRINGS
+    hours = local_times.dt.hour.to_numpy()
+
+    formatted = (pad[local_times.dt.month.to_numpy()] + '/' + pad[local_times.dt.day.to_numpy()] + '/'
+                 + pad[local_times.dt.year.to_numpy() % 100] + ' ' + pad[(hours + 11) % 12 + 1] + ':'
+                 + pad[local_times.dt.minute.to_numpy()] + ':' + pad[local_times.dt.second.to_numpy()]
+                 + np.where(hours < 12, ' AM (', ' PM ('))
+
+    # Timezone abbreviation (ex: EST vs EDT) only changes with the UTC offset
+    offsets = (local_times.dt.tz_localize(None) - local_times.dt.tz_convert(None)).to_numpy()
+    unique_offsets, first_indices, offset_indices = np.unique(offsets, return_index=True, return_inverse=True)
+    abbreviations = np.array([local_times.iloc[index].strftime('%Z') + ')' for index in first_indices], dtype=object)
+
+    return formatted + abbreviations[offset_indices.reshape(-1)]
+
+
+def localize_time_columns(time_columns: list[list[str]], timezones: list[str]) -> list[list[str]]:
+    """
+    Convert columns of UTC time strings (DB format) to local time display strings. Rows are grouped by timezone and
+    each group is converted and formatted as a whole column (same output as per row astimezone + strftime)
+    :param time_columns: One or more columns of UTC time strings ('%Y-%m-%d %H:%M:%S'), all the same length
+    :param timezones: Timezone name per row (typically the associated device's location timezone, or 'N/A' for UTC)
+    :return: Formatted local time string columns, same order as time_columns
+    """
+    parsed_columns = [pd.to_datetime(pd.Series(column), format=DB_TIME_FORMAT, utc=True)
+                      for column in time_columns]
+    output_columns = [np.empty(len(timezones), dtype=object) for _ in time_columns]
+
+    # Convert and format each timezone group in one pass
+    for timezone, indices in pd.Series(timezones).groupby(timezones, sort=False).indices.items():
+        zone = get_timezone(timezone)
+
+        for parsed_column, output_column in zip(parsed_columns, output_columns):
+            output_column[indices] = format_local_time_column(parsed_column.iloc[indices].dt.tz_convert(zone))
+
+    return [output_column.tolist() for output_column in output_columns]
+
+
+def calculate_start_time(duration_seconds: int, timezone: str) -> str:
     """
     Given a duration, calculate the start time of an event from the current time stamp and in the correct timezone
     :param duration_seconds: How many seconds since an event started
-    :param timezone: Event timezone (typically determined by associated device's location timezone)
+    :param timezone: Event timezone name (typically determined by associated device's location timezone)
     :return: Formatted string showing the starting datetime of the event
     """
-    # Define the time zone (if provided, else, UTC)
-    if timezone != 'N/A':
-        zone = pytz.timezone(timezone)
-    else:
-        zone = pytz.utc
-
-    # Get current date and time
-    current_time = datetime.now(zone)
+    # Get current date and time (in device timezone if provided, else, UTC)
+    current_time = datetime.now(get_timezone(timezone))
 
     # Calculate start time by subtracting duration from current time
     start_time = current_time - timedelta(seconds=duration_seconds)
 
     # Format start time in the desired format
-    formatted_start_time = start_time.strftime('%m/%d/%y %I:%M:%S %p (%Z)')
+    formatted_start_time = start_time.strftime(DISPLAY_TIME_FORMAT)
 
     return formatted_start_time
 
 
+def heuristic_stream_scores(jitter: np.ndarray, packet_loss_percent: np.ndarray, parameters: dict) -> np.ndarray:
+    """
+    Heuristic MOSS of streams (see README: base score minus jitter and packet loss penalties)
+    :param jitter: Stream jitter values (ms)
+    :param packet_loss_percent: Stream packet loss percent values
+    :param parameters: Model parameters (see HEURISTIC_MOS_PARAMETERS)
+    :return: MOSS per stream
+    """
+    jitter_penalty = (np.maximum(0.0, (jitter - parameters['jitter_threshold']) / 10.00)
+                      * parameters['jitter_penalty_per_10ms'])
+    packet_loss_penalty = np.select(
+        [packet_loss_percent <= parameters['packet_loss_good_threshold'],
+         packet_loss_percent <= parameters['packet_loss_fair_threshold']],
+        [0.0, parameters['packet_loss_penalty_good_to_fair']],
+        parameters['packet_loss_penalty_good_to_fair'] + parameters['packet_loss_penalty_fair_to_poor'])
+
+    return np.maximum(parameters['min_score'], parameters['base_score'] - jitter_penalty - packet_loss_penalty)
+
+
+def e_model_stream_scores(jitter: np.ndarray, packet_loss_percent: np.ndarray, parameters: dict) -> np.ndarray:
+    """
+    ITU-T G.107 E-model MOS of streams: R-factor from the delay impairment (assumed one way delay plus jitter buffer) and
+    the effective equipment impairment (codec impairment and packet loss), converted to MOS (1.0 - 4.5)
+    :param jitter: Stream jitter values (ms)
+    :param packet_loss_percent: Stream packet loss percent values
+    :param parameters: Model parameters (see E_MODEL_MOS_PARAMETERS)
+    :return: MOS per stream
+    """
+    # Delay impairment (Id), mouth to ear delay only
+    delay = parameters['one_way_delay'] + parameters['jitter_buffer_factor'] * jitter
+    delay_impairment = 0.024 * delay + 0.11 * np.maximum(delay - 177.3, 0.0)
+
+    # Effective equipment impairment (Ie-eff)
+    equipment_impairment = parameters['ie'] + (95 - parameters['ie']) * packet_loss_percent / (
+            packet_loss_percent / parameters['burst_ratio'] + parameters['bpl'])
+
+    r_factor = parameters['r0'] - delay_impairment - equipment_impairment + parameters['advantage']
+
+    # R-factor to MOS
+    r_factor = np.clip(r_factor, 0.0, 100.0)
+    return np.clip(1 + 0.035 * r_factor + r_factor * (r_factor - 60) * (100 - r_factor) * 7e-6, 1.0, 4.5)
+
+
+# MOS model registry: model name -> (stream scoring function, default parameters). The active model (MOS_MODEL in
+# config.py) is set once per process with set_mos_model
+MOS_MODELS = {
+    'heuristic': (heuristic_stream_scores, HEURISTIC_MOS_PARAMETERS),
+    'e-model': (e_model_stream_scores, E_MODEL_MOS_PARAMETERS),
+}
+active_mos_model = {'name': 'heuristic', 'parameters': HEURISTIC_MOS_PARAMETERS}
+
+
+def register_mos_model(name: str, stream_scores, parameters: dict):
+    """
+    Add a MOS model to the registry
+    :param name: Model name (MOS_MODEL value)
+    :param stream_scores: Stream scoring function (jitter array, packet loss percent array, parameters) -> MOS array
+    :param parameters: Default model parameters
+    """
+    MOS_MODELS[name] = (stream_scores, parameters)
+
+
+def set_mos_model(name: str, parameters: dict | None = None):
+    """
+    Select the MOS model used by calculate_mos / calculate_mos_batch when no model is given
+    :param name: Registered model name
+    :param parameters: Parameter overrides (merged over the model's default parameters)
+    """
+    if name not in MOS_MODELS:
+        raise ValueError(f"Unknown MOS model: {name} (available: {', '.join(MOS_MODELS)})")
+
+    active_mos_model['name'] = name
+    active_mos_model['parameters'] = {**MOS_MODELS[name][1], **(parameters or {})}
+
+
+def get_mos_model(name: str | None = None, parameters: dict | None = None) -> tuple[str, dict]:
+    """
+    Resolve a MOS model and its parameters (the active model if no name is given)
+    :param name: Registered model name
+    :param parameters: Parameter overrides (merged over the model's default parameters)
+    :return: Model name, model parameters
+    """
+    if name is None:
+        return active_mos_model['name'], {**active_mos_model['parameters'], **(parameters or {})}
+
+    return name, {**MOS_MODELS[name][1], **(parameters or {})}
+
+
 def calculate_mos(incoming_jitter: float | None, outgoing_jitter: float | None,
-                  incoming_packet_loss_percent: int | None, outgoing_packet_loss_percent: int | None) -> float | str:
+                  incoming_packet_loss_percent: int | None, outgoing_packet_loss_percent: int | None,
+                  model: str | None = None, parameters: dict | None = None) -> float | str:
     """
     Calculate MOSS scores for Audio and Video based on jitter and packet loss, choose the minimum of the scores between incoming and outgoing calculations
     :param incoming_jitter: Incoming stream jitter
     :param outgoing_jitter: Outgoing stream jitter
     :param incoming_packet_loss_percent: Incoming stream packet loss
     :param outgoing_packet_loss_percent: Outgoing stream packet loss
+    :param model: MOS model (default: active model)
+    :param parameters: Model parameter overrides
     :return: Minimum of 2 calculated stream MOSS values
     """
+    model, parameters = get_mos_model(model, parameters)
+
+    # Models other than the heuristic are only implemented for batches
+    if model != 'heuristic':
+        return mos_values(calculate_mos_batch([incoming_jitter], [outgoing_jitter], [incoming_packet_loss_percent],
+                                              [outgoing_packet_loss_percent], model, parameters))[0]
+
     # Initialize a list to hold the scores
     scores = []
 
@@ -137,30 +383,19 @@ def calculate_mos(incoming_jitter: float | None, outgoing_jitter: float | None,
         :param packet_loss_percent: Packet loss percent value (int - %)
         :return: Calculated MOSS score
         """
-        # Base score
-        base_score = 5.00
-
-        # Thresholds and penalties for jitter
-        jitter_threshold = 10.00  # in ms
-        jitter_penalty_per_10ms_over_threshold = 0.1
-
-        # Thresholds and penalties for packet loss
-        packet_loss_good_threshold = 2.0  # Up to 2% is considered good
-        packet_loss_fair_threshold = 5.0  # Between 2% and 5% is fair to poor
-        packet_loss_penalty_good_to_fair = 0.5  # Penalty for exceeding good threshold but less than fair
-        packet_loss_penalty_fair_to_poor = 1.0  # Additional penalty for exceeding fair threshold
-
         # Calculate penalties
-        jitter_penalty = max(0.0, (jitter - jitter_threshold) / 10.00) * jitter_penalty_per_10ms_over_threshold
-        if packet_loss_percent <= packet_loss_good_threshold:
+        jitter_penalty = (max(0.0, (jitter - parameters['jitter_threshold']) / 10.00)
+                          * parameters['jitter_penalty_per_10ms'])
+        if packet_loss_percent <= parameters['packet_loss_good_threshold']:
             packet_loss_penalty = 0.0
-        elif packet_loss_percent <= packet_loss_fair_threshold:
-            packet_loss_penalty = packet_loss_penalty_good_to_fair
+        elif packet_loss_percent <= parameters['packet_loss_fair_threshold']:
+            packet_loss_penalty = parameters['packet_loss_penalty_good_to_fair']
         else:
-            packet_loss_penalty = packet_loss_penalty_good_to_fair + packet_loss_penalty_fair_to_poor
+            packet_loss_penalty = (parameters['packet_loss_penalty_good_to_fair']
+                                   + parameters['packet_loss_penalty_fair_to_poor'])
 
         # Calculate and return the score
-        return max(1.0, base_score - jitter_penalty - packet_loss_penalty)
+        return max(parameters['min_score'], parameters['base_score'] - jitter_penalty - packet_loss_penalty)
 
     # Calculate incoming score if data is present
     if incoming_jitter is not None and incoming_packet_loss_percent is not None:
@@ -172,3 +407,268 @@ def calculate_mos(incoming_jitter: float | None, outgoing_jitter: float | None,
 
     # Return the minimum score if both scores are present, otherwise return the single score available
     return min(scores) if scores else 'N/A'
+
+
+def calculate_mos_batch(incoming_jitter, outgoing_jitter, incoming_packet_loss_percent,
+                        outgoing_packet_loss_percent, model: str | None = None,
+                        parameters: dict | None = None) -> np.ndarray:
+    """
+    Vectorized calculate_mos: score many calls at once (same model and min of incoming/outgoing streams). Missing values
+    (None) are accepted and treated as NaN; a stream is only scored if both its jitter and packet loss are present
+    :param incoming_jitter: Incoming stream jitter per call (array like)
+    :param outgoing_jitter: Outgoing stream jitter per call (array like)
+    :param incoming_packet_loss_percent: Incoming stream packet loss per call (array like)
+    :param outgoing_packet_loss_percent: Outgoing stream packet loss per call (array like)
+    :param model: MOS model (default: active model)
+    :param parameters: Model parameter overrides
+    :return: Float array of MOSS values, NaN where neither stream could be scored ('N/A', see mos_values)
+    """
+    model, parameters = get_mos_model(model, parameters)
+    stream_scores = MOS_MODELS[model][0]
+
+    def calculate_scores(jitter: np.ndarray, packet_loss_percent: np.ndarray) -> np.ndarray:
+        """
+        Score one stream direction, NaN where jitter or packet loss is missing
+        :param jitter: Jitter values (ms)
+        :param packet_loss_percent: Packet loss percent values
+        :return: Calculated MOSS scores
+        """
+        missing = np.isnan(jitter) | np.isnan(packet_loss_percent)
+        with np.errstate(invalid='ignore'):
+            scores = stream_scores(jitter, packet_loss_percent, parameters)
+        scores[missing] = np.nan
+        return scores
+
+    # None -> NaN (missing stream data)
+    incoming_scores = calculate_scores(np.asarray(incoming_jitter, dtype=float),
+                                       np.asarray(incoming_packet_loss_percent, dtype=float))
+    outgoing_scores = calculate_scores(np.asarray(outgoing_jitter, dtype=float),
+                                       np.asarray(outgoing_packet_loss_percent, dtype=float))
+
+    # Minimum of the scored streams (fmin ignores a missing stream, NaN only if both are missing)
+    return np.fmin(incoming_scores, outgoing_scores)
+
+
+def mos_values(scores: np.ndarray) -> list[float | str]:
+    """
+    Convert calculate_mos_batch output to calculate_mos style values (floats, 'N/A' where no stream was scored)
+    :param scores: MOSS score array
+    :return: List of MOSS values
+    """
+    return [score if score == score else 'N/A' for score in scores.tolist()]
+
+
+def netstat_metrics(netstat: dict | None) -> tuple[float | None, float | None]:
+    """
+    Jitter and packet loss of a call media channel (Netstat information, see WebexDeviceAPI.get_call_media_channels)
+    :param netstat: Media channel Netstat information, None if the channel is not present
+    :return: Max jitter, last interval packet loss percent (None values if the channel is not present)
+    """
+    if not netstat:
+        return None, None
+
+    try:
+        packet_loss_percent = round(((netstat['LastIntervalLost'] / netstat['LastIntervalReceived']) * 100), 2)
+    except ZeroDivisionError:
+        packet_loss_percent = 0.0
+
+    return netstat['MaxJitter'], packet_loss_percent
+
+
+class RingBuffer:
+    """
+    Fixed capacity buffer of numeric rows backed by a preallocated NumPy array, once full the oldest row is overwritten
+    """
+
+    def __init__(self, capacity: int, columns: int):
+        self.rows = np.full((capacity, columns), np.nan)
+        self.next = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, row: list[float | None]):
+        """
+        Add a row (None values are stored as NaN), overwrites the oldest row if the buffer is full
+        :param row: Row values, one per column
+        """
+        self.rows[self.next] = row
+        self.next = (self.next + 1) % len(self.rows)
+        self.count = min(self.count + 1, len(self.rows))
+
+    def values(self) -> np.ndarray:
+        """
+        Return the buffered rows, oldest first
+        :return: Array of rows (count x columns)
+        """
+        if self.count < len(self.rows):
+            return self.rows[:self.count].copy()
+
+        return np.roll(self.rows, -self.next, axis=0)
+
+
+# Call quality analytics: metric columns (call_history) and percentiles reported per group
+CALL_QUALITY_METRICS = ('a_mos', 'v_mos', 'a_pkt_loss_max', 'v_pkt_loss_max', 'a_jit_max', 'v_jit_max')
+CALL_QUALITY_PERCENTILES = (50, 90, 99)
+
+
+def summarize_call_quality(calls: list[tuple]) -> list[dict]:
+    """
+    Aggregate call quality metrics per group: call count and p50/p90/p99 of each metric (whole columns at once, calls
+    without a value for a metric - ex: 'N/A' MOSS, None - are left out of that metric's percentiles)
+    :param calls: List of (group, label, *CALL_QUALITY_METRICS) entries (see db.query_call_quality)
+    :return: One summary per group ({group, label, calls, <metric>: {p50, p90, p99}}), ordered by group
+    """
+    if not calls:
+        return []
+
+    frame = pd.DataFrame(calls, columns=['group', 'label', *CALL_QUALITY_METRICS])
+    metrics = frame[list(CALL_QUALITY_METRICS)].astype(float)
+
+    groups = metrics.groupby(frame['group'], sort=True)
+    counts = groups.size()
+    labels = frame.groupby('group', sort=True)['label'].first()
+    percentiles = groups.quantile([percentile / 100 for percentile in CALL_QUALITY_PERCENTILES]).unstack()
+    percentiles = percentiles[list(CALL_QUALITY_METRICS)]
+
+    summaries = []
+    for group, row in zip(counts.index.tolist(), percentiles.itertuples(index=False)):
+        values = iter(None if value != value else round(value, 2) for value in row)
+
+        summary = {'group': group, 'label': labels[group], 'calls': int(counts[group])}
+        for metric in CALL_QUALITY_METRICS:
+            summary[metric] = {f'p{percentile}': next(values) for percentile in CALL_QUALITY_PERCENTILES}
+        summaries.append(summary)
+
+    return summaries
+
+
+# Chart bucket sizes (seconds), the smallest size keeping a time range within the requested number of points is used
+CHART_BUCKET_SIZES = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 7 * 86400)
+
+
+def chart_bucket_seconds(range_seconds: float, max_points: int) -> int:
+    """
+    Fixed bucket size of a chart time range
+    :param range_seconds: Time range length
+    :param max_points: Maximum number of buckets
+    :return: Bucket size in seconds (largest size if even that exceeds max_points)
+    """
+    # A range spans one more bucket than its length in buckets unless it starts on a bucket boundary
+    for bucket_seconds in CHART_BUCKET_SIZES:
+        if range_seconds / bucket_seconds + 1 <= max_points:
+            return bucket_seconds
+
+    return CHART_BUCKET_SIZES[-1]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the first and last points, and from each of threshold - 2 equal
+    buckets in between the point forming the largest triangle with the previously kept point and the next bucket's
+    average (preserves the visual shape of a series, spikes included)
+    :param x: Point x values (ascending)
+    :param y: Point y values
+    :param threshold: Number of points to keep
+    :return: Indices of the kept points (all points if there are no more than threshold)
+    """
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+
+    # Bucket edges over the points between the first and last points (each bucket holds at least one point)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(int)
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, count - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        # Average of the next bucket (the last point for the last bucket)
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+            average_x, average_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            average_x, average_y = x[-1], y[-1]
+
+        # Twice the triangle areas (previous kept point, candidate, next bucket average)
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = selected[bucket + 1] = start + int(np.argmax(areas))
+
+    return selected
+
+
+# Device quality degradation detector metrics: (metric, direction - 1 if higher values are worse, -1 if lower values are
+# worse, minimum standard deviation - keeps a very stable baseline from flagging small changes)
+QUALITY_DETECTOR_METRICS = (('a_mos', -1, 0.1), ('v_mos', -1, 0.1), ('a_pkt_loss_max', 1, 0.5),
+                            ('v_pkt_loss_max', 1, 0.5), ('a_jit_max', 1, 2.0), ('v_jit_max', 1, 2.0),
+                            ('failure_rate', 1, 0.05))
+
+
+def update_quality_state(state: dict, observation: dict, baseline_alpha: float, recent_alpha: float,
+                         min_calls: int, threshold: float, update_baseline: bool = True):
+    """
+    Update a device's quality detector state with one observation (constant time and size: per metric baseline EWMA and
+    exponentially weighted variance, recent EWMA and observation count). The baseline is a plain average of the first
+    min_calls observations, afterwards outliers only move it by up to threshold standard deviations (a degradation
+    doesn't inflate the baseline variance it is measured against, a lasting change is still absorbed over time)
+    :param state: Detector state, {metric: [baseline mean, baseline variance, recent mean, count]} (updated in place)
+    :param observation: Metric values of one call or active call sample (missing metrics are None / absent)
+    :param baseline_alpha: Baseline smoothing factor (small, slow to follow changes)
+    :param recent_alpha: Recent quality smoothing factor (large, follows changes quickly)
+    :param min_calls: Observations required before a metric's baseline is trusted
+    :param threshold: Standard deviations from the baseline at which a metric is flagged as degraded
+    :param update_baseline: False for active call samples (only the recent quality of metrics with a baseline moves)
+    """
+    for metric, _, min_deviation in QUALITY_DETECTOR_METRICS:
+        value = observation.get(metric)
+        if value is None:
+            continue
+
+        if metric not in state:
+            if update_baseline:
+                state[metric] = [value, 0.0, value, 1]
+            continue
+
+        mean, variance, recent, count = state[metric]
+        if update_baseline:
+            difference = value - mean
+            if count >= min_calls:
+                limit = threshold * max(variance ** 0.5, min_deviation)
+                difference = min(max(difference, -limit), limit)
+
+            alpha = max(baseline_alpha, 1 / (count + 1))
+            increment = alpha * difference
+            mean += increment
+            variance = (1 - alpha) * (variance + difference * increment)
+            count += 1
+        recent += recent_alpha * (value - recent)
+
+        state[metric] = [mean, variance, recent, count]
+
+
+def score_quality_state(state: dict, min_calls: int, threshold: float) -> tuple[float, list[str]]:
+    """
+    Score how far a device's recent quality departs (for the worse) from its baseline
+    :param state: Detector state (see update_quality_state)
+    :param min_calls: Observations required before a metric's baseline is trusted
+    :param threshold: Standard deviations from the baseline at which a metric is flagged as degraded
+    :return: Degradation score (largest deviation for the worse in standard deviations, 0 if none), degraded metrics
+    """
+    score, degraded = 0.0, []
+    for metric, direction, min_deviation in QUALITY_DETECTOR_METRICS:
+        if metric not in state or state[metric][3] < min_calls:
+            continue
+
+        mean, variance, recent, _ = state[metric]
+        deviation = direction * (recent - mean) / max(variance ** 0.5, min_deviation)
+
+        score = max(score, deviation)
+        if deviation >= threshold:
+            degraded.append(metric)
+
+    return round(score, 3), degraded
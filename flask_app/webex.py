@@ -17,17 +17,23 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import heapq
+import itertools
 import json
 import logging
 import os
 import sys
+import threading
 import time
+from collections import Counter, deque
 
 import requests
 from dotenv import load_dotenv
 from requests_oauthlib import OAuth2Session
 from rich.console import Console
 
+import config
+
 # Load env variables
 load_dotenv()
 WEBEX_CLIENT_ID = os.getenv("WEBEX_CLIENT_ID")
@@ -39,16 +45,39 @@ BASE_URL = 'https://webexapis.com/v1/'
 XAPI_STATUS_URL = "xapi/status"
 XAPI_COMMAND_URL = "xapi/command"
 
+# Request priorities (lower value is served first): interactive page lookups preempt background sync requests
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+# Number of recent queue wait samples kept per priority (used for wait percentiles)
+QUEUE_WAIT_SAMPLES = 1000
+
+# Access tokens are refreshed in the background TOKEN_REFRESH_MARGIN seconds before they expire (failed refreshes are
+# retried every TOKEN_REFRESH_RETRY seconds)
+TOKEN_REFRESH_MARGIN = 12 * 3600
+TOKEN_REFRESH_RETRY = 300
+
 # Absolute Paths
 script_dir = os.path.dirname(os.path.abspath(__file__))
 tokens_path = os.path.join(script_dir, 'tokens.json')
 
 
-def refresh_token(tokens: dict, logger: logging.Logger) -> dict:
+def org_tokens_path(org_id: str) -> str:
+    """
+    Return the tokens file of a configured Webex org (WEBEX_ORGS in config.py)
+    :param org_id: Org name (key in WEBEX_ORGS)
+    :return: Absolute tokens file path
+    """
+    return os.path.join(script_dir, config.WEBEX_ORGS[org_id])
+
+
+def refresh_token(tokens: dict, logger: logging.Logger, tokens_file: str = tokens_path) -> dict:
     """
     Refresh Webex token if primary token is expired (assumes refresh token is valid)
     :param tokens: Primary and Refresh Tokens
     :param logger: Logger Object
+    :param tokens_file: Tokens file the new tokens are written to
     :return: New set of tokens
     """
     refresh_token = tokens['refresh_token']
@@ -60,23 +89,26 @@ def refresh_token(tokens: dict, logger: logging.Logger) -> dict:
     auth_code = OAuth2Session(WEBEX_CLIENT_ID, token=tokens)
     new_teams_token = auth_code.refresh_token(TOKEN_URL, **extra)
 
-    # store away the new token
-    with open(tokens_path, 'w') as json_file:
+    # store away the new token (replaced atomically, other processes may read the file at any time)
+    temp_file = f"{tokens_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w') as json_file:
         json.dump(new_teams_token, json_file)
+    os.replace(temp_file, tokens_file)
 
-    logger.info("A new token has been generated and stored in `tokens.json`")
+    logger.info(f"A new token has been generated and stored in `{os.path.basename(tokens_file)}`")
     return new_teams_token
 
 
-def get_webex_token(logger: logging.Logger) -> str:
+def load_tokens(logger: logging.Logger, tokens_file: str = tokens_path) -> dict:
     """
-    Get Valid Webex Access Token (from OAuth token workflow, Refresh Workflow, or end application if both tokens expired)
+    Get Valid Webex Tokens (from OAuth token workflow, Refresh Workflow, or end application if both tokens expired)
     :param logger: Logger Object
-    :return: Valid Webex API Access Token
+    :param tokens_file: Tokens file to read (one per Webex org)
+    :return: Valid Webex tokens (access token, refresh token, expiry)
     """
     # If token file already exists, extract existing tokens
-    if os.path.exists(tokens_path):
-        with open(tokens_path) as f:
+    if os.path.exists(tokens_file):
+        with open(tokens_file) as f:
             tokens = json.load(f)
     else:
         tokens = None
@@ -93,12 +125,105 @@ def get_webex_token(logger: logging.Logger) -> str:
     elif time.time() > tokens['expires_at']:
         # Generate a new token using the refresh token
         logger.info("Existing primary token expired! Using refresh token...")
-        tokens = refresh_token(tokens, logger)
+        tokens = refresh_token(tokens, logger, tokens_file)
     else:
         # Use existing valid token
         logger.info("Existing primary token is valid!")
 
-    return tokens['access_token']
+    return tokens
+
+
+def get_webex_token(logger: logging.Logger, tokens_file: str = tokens_path) -> str:
+    """
+    Get Valid Webex Access Token (from OAuth token workflow, Refresh Workflow, or end application if both tokens expired)
+    :param logger: Logger Object
+    :param tokens_file: Tokens file to read (one per Webex org)
+    :return: Valid Webex API Access Token
+    """
+    return load_tokens(logger, tokens_file)['access_token']
+
+
+class TokenProvider:
+    """
+    Webex tokens of one org, shared by all WebexDeviceAPI instances of the org. The access token is refreshed in the
+    background ahead of expiry and on 401 responses (one refresh for all threads that saw the 401), request headers are
+    swapped atomically (a new headers dictionary replaces the old one)
+    """
+
+    def __init__(self, tokens_file: str, logger: logging.Logger):
+        self.tokens_file = tokens_file
+        self.logger = logger
+        self.lock = threading.Lock()
+
+        self.tokens = load_tokens(logger, tokens_file)
+        self.headers = {'Authorization': f"Bearer {self.tokens['access_token']}"}
+
+        self.refresh_timer = None
+        self.schedule_refresh()
+
+    def schedule_refresh(self, delay: float | None = None):
+        """
+        Schedule the next background refresh (TOKEN_REFRESH_MARGIN seconds before the access token expires)
+        :param delay: Seconds until the refresh (default: based on the current token expiry)
+        """
+        if delay is None:
+            delay = max(self.tokens['expires_at'] - time.time() - TOKEN_REFRESH_MARGIN, 0)
+
+        if self.refresh_timer:
+            self.refresh_timer.cancel()
+        self.refresh_timer = threading.Timer(delay, self.refresh)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+    def refresh(self, failed_headers: dict | None = None) -> bool:
+        """
+        Refresh the access token (background refresh, or after a 401). Concurrent callers wait for a single refresh, a
+        token already replaced since the failed request, or a newer token written by another process, is reused
+        :param failed_headers: Headers of the request answered with 401 (None for a background refresh)
+        :return: True if a newer token is available
+        """
+        with self.lock:
+            # Another thread already refreshed the token the failed request used
+            if failed_headers is not None and failed_headers is not self.headers:
+                return True
+
+            try:
+                # Another process (web worker, collector) may already have refreshed the token
+                with open(self.tokens_file) as f:
+                    tokens = json.load(f)
+
+                if (tokens['access_token'] == self.tokens['access_token']
+                        or tokens['expires_at'] - time.time() < TOKEN_REFRESH_MARGIN):
+                    tokens = refresh_token(tokens, self.logger, self.tokens_file)
+            except Exception as e:
+                self.logger.error(f"Token refresh failed, retrying in {TOKEN_REFRESH_RETRY} seconds: "
+                                  f"{type(e).__name__}: {e}")
+                self.schedule_refresh(TOKEN_REFRESH_RETRY)
+                return False
+
+            self.tokens = tokens
+            self.headers = {'Authorization': f"Bearer {tokens['access_token']}"}
+            self.schedule_refresh()
+
+            return True
+
+
+# Token providers, one per tokens file (shared by every WebexDeviceAPI instance of the org in this process)
+token_providers = {}
+token_providers_lock = threading.Lock()
+
+
+def get_token_provider(tokens_file: str, logger: logging.Logger) -> TokenProvider:
+    """
+    Return the token provider of a tokens file (created on first use)
+    :param tokens_file: Tokens file (one per Webex org)
+    :param logger: Logger Object
+    :return: Token provider
+    """
+    with token_providers_lock:
+        if tokens_file not in token_providers:
+            token_providers[tokens_file] = TokenProvider(tokens_file, logger)
+        return token_providers[tokens_file]
 
 
 def get_next_page_url(link_header: str):
@@ -118,15 +243,260 @@ def get_next_page_url(link_header: str):
     return None
 
 
+class RequestScheduler:
+    """
+    Priority request gate shared by every WebexDeviceAPI instance in the process. Queued interactive requests are always
+    started before queued bulk requests, bulk requests only start while the request budget (token bucket) is above the
+    interactive reserve, and a 429 Retry-After pauses all requests instead of each thread sleeping on its own
+    """
+
+    def __init__(self, max_concurrent: int, requests_per_second: float, interactive_reserve: int):
+        self.max_concurrent = max_concurrent
+        self.rate = requests_per_second
+        self.interactive_reserve = interactive_reserve
+        self.capacity = max(requests_per_second, interactive_reserve + 1)
+
+        self.condition = threading.Condition()
+        self.waiting = []  # Heap of (priority, sequence) queue entries
+        self.sequence = itertools.count()
+        self.active = 0
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+
+        self.wait_stats = {priority: {'requests': 0, 'total_wait': 0.0, 'max_wait': 0.0,
+                                      'recent_waits': deque(maxlen=QUEUE_WAIT_SAMPLES)} for priority in PRIORITY_NAMES}
+
+    def refill(self, now: float):
+        """
+        Add request budget accrued since the last refill (capped at bucket capacity)
+        :param now: Current monotonic time
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def time_until_ready(self, priority: int, now: float) -> float | None:
+        """
+        Seconds until a request of the given priority may start (0 = start now, None = wait for a running request to
+        finish)
+        :param priority: Request priority
+        :param now: Current monotonic time
+        :return: Seconds to wait
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.active >= self.max_concurrent:
+            return None
+
+        # Bulk requests leave the reserve untouched, so interactive requests never wait on budget bulk work used up
+        needed = 1 if priority == PRIORITY_INTERACTIVE else 1 + self.interactive_reserve
+        if self.tokens < needed:
+            return (needed - self.tokens) / self.rate
+        return 0
+
+    def acquire(self, priority: int):
+        """
+        Block until a request of the given priority may be sent (head of the priority queue, slot and budget available)
+        :param priority: Request priority
+        """
+        entry = (priority, next(self.sequence))
+        queued_at = time.monotonic()
+
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+
+                delay = self.time_until_ready(priority, now) if self.waiting[0] == entry else None
+                if delay == 0:
+                    break
+                self.condition.wait(timeout=delay)
+
+            heapq.heappop(self.waiting)
+            self.active += 1
+            self.tokens -= 1
+
+            # Record queue wait time
+            wait = now - queued_at
+            stats = self.wait_stats[priority]
+            stats['requests'] += 1
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+            stats['recent_waits'].append(wait)
+
+            # Let the next queued request re-evaluate (new queue head)
+            self.condition.notify_all()
+
+    def release(self, retry_after: int = 0):
+        """
+        Mark a request as finished, pause all requests for retry_after seconds if it was rate limited
+        :param retry_after: Retry-After seconds from a 429 response (0 if not rate limited)
+        """
+        with self.condition:
+            self.active -= 1
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                self.tokens = 0
+            self.condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """
+        Queue wait statistics per priority (seconds), plus current gate state
+        :return: Stats dictionary
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.refill(now)
+            queued = Counter(priority for priority, _ in self.waiting)
+
+            stats = {'active': self.active, 'tokens': round(self.tokens, 2),
+                     'rate_limited_for': round(max(0.0, self.blocked_until - now), 2)}
+            for priority, name in PRIORITY_NAMES.items():
+                priority_stats = self.wait_stats[priority]
+                recent_waits = sorted(priority_stats['recent_waits'])
+                requests_made = priority_stats['requests']
+
+                stats[name] = {
+                    'requests': requests_made,
+                    'queued': queued[priority],
+                    'avg_wait': round(priority_stats['total_wait'] / requests_made, 4) if requests_made else 0,
+                    'p95_wait': round(recent_waits[int(0.95 * (len(recent_waits) - 1))], 4) if recent_waits else 0,
+                    'max_wait': round(priority_stats['max_wait'], 4)
+                }
+
+        return stats
+
+
+# Process wide request gates, one per Webex org (each org's token has its own rate limit budget, shared by all
+# WebexDeviceAPI instances of the org)
+request_schedulers = {}
+request_schedulers_lock = threading.Lock()
+
+
+def get_request_scheduler(org_id: str) -> RequestScheduler:
+    """
+    Return the request gate of a Webex org (created on first use)
+    :param org_id: Org name (key in WEBEX_ORGS)
+    :return: Org request gate
+    """
+    with request_schedulers_lock:
+        if org_id not in request_schedulers:
+            request_schedulers[org_id] = RequestScheduler(config.API_MAX_CONCURRENT_REQUESTS,
+                                                          config.API_REQUESTS_PER_SECOND,
+                                                          config.API_INTERACTIVE_RESERVE)
+        return request_schedulers[org_id]
+
+
 class WebexDeviceAPI:
     """
     Webex Devices API Class, includes various methods for interacting with Webex Device APIs (including xAPI)
     """
 
-    def __init__(self, token: str, logger: logging.Logger):
-        self.headers = {'Authorization': f'Bearer {token}'}
+    def __init__(self, token_provider: TokenProvider, logger: logging.Logger, priority: int = PRIORITY_INTERACTIVE,
+                 org_id: str | None = None):
+        self.token_provider = token_provider
         self.logger = logger if logger else Console()
 
+        # Webex org the token belongs to (defaults to the first org in WEBEX_ORGS)
+        self.org_id = org_id if org_id else next(iter(config.WEBEX_ORGS))
+
+        # Request priority (interactive page lookups or bulk background sync), and the org's request gate
+        self.priority = priority
+        self.request_scheduler = get_request_scheduler(self.org_id)
+
+        # Per thread request counters (API calls made, 429 responses received, calls skipped), read by the scheduler
+        # job runner
+        self.counters = threading.local()
+
+        # Average request time (seconds, moving average), used to estimate the time saved by skipped calls
+        self.average_request_time = None
+
+    @property
+    def headers(self) -> dict:
+        """
+        Current request headers (bearer token, replaced whenever the token is refreshed)
+        """
+        return self.token_provider.headers
+
+    def count_request(self, rate_limited: bool = False):
+        """
+        Count an API request made by the current thread
+        :param rate_limited: Request was answered with 429 Too Many Requests
+        """
+        self.counters.api_calls = getattr(self.counters, 'api_calls', 0) + 1
+        if rate_limited:
+            self.counters.rate_limited = getattr(self.counters, 'rate_limited', 0) + 1
+
+    def get_request_counts(self) -> tuple[int, int]:
+        """
+        Return request counters for the current thread
+        :return: API calls made, 429 responses received
+        """
+        return getattr(self.counters, 'api_calls', 0), getattr(self.counters, 'rate_limited', 0)
+
+    def skip_request(self):
+        """
+        Count an API request the current thread skipped (ex: xAPI call to an offline device), the time saved is estimated
+        with the average request time
+        """
+        self.counters.skipped = getattr(self.counters, 'skipped', 0) + 1
+        self.counters.time_saved = getattr(self.counters, 'time_saved', 0.0) + (self.average_request_time or 0.0)
+
+    def get_skipped_counts(self) -> tuple[int, float]:
+        """
+        Return skipped request counters for the current thread
+        :return: API calls skipped, estimated seconds saved
+        """
+        return getattr(self.counters, 'skipped', 0), getattr(self.counters, 'time_saved', 0.0)
+
+    def send_request(self, method: str, url: str, headers=None, **kwargs) -> requests.Response:
+        """
+        Send a request with the current access token, a 401 triggers one token refresh (shared with any other thread
+        that saw the 401) and a single retry
+        :param method: HTTP method
+        :param url: Full request URL
+        :param headers: Optional Headers (used to execute calls with Webex Bot Token, never refreshed)
+        :param kwargs: requests.request arguments (params, json)
+        :return: Response
+        """
+        request_headers = headers if headers else self.headers
+        response = self.send_gated_request(method, url, headers=request_headers, **kwargs)
+
+        if response.status_code == 401 and not headers and self.token_provider.refresh(request_headers):
+            self.logger.info("Access token rejected (401), retrying with the refreshed token")
+            response = self.send_gated_request(method, url, headers=self.headers, **kwargs)
+
+        return response
+
+    def send_gated_request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the process wide priority gate (waits for its turn, reports 429 Retry-After to the gate)
+        :param method: HTTP method
+        :param url: Full request URL
+        :param kwargs: requests.request arguments (headers, params, json)
+        :return: Response
+        """
+        self.request_scheduler.acquire(self.priority)
+        retry_after = 0
+        start_time = time.perf_counter()
+        try:
+            response = requests.request(method, url, **kwargs)
+            if response.status_code == 429:
+                retry_after = int(
+                    response.headers.get('Retry-After', 10))  # Default to 10 seconds if Retry-After is not provided
+        finally:
+            self.request_scheduler.release(retry_after)
+
+        request_time = time.perf_counter() - start_time
+        if self.average_request_time is None:
+            self.average_request_time = request_time
+        else:
+            self.average_request_time = 0.9 * self.average_request_time + 0.1 * request_time
+
+        self.count_request(response.status_code == 429)
+        return response
+
     def get_wrapper(self, url: str, params: dict, headers=None) -> dict | None:
         """
         REST Get API Wrapper, includes support for paging, 429 rate limiting, and error handling
@@ -141,7 +511,7 @@ class WebexDeviceAPI:
         retry_count = 0
 
         while next_url:
-            response = requests.get(url=next_url, headers=headers if headers else self.headers, params=params)
+            response = self.send_request('GET', next_url, headers=headers, params=params)
 
             if response.ok:
                 response_data = response.json()
@@ -160,12 +530,10 @@ class WebexDeviceAPI:
                 if next_url:
                     params = {}
             elif response.status_code == 429:
-                # Handle 429 Too Many Requests error (25 maximum retries to avoid infinite loops)
+                # Handle 429 Too Many Requests error (25 maximum retries to avoid infinite loops), the request gate holds
+                # the retry until Retry-After has passed
                 if retry_count < 25:
                     retry_count += 1
-                    sleep_time = int(
-                        response.headers.get('Retry-After', 10))  # Default to 10 seconds if Retry-After is not provided
-                    time.sleep(sleep_time)
                 else:
                     self.logger.info("Rate limit exceeded, maximum amount of retries exceeded.")
                     return None
@@ -190,18 +558,16 @@ class WebexDeviceAPI:
         target_url = f'{BASE_URL}{url}'
         retry_count = 0
 
-        response = requests.post(url=target_url, headers=headers if headers else self.headers, params=params, json=body)
-
         while retry_count < 25:
+            response = self.send_request('POST', target_url, headers=headers, params=params, json=body)
+
             if response.ok:
                 response_data = response.json()
                 return response_data
             elif response.status_code == 429:
-                # Handle 429 Too Many Requests error (25 maximum retries to avoid infinite loops)
+                # Handle 429 Too Many Requests error (25 maximum retries to avoid infinite loops), the request gate holds
+                # the retry until Retry-After has passed
                 retry_count += 1
-                sleep_time = int(
-                    response.headers.get('Retry-After', 10))  # Default to 10 seconds if Retry-After is not provided
-                time.sleep(sleep_time)
             else:
                 # Print failure message on error
                 self.logger.error("Request FAILED: " + str(
@@ -329,6 +695,9 @@ class WebexDeviceAPI:
 
                 # Create new entry is call history dictionary mapped to device_id
                 call_history[device_id] = calls_with_deviceid
+            elif response:
+                # Device answered, no calls in its history
+                call_history[device_id] = []
 
         self.logger.info(f"Found the following call history for device_ids ({device_ids}): {call_history}")
         return call_history
@@ -449,3 +818,15 @@ class WebexDeviceAPI:
         else:
             self.logger.error(f"Unable to find peripheral information for device_id ({device_id}): {response}")
             return {}
+
+
+def create_org_apis(org_ids, logger: logging.Logger, priority: int = PRIORITY_INTERACTIVE) -> dict[str, WebexDeviceAPI]:
+    """
+    Create one WebexDeviceAPI instance per Webex org (each with the org's own token)
+    :param org_ids: Org names (keys in WEBEX_ORGS)
+    :param logger: Logger Object
+    :param priority: Request priority of the instances
+    :return: Dictionary mapping org name to its WebexDeviceAPI instance
+    """
+    return {org_id: WebexDeviceAPI(get_token_provider(org_tokens_path(org_id), logger), logger, priority, org_id)
+            for org_id in org_ids}
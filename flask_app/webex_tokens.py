@@ -17,6 +17,7 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import argparse
 import json
 import os
 
@@ -24,6 +25,8 @@ from dotenv import load_dotenv
 from flask import Flask, request, redirect, session, render_template
 from requests_oauthlib import OAuth2Session
 
+import config
+
 # Initialize variables for URLs and Webex App
 PUBLIC_URL = 'http://0.0.0.0:5500'
 REDIRECT_URI = PUBLIC_URL + '/callback'
@@ -87,6 +90,14 @@ def callback():
 
 
 if __name__ == "__main__":
+    # Optional Webex org (multi-org: tokens written to the org's tokens file in WEBEX_ORGS)
+    parser = argparse.ArgumentParser(description="Generate Webex OAuth tokens")
+    parser.add_argument('--org', help="org name in WEBEX_ORGS (default: tokens.json)")
+    args = parser.parse_args()
+    if args.org:
+        tokens_path = os.path.join(script_dir, config.WEBEX_ORGS[args.org])
+        print("Writing tokens for org: ", args.org, " to ", tokens_path)
+
     # Spinning up Flask server for admin to perform OAuth
     print("Using PUBLIC_URL: ", PUBLIC_URL)
     print("Using redirect URI: ", REDIRECT_URI)
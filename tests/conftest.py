@@ -0,0 +1,66 @@
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import importlib
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# The app modules import each other by name from flask_app/
+flask_app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app')
+sys.path.insert(0, flask_app_dir)
+
+# Without a local config.py (copied from config_sample.py on deployment), run against the sample config
+if not os.path.exists(os.path.join(flask_app_dir, 'config.py')):
+    sys.modules['config'] = importlib.import_module('config_sample')
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """
+    Connection to an empty DB with every table created
+    """
+    import db
+
+    conn = db.create_connection(str(tmp_path / 'sqlite.db'))
+    db.create_tables(conn)
+    yield conn
+    db.close_connection(conn)
+
+
+@pytest.fixture
+def stand_in():
+    """
+    Local HTTP stand-in for an external API: start(handler class) serves it on a free port and returns its base URL
+    """
+    servers = []
+
+    def start(handler) -> str:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import logging
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import pytz
+
+import alerts
+
+THRESHOLDS = {'a_mos': ('below', 3.0), 'a_pkt_loss_max': ('above', 5.0)}
+START = datetime(2024, 5, 1, 10, 0, tzinfo=pytz.utc)
+BAD_CALL = {'a_mos': 2.4, 'a_pkt_loss_max': 1.0}
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    Webhook stand-in: records posted JSON bodies, answers with status
+    """
+    bodies = []
+    status = 200
+
+    def do_POST(self):
+        self.bodies.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(self.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_healthy_call_not_alerted():
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=10)
+
+    assert not engine.evaluate('device-1', 'call-1', 'history', {'a_mos': 4.1, 'a_pkt_loss_max': None}, START)
+    assert engine.take_digest(START) is None
+
+
+def test_call_alerted_once():
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=10)
+
+    assert engine.evaluate('device-1', 'call-1', 'active', BAD_CALL, START)
+    assert not engine.evaluate('device-1', 'call-1', 'active', BAD_CALL, START + timedelta(minutes=1))
+
+    # Same call completed, after the debounce period
+    assert not engine.evaluate('device-1', 'call-1', 'history', BAD_CALL, START + timedelta(minutes=30))
+
+    digest = engine.take_digest(START + timedelta(minutes=30))
+    assert digest['total'] == 1 and digest['suppressed'] == 0
+    assert digest['alerts'][0]['breaches'] == ['Audio MOS 2.4 (below 3.0)']
+
+
+def test_device_debounced():
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=10)
+
+    assert engine.evaluate('device-1', 'call-1', 'history', BAD_CALL, START)
+    assert not engine.evaluate('device-1', 'call-2', 'history', BAD_CALL, START + timedelta(minutes=5))
+    assert engine.evaluate('device-2', 'call-3', 'history', BAD_CALL, START + timedelta(minutes=5))
+    assert engine.evaluate('device-1', 'call-4', 'history', BAD_CALL, START + timedelta(minutes=15))
+
+    digest = engine.take_digest(START + timedelta(minutes=15))
+    assert [alert['call_id'] for alert in digest['alerts']] == ['call-1', 'call-3', 'call-4']
+    assert digest['suppressed'] == 1
+
+
+def test_burst_sent_as_one_digest():
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=5)
+
+    # 20 devices breaching twice each within the debounce period
+    for minute in range(2):
+        for device in range(20):
+            engine.evaluate(f'device-{device}', f'call-{device}-{minute}', 'history', BAD_CALL,
+                            START + timedelta(minutes=minute))
+
+    digest = engine.take_digest(START + timedelta(minutes=2))
+    assert len(digest['alerts']) == 5
+    assert digest['total'] == 20
+    assert digest['omitted'] == 15
+    assert digest['suppressed'] == 20
+    assert digest['debounce_minutes'] == 15
+    assert "... and 15 more call(s)" in alerts.format_digest(digest)
+
+    # Burst fully drained
+    assert engine.take_digest(START + timedelta(minutes=3)) is None
+
+
+def test_webhook_sink_posts_digest(stand_in):
+    WebhookHandler.bodies, WebhookHandler.status = [], 200
+    sink = alerts.WebhookSink(f"{stand_in(WebhookHandler)}/hooks/alerts", 5, logging.getLogger('test'))
+
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=10)
+    engine.evaluate('device-1', 'call-1', 'history', BAD_CALL, START)
+    digest = engine.take_digest(START)
+    digest['alerts'][0]['site'] = 'Building A'
+
+    assert sink.send(digest)
+    assert WebhookHandler.bodies == [dict(digest, sites={'Building A': 1})]
+
+
+def test_webhook_sink_reports_failure(stand_in):
+    WebhookHandler.bodies, WebhookHandler.status = [], 500
+    sink = alerts.WebhookSink(stand_in(WebhookHandler), 5, logging.getLogger('test'))
+
+    digest = {'org_id': 'org-1', 'time': '2024-05-01 10:00:00', 'alerts': [], 'total': 0, 'omitted': 0,
+              'suppressed': 1, 'debounce_minutes': 15}
+    assert not sink.send(digest)
+    assert len(WebhookHandler.bodies) == 1
+
+
+def test_active_call_not_alerted_again_from_history():
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=30, max_alerts=10)
+
+    # Alerted while active (xAPI call id, start estimated from the call's duration), ingested 40 minutes later under
+    # its call history id
+    assert engine.evaluate('device-1', '17', 'active', BAD_CALL, START, call_start='2024-05-01 09:54:59')
+    engine.take_digest(START + timedelta(minutes=5))
+    assert not engine.evaluate('device-1', 'history-hash', 'history', BAD_CALL, START + timedelta(minutes=40),
+                               call_start='2024-05-01 09:55:00')
+
+    # Later call of the same device still alerts
+    assert engine.evaluate('device-1', 'history-hash-2', 'history', BAD_CALL, START + timedelta(minutes=40),
+                           call_start='2024-05-01 10:20:00')
+    assert engine.take_digest(START + timedelta(minutes=45))['total'] == 1
+
+
+def test_undelivered_digest_merged_into_next():
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=2)
+
+    engine.evaluate('device-1', 'call-1', 'history', BAD_CALL, START)
+    engine.evaluate('device-1', 'call-2', 'history', BAD_CALL, START + timedelta(minutes=1))
+    first = engine.take_digest(START + timedelta(minutes=2))
+    engine.requeue('webhook', first)
+
+    engine.evaluate('device-2', 'call-3', 'history', BAD_CALL, START + timedelta(minutes=3))
+    engine.evaluate('device-3', 'call-4', 'history', BAD_CALL, START + timedelta(minutes=3))
+    second = engine.take_digest(START + timedelta(minutes=4))
+
+    # Sink which delivered the first digest only gets the new alerts, the failed sink gets both (oldest listed first)
+    assert engine.sink_digest('log', second) == second
+    merged = engine.sink_digest('webhook', second)
+    assert [alert['call_id'] for alert in merged['alerts']] == ['call-1', 'call-3']
+    assert (merged['total'], merged['omitted'], merged['suppressed']) == (3, 1, 1)
+
+    # Undelivered digest is sent again even without new alerts, once
+    engine.requeue('webhook', merged)
+    assert engine.sink_digest('webhook', None) == merged
+    assert engine.sink_digest('webhook', None) is None
+
+
+class FailingSink:
+    """
+    Sink failing its first deliveries
+    """
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.digests = []
+
+    def send(self, digest: dict) -> bool:
+        self.digests.append(digest)
+        self.failures -= 1
+        return self.failures < 0
+
+
+def test_failed_sink_digest_sent_with_next_digest(conn, monkeypatch):
+    import collector
+    import config
+    import db
+
+    log_sink, webhook_sink = FailingSink(0), FailingSink(1)
+    monkeypatch.setattr(db, 'db_path', conn.execute("PRAGMA database_list").fetchone()[2])
+    monkeypatch.setattr(config, 'ALERT_SINKS', ['log', 'webhook'])
+    monkeypatch.setitem(alerts.ALERT_SINKS, 'log', lambda api, logger: log_sink)
+    monkeypatch.setitem(alerts.ALERT_SINKS, 'webhook', lambda api, logger: webhook_sink)
+
+    engine = alerts.AlertEngine('org-1', THRESHOLDS, debounce_minutes=15, max_alerts=10)
+    monkeypatch.setitem(collector.alert_engines, 'org-1', engine)
+    api = type('API', (), {'org_id': 'org-1', 'logger': logging.getLogger('test')})()
+
+    engine.evaluate('device-1', 'call-1', 'history', BAD_CALL)
+    with pytest.raises(RuntimeError):
+        collector.send_alert_digest(api)
+
+    # Next run: the webhook gets the undelivered alert with the new one, the log sink only the new one
+    engine.evaluate('device-2', 'call-2', 'history', BAD_CALL)
+    assert collector.send_alert_digest(api) == 2
+    assert [len(digest['alerts']) for digest in log_sink.digests] == [1, 1]
+    assert [len(digest['alerts']) for digest in webhook_sink.digests] == [1, 2]
+
+    # Nothing left to send
+    assert collector.send_alert_digest(api) == 0
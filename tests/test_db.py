@@ -0,0 +1,59 @@
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import db
+
+
+def add_call(conn):
+    conn.execute("INSERT INTO call_history (call_id, device_id, start_time, org_id) VALUES "
+                 "('call-1', 'device-1', '2024-05-01 10:00:00', 'org-1')")
+    conn.commit()
+
+
+def test_restart_keeps_history_and_checkpoints(conn):
+    add_call(conn)
+    db.start_sync_checkpoint(conn, 'call_history', 0, '2024-05-01 10:00:00', 10)
+
+    db.create_tables(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM call_history").fetchone()[0] == 1
+    checkpoint = db.query_sync_checkpoint(conn, 'call_history')
+    assert checkpoint is not None and not checkpoint[6]
+
+
+def test_reset_drops_history_and_checkpoints(conn):
+    add_call(conn)
+    db.start_sync_checkpoint(conn, 'call_history', 0, '2024-05-01 10:00:00', 10)
+
+    db.create_tables(conn, reset=True)
+
+    assert conn.execute("SELECT COUNT(*) FROM call_history").fetchone()[0] == 0
+    assert db.query_sync_checkpoint(conn, 'call_history') is None
+
+
+def test_outdated_call_history_rebuilt(conn):
+    db.start_sync_checkpoint(conn, 'call_history', 0, '2024-05-01 10:00:00', 10)
+    conn.execute("DROP TABLE call_history")
+    conn.execute("CREATE TABLE call_history (call_id TEXT PRIMARY KEY, device_id TEXT, a_mos TEXT)")
+    conn.commit()
+
+    db.create_tables(conn)
+
+    columns = [entry[1] for entry in conn.execute("PRAGMA table_xinfo(call_history)").fetchall()]
+    assert 'jit_max' in columns
+    assert db.query_sync_checkpoint(conn, 'call_history') is None
@@ -0,0 +1,63 @@
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collector
+import db
+
+
+def history_entry(call_id: str, start_time: str, a_mos: float, a_loss: float) -> tuple:
+    """
+    Call history entry (call_history column order) with the columns the quality detector reads
+    """
+    return (call_id, 'device-1', 'Remote', '1000', 'Endpoint', start_time, start_time, 60, 'LocalHangup', a_mos,
+            'N/A', a_loss, 0.0, 5.0, 0.0)
+
+
+def feed(conn, entries: list[tuple]):
+    collector.update_device_quality(conn, 'device-1', 'org-1',
+                                    [collector.call_quality_observation(entry) for entry in entries])
+
+
+def test_same_calls_fed_again_leave_state_unchanged(conn):
+    entries = [history_entry(f'call-{i}', f'2024-05-01 10:{i:02d}:00', 4.2 - i * 0.01, i * 0.1) for i in range(15)]
+    feed(conn, entries)
+    state = db.query_device_quality_state(conn, 'device-1')
+    assert state[0] and state[1] == '2024-05-01 10:14:00'
+
+    # Call history rebuilt on start: the backfill comes back as new entries
+    feed(conn, entries)
+    assert db.query_device_quality_state(conn, 'device-1') == state
+
+
+def test_only_newer_calls_are_fed(conn):
+    entries = [history_entry(f'call-{i}', f'2024-05-01 10:{i:02d}:00', 4.0, 0.0) for i in range(5)]
+    feed(conn, entries[:3])
+    feed(conn, entries)
+
+    state, last_call = db.query_device_quality_state(conn, 'device-1')
+    assert state['a_mos'][3] == 5
+    assert last_call == '2024-05-01 10:04:00'
+
+
+def test_active_call_samples_keep_last_call(conn):
+    feed(conn, [history_entry('call-1', '2024-05-01 10:00:00', 4.0, 0.0)])
+    collector.update_device_quality(conn, 'device-1', 'org-1', [{'a_mos': 3.0}], update_baseline=False)
+
+    state, last_call = db.query_device_quality_state(conn, 'device-1')
+    assert state['a_mos'][2] < 4.0
+    assert last_call == '2024-05-01 10:00:00'
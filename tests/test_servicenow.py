@@ -0,0 +1,87 @@
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import logging
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import config
+import servicenow
+
+INCIDENT_COUNT = 7
+PAGE_SIZE = 3
+
+
+class IncidentTableHandler(BaseHTTPRequestHandler):
+    """
+    ServiceNow incident table API stand-in: pages of INCIDENT_COUNT incidents, the first request answered with a 503
+    """
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests.append((url.path, params))
+
+        if len(self.requests) == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        offset, limit = int(params['sysparm_offset']), int(params['sysparm_limit'])
+        fields = params['sysparm_fields'].split(',')
+        incidents = [{field: f"{field}-{i}" for field in fields} for i in range(INCIDENT_COUNT)]
+
+        body = json.dumps({'result': incidents[offset:offset + limit]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def service_now(stand_in, monkeypatch):
+    IncidentTableHandler.requests = []
+    monkeypatch.setattr(servicenow, 'SERVICENOW_INSTANCE', stand_in(IncidentTableHandler))
+    monkeypatch.setattr(servicenow, 'SERVICENOW_USERNAME', 'admin')
+    monkeypatch.setattr(servicenow, 'SERVICENOW_PASSWORD', 'password')
+    monkeypatch.setattr(config, 'SERVICE_NOW_PAGE_SIZE', PAGE_SIZE)
+    return servicenow.ServiceNow(logging.getLogger('test'))
+
+
+def test_incidents_paged_with_field_projection(service_now):
+    incidents = service_now.get_service_now_incidents(config.OPEN_SERVICE_NOW_INCIDENT_FILTER)
+
+    assert [incident['number'] for incident in incidents] == [f"number-{i}" for i in range(INCIDENT_COUNT)]
+    assert all(set(incident) == set(servicenow.INCIDENT_FIELDS) for incident in incidents)
+
+    # 503 retried, then one request per page (the short third page is the last one)
+    pages = IncidentTableHandler.requests
+    assert [params['sysparm_offset'] for _, params in pages] == ['0', '0', '3', '6']
+    for path, params in pages:
+        assert path == '/api/now/table/incident'
+        assert params['sysparm_limit'] == str(PAGE_SIZE)
+        assert params['sysparm_fields'] == ','.join(servicenow.INCIDENT_FIELDS)
+        assert params['sysparm_query'] == 'active=true^category=devices^ORDERBYsys_id'
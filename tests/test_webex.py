@@ -0,0 +1,157 @@
+"""
+Copyright (c) 2024 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import webex
+from webex import PRIORITY_BULK, PRIORITY_INTERACTIVE, RequestScheduler, TokenProvider, WebexDeviceAPI
+
+CONCURRENT_REQUESTS = 4
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_interactive_requests_overtake_queued_bulk_requests():
+    scheduler = RequestScheduler(max_concurrent=1, requests_per_second=1000, interactive_reserve=0)
+    started = []
+
+    def request(name: str, priority: int):
+        scheduler.acquire(priority)
+        started.append(name)
+        scheduler.release()
+
+    # Slot taken, three bulk requests queue up, then an interactive request
+    scheduler.acquire(PRIORITY_BULK)
+    threads = [threading.Thread(target=request, args=(f'bulk-{i}', PRIORITY_BULK)) for i in range(3)]
+    for count, thread in enumerate(threads, start=1):
+        thread.start()
+        wait_for(lambda: len(scheduler.waiting) == count)
+    interactive = threading.Thread(target=request, args=('interactive', PRIORITY_INTERACTIVE))
+    interactive.start()
+    wait_for(lambda: len(scheduler.waiting) == 4)
+
+    scheduler.release()
+    for thread in threads + [interactive]:
+        thread.join(5)
+
+    assert started == ['interactive', 'bulk-0', 'bulk-1', 'bulk-2']
+
+
+def test_bulk_requests_leave_interactive_reserve():
+    scheduler = RequestScheduler(max_concurrent=10, requests_per_second=1, interactive_reserve=2)
+
+    # Budget of 3 requests: bulk requests stop at the reserve, interactive requests may use it
+    assert scheduler.time_until_ready(PRIORITY_BULK, time.monotonic()) == 0
+    scheduler.acquire(PRIORITY_BULK)
+    assert scheduler.time_until_ready(PRIORITY_BULK, time.monotonic()) > 0
+    assert scheduler.time_until_ready(PRIORITY_INTERACTIVE, time.monotonic()) == 0
+
+
+def test_rate_limited_response_blocks_gate_for_retry_after():
+    scheduler = RequestScheduler(max_concurrent=10, requests_per_second=1000, interactive_reserve=0)
+
+    scheduler.acquire(PRIORITY_INTERACTIVE)
+    scheduler.release(retry_after=1)
+    assert scheduler.get_stats()['rate_limited_for'] > 0.5
+
+    # Every priority waits out the Retry-After
+    start = time.monotonic()
+    scheduler.acquire(PRIORITY_INTERACTIVE)
+    scheduler.release()
+    assert time.monotonic() - start >= 0.9
+
+
+class TokenCheckHandler(BaseHTTPRequestHandler):
+    """
+    Webex API stand-in accepting only the refreshed token (requests with the old token are answered with 401 once all
+    concurrent requests arrived)
+    """
+    tokens = []
+    arrived = None
+
+    def do_GET(self):
+        token = self.headers['Authorization'].split()[1]
+        self.tokens.append(token)
+        if token != 'new-token':
+            self.arrived.wait(5)
+
+        body = json.dumps({'token': token}).encode()
+        self.send_response(200 if token == 'new-token' else 401)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def token_provider(tmp_path, monkeypatch):
+    tokens_file = tmp_path / 'tokens.json'
+    tokens_file.write_text(json.dumps({'access_token': 'old-token', 'refresh_token': 'refresh', 'expires_in': 1209600,
+                                       'refresh_token_expires_in': 7776000, 'expires_at': time.time() + 1209600}))
+
+    refreshes = []
+
+    def refresh_token(tokens, logger, tokens_file):
+        refreshes.append(tokens['access_token'])
+        time.sleep(0.2)
+        return dict(tokens, access_token='new-token', expires_at=time.time() + 1209600)
+
+    monkeypatch.setattr(webex, 'refresh_token', refresh_token)
+
+    provider = TokenProvider(str(tokens_file), logging.getLogger('test'))
+    provider.refreshes = refreshes
+    yield provider
+    provider.refresh_timer.cancel()
+
+
+def test_concurrent_unauthorized_requests_refresh_token_once(stand_in, token_provider):
+    TokenCheckHandler.tokens, TokenCheckHandler.arrived = [], threading.Barrier(CONCURRENT_REQUESTS)
+    url = stand_in(TokenCheckHandler)
+
+    api = WebexDeviceAPI(token_provider, logging.getLogger('test'), org_id='test-org')
+    api.request_scheduler = RequestScheduler(CONCURRENT_REQUESTS, 1000, 0)
+
+    responses = [None] * CONCURRENT_REQUESTS
+
+    def request(index: int):
+        responses[index] = api.send_request('GET', f"{url}/v1/devices")
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(CONCURRENT_REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    # One refresh, each request retried once with the refreshed token
+    assert token_provider.refreshes == ['old-token']
+    assert all(response.status_code == 200 for response in responses)
+    assert sorted(TokenCheckHandler.tokens) == ['new-token'] * CONCURRENT_REQUESTS + ['old-token'] * CONCURRENT_REQUESTS
+    assert api.headers == {'Authorization': 'Bearer new-token'}